@@ -0,0 +1,261 @@
+# bench_monitor.py
+# Throughput benchmarks for the monitor's bus loop (emon6502.py by default).
+#
+# On Linux:  python3 bench_monitor.py [--firmware cupboard6502.py] [--save] [--tolerance 0.25]
+#            runs against simulated pins (cupboard_sim.py) with the software 65C02 on the far side of the bus.
+# On board:  copy this file as code.py next to emon6502.py, cupboard_bus.py (and bench_baseline.json, if any);
+#            results print on the console, along with a JSON line to paste into bench_baseline.json.
+#
+# Reports ns per call, calls per second and bytes allocated per call for each bus primitive, each phase of
+# cycle_clock() and cycle_clock() as a whole. With a baseline for this platform, anything slower than
+# baseline * (1 + tolerance) is reported as a REGRESSION and the run exits with status 1 (Linux).
+
+import sys
+import time
+import gc
+import json
+
+BASELINE_FILE = "bench_baseline.json"
+TOLERANCE     = 0.25   # fraction slower than baseline that counts as a regression
+
+# allocation measurement: exact bytes on CircuitPython (gc.mem_alloc with gc disabled). CPython keeps no running
+# total, so there each call's own tracemalloc peak (above what was live before it) is added up: everything a call
+# allocates, except where it frees some and allocates again within the same call.
+try:
+    _mem_alloc = gc.mem_alloc
+    tracemalloc = None
+except AttributeError:
+    _mem_alloc = None
+    import tracemalloc
+
+def _null_print (*args, **kwargs):
+    pass
+
+# on CPython, send console output to memory while timing it; the board always prints to its serial console
+def _capture_stdout ():
+    if sys.implementation.name != "cpython":
+        return None
+    import io
+    saved = sys.stdout
+    sys.stdout = io.StringIO()
+    return saved
+
+def _restore_stdout (saved):
+    if saved is not None:
+        sys.stdout = saved
+
+# bytes allocated by calls calls of fn
+def _alloc_total (fn, calls):
+    gc.collect()
+    if _mem_alloc:
+        gc.disable()
+        start = _mem_alloc()
+        for _ in range(calls):
+            fn()
+        used = _mem_alloc() - start
+        gc.enable()
+        return used
+    traced = tracemalloc.get_traced_memory
+    reset_peak = tracemalloc.reset_peak
+    tracemalloc.start()
+    used = 0
+    for _ in range(calls):
+        live = traced()[0]
+        reset_peak()
+        fn()
+        used += traced()[1] - live
+    tracemalloc.stop()
+    return used
+
+def _empty ():
+    pass
+
+# time n calls of fn (ns per call, less empty-loop overhead); allocations measured in a separate pass
+def bench (fn, n):
+    t0 = time.monotonic_ns()
+    for _ in range(n):
+        pass
+    overhead = time.monotonic_ns() - t0
+    t0 = time.monotonic_ns()
+    for _ in range(n):
+        fn()
+    elapsed = max(time.monotonic_ns() - t0 - overhead, 0)
+    calls = min(n, 100)
+    alloc = max(_alloc_total(fn, calls) - _alloc_total(_empty, calls), 0)  # less the measuring loop's own
+    return elapsed // n, alloc // calls
+
+# load the firmware: the real module on the board, or the simulated board with a software CPU on Linux
+def load_firmware (name):
+    try:
+        import board
+        return __import__(name.replace(".py", ""))
+    except ImportError:
+        import cupboard_sim
+        fw = cupboard_sim.load_firmware(name)
+        cupboard_sim.attach_cpu(fw)
+        return fw
+
+# run every benchmark against the firmware; returns [(name, ns, alloc), ...]
+def run_benchmarks (fw, scale=1):
+    results = []
+    real_print = fw.__dict__.get("print")
+    console_print = real_print if real_print is not None else print
+    fw.print = _null_print  # the firmware's own output is only measured where noted
+    # a CPU profile (cupboard_cpu.py) prints its cycles itself, switched by cpu.trace rather than the firmware's print
+    cpu = getattr(fw, "cpu", None)
+    if cpu is not None:
+        saved_trace = cpu.trace
+        cpu.trace = False
+    n = 2000 * scale
+
+    def add (name, fn, count):
+        ns, alloc = bench(fn, count)
+        results.append((name, ns, alloc))
+
+    if hasattr(fw, "calibrate_edges"):
+        fw.calibrate_edges()  # as main() does at startup
+    fw.reset_cpu()
+    fw.reset_memory()
+    fw.cycle_clock(16)  # get through the reset sequence
+    bus = fw.bus
+    buses = [(bus.backend, bus)]
+    if getattr(bus, "pin_bus", None) is not None:
+        buses.append((bus.pin_bus.backend, bus.pin_bus))
+    for label, b in buses:
+        add("read_addr_bus [%s]" % label, b.read_addr_bus, n)
+        add("read_data_bus [%s]" % label, b.read_data_bus, n)
+        add("write_data_bus [%s]" % label, lambda: b.write_data_bus(0xa5), n)
+        add("reset_data_bus [%s]" % label, b.reset_data_bus, n)
+        # consecutive reads of different bytes: the bus stays driven, half the bits change
+        values = [0xa5]
+        def drive_next ():
+            values[0] ^= 0x0f
+            b.drive_data_bus(values[0])
+        b.write_data_bus(0xa5)
+        add("drive_data_bus (driven) [%s]" % label, drive_next, n)
+        b.reset_data_bus()
+    b.reset_data_bus()
+
+    # the phases of one cycle_clock() pass; a firmware with a CPU profile (cupboard_cpu.py) reads its status lines
+    # as one word and its edges are only reachable as whole clocks
+    if cpu is not None:
+        status_pins = cpu.read_status
+    else:
+        pin_rw, pin_sync, pin_mlb, pin_vpb = fw.pin_rw, fw.pin_sync, fw.pin_mlb, fw.pin_vpb
+        def status_pins ():
+            rw_signal = pin_rw.value
+            status = "smv%d%d%d" % (1 if pin_sync.value else 0, 1 if pin_mlb.value else 0, 1 if pin_vpb.value else 0)
+    def data_phase ():
+        fw.write_data_bus(0xea)
+        fw.reset_data_bus()
+    def trace_line ():
+        console_print("%04x %s " % (0x8000, "smv100"), end='')
+        console_print("R %02x" % 0xea)
+    if cpu is not None:
+        add("phase: clock (both edges)", lambda: cpu.pulse(1), n // 2)
+    else:
+        add("phase: clock_low", fw.clock_low, n // 2)
+    add("phase: read_addr_bus", fw.read_addr_bus, n)
+    add("phase: status pins", status_pins, n)
+    if cpu is None:
+        add("phase: clock_high", fw.clock_high, n // 2)
+    add("phase: data bus (read cycle)", data_phase, n)
+    # console output: real serial output on the board, an in-memory console on Linux
+    saved = _capture_stdout()
+    add("phase: print trace line", trace_line, n // 10)
+
+    # whole cycles, with and without per-cycle printing (and trace recording, where the firmware has a trace)
+    cycles = 500 * scale
+    has_trace = hasattr(fw, "trace_verbose")
+    if has_trace:
+        fw.trace_verbose = True
+    if cpu is not None:
+        cpu.trace = True
+    add("cycle_clock (printing)", lambda: fw.cycle_clock(1), cycles // 5)
+    _restore_stdout(saved)
+    fw.print = _null_print
+    if cpu is not None:
+        cpu.trace = False
+    if has_trace:
+        fw.trace_verbose = False
+        add("cycle_clock (trace only)", lambda: fw.cycle_clock(1), cycles)
+        fw.trace_enable = False
+    add("cycle_clock (no output)", lambda: fw.cycle_clock(1), cycles)
+    if hasattr(fw, "profile_enable"):
+        fw.profile_enable = True
+        add("cycle_clock (profiling)", lambda: fw.cycle_clock(1), cycles)
+        fw.profile_enable = False
+    if has_trace:
+        fw.trace_enable = True
+
+    # monitor memory operations
+    if hasattr(fw, "dump_memory"):
+        add("dump_memory 256 bytes", lambda: fw.dump_memory(0x8000, 256), max(scale, 2))
+    add("reset_memory", fw.reset_memory, 2)
+
+    if cpu is not None:
+        cpu.trace = saved_trace
+    if real_print is None:
+        del fw.print
+    else:
+        fw.print = real_print
+    return results
+
+# print results, compare against the baseline for this platform; returns number of regressions
+def report (results, baseline, tolerance):
+    regressions = 0
+    print("%-32s %12s %12s %10s  %s" % ("benchmark", "ns/call", "calls/s", "alloc B", "vs baseline"))
+    for name, ns, alloc in results:
+        note = ""
+        if name in baseline and baseline[name] > 0:
+            ratio = ns / baseline[name]
+            note = "%+.0f%%" % ((ratio - 1) * 100)
+            if ratio > 1 + tolerance:
+                note += "  REGRESSION"
+                regressions += 1
+        print("%-32s %12d %12d %10d  %s" % (name, ns, 1e9 / ns if ns else 0, alloc, note))
+    for name, ns, alloc in results:
+        if name.startswith("cycle_clock") and ns:
+            print("%s: %.1f kHz" % (name, 1e6 / ns))
+    return regressions
+
+def load_baselines ():
+    try:
+        with open(BASELINE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def main (firmware="emon6502.py", save=False, tolerance=TOLERANCE, scale=1):
+    fw = load_firmware(firmware)
+    platform = "%s/%s" % (sys.platform, firmware)
+    results = run_benchmarks(fw, scale)
+    baselines = load_baselines()
+    regressions = report(results, baselines.get(platform, {}), tolerance)
+    if platform not in baselines and not save:
+        print("NO BASELINE for %s in %s: nothing was checked for regressions; run with --save to make one" % (platform, BASELINE_FILE))
+    current = {name: ns for name, ns, _ in results}
+    if save:
+        baselines[platform] = current
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print("Saved baseline for %s" % platform)
+    elif sys.implementation.name != "cpython":
+        print("Baseline entry for %s:" % platform)
+        print(json.dumps({platform: current}))
+    if regressions:
+        print("%d REGRESSION(S) against baseline" % regressions)
+    return regressions
+
+if __name__ == "__main__":
+    if sys.implementation.name == "cpython":
+        import argparse
+        parser = argparse.ArgumentParser(description='Cupboard monitor bus loop benchmarks')
+        parser.add_argument('--firmware', type=str, default="emon6502.py", help='firmware to benchmark')
+        parser.add_argument('--save', action="store_true", help='save results as the baseline for this platform')
+        parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown before failing')
+        parser.add_argument('--scale', type=int, default=5, help='multiply iteration counts')
+        args = parser.parse_args()
+        sys.exit(1 if main(args.firmware, args.save, args.tolerance, args.scale) else 0)
+    else:
+        main()
@@ -0,0 +1,697 @@
+# cpu65c02.py
+# Software WDC 65C02, used as a "virtual CPU" in place of the physical chip.
+#
+# One instruction-set implementation, two ways to drive it:
+#   run(cycles)       - fast path: whole instructions executed directly against a 64K memory (e.g. emulated_memory)
+#   bus_cycle(data)   - bus-level path: one clock cycle at a time, returning the address/R-W/SYNC/VPB/MLB the chip
+#                       would put on the bus, so it can sit on the far side of cycle_clock() (see cupboard_sim.py)
+#
+# Every instruction performs the same sequence of bus cycles the chip does, including dummy (internal
+# operation) cycles, so cycle counts match the WDC datasheet: page-crossing and taken-branch penalties,
+# the extra decimal-mode cycle of ADC/SBC, 7-cycle interrupt/reset sequences, WAI/STP, and the 65C02
+# one/two/three byte NOPs in the unused opcode slots. Internal-operation cycles re-read the most recent
+# program address.
+
+import cupboard_opcodes
+
+FLAG_C = 0x01  # carry
+FLAG_Z = 0x02  # zero
+FLAG_I = 0x04  # IRQ disable
+FLAG_D = 0x08  # decimal mode
+FLAG_B = 0x10  # break (only in the pushed copy of P)
+FLAG_U = 0x20  # unused, always 1
+FLAG_V = 0x40  # overflow
+FLAG_N = 0x80  # negative
+
+VECTOR_NMI = 0xfffa
+VECTOR_RES = 0xfffc
+VECTOR_IRQ = 0xfffe
+
+# (mnemonic, mode) for each of the 256 opcodes, from the shared decode table (see cupboard_opcodes.py for the modes)
+def opcode_list ():
+    return [cupboard_opcodes.opcode_name(op) for op in range(256)]
+
+# raised by the bus-level accessors when the instruction needs a bus cycle that hasn't happened yet
+class NeedCycle(Exception):
+    pass
+
+_need_cycle = NeedCycle()  # preallocated, raised once per bus cycle
+
+class CPU65C02:
+    def __init__ (self, memory=None):
+        self.memory = memory if memory is not None else bytearray(65536)
+        self.a = 0
+        self.x = 0
+        self.y = 0
+        self.sp = 0xfd
+        self.p = FLAG_U | FLAG_I
+        self.pc = 0
+        self.cycles = 0             # bus cycles executed
+        self.irq = False            # IRQB held low (level sensitive)
+        self.nmi_pending = False    # NMIB falling edge seen, not yet serviced
+        self.reset_pending = True   # run the reset sequence before the next instruction
+        self.waiting = False        # WAI: idle until an interrupt
+        self.stopped = False        # STP: idle until reset
+        self.mlb = 1                # MLB output: low during read-modify-write cycles
+        self.vpb = 1                # VPB output: low during vector fetches
+        self._ops = self._build_ops()
+        # bus-level state
+        self._log = []              # data values of the bus cycles completed so far in this instruction
+        self._i = 0                 # replay position in _log
+        self._next = None           # (addr, rw, sync, vpb, mlb, write_value) of the cycle being requested
+        self._saved = None
+        self.irq_line = False       # IRQB level as seen on the pin, latched into irq at instruction boundaries
+        self.nmi_edge = False       # NMIB falling edge seen on the pin, latched into nmi_pending at instruction boundaries
+        self.so_edge = False        # SOB falling edge seen on the pin, sets V at the next instruction boundary
+        self.use_memory()
+
+    # -------------------------------------------------------------------------------------------------------
+    # memory access: fast path (direct memory) or bus path (one bus cycle per access, replayed)
+    # -------------------------------------------------------------------------------------------------------
+
+    # fast path: accesses go straight to self.memory
+    def use_memory (self):
+        self.rd = self._mem_rd
+        self.wr = self._mem_wr
+        self.dummy = self._mem_dummy
+        self.fetch = self._mem_rd
+        self.vec = self._mem_rd
+
+    # bus path: accesses become bus cycles, see bus_cycle()
+    def use_bus (self):
+        self.rd = self._bus_rd
+        self.wr = self._bus_wr
+        self.dummy = self._bus_rd
+        self.fetch = self._bus_fetch
+        self.vec = self._bus_vec
+        self._log = []
+        self._next = None
+
+    def _mem_rd (self, addr):
+        self.cycles += 1
+        return self.memory[addr]
+
+    def _mem_wr (self, addr, value):
+        self.cycles += 1
+        self.memory[addr] = value
+
+    def _mem_dummy (self, addr):
+        self.cycles += 1
+
+    def _bus_rd (self, addr):
+        i = self._i
+        if i < len(self._log):
+            self._i = i + 1
+            return self._log[i]
+        self._next = (addr, 1, 0, self.vpb, self.mlb, 0)
+        raise _need_cycle
+
+    def _bus_fetch (self, addr):
+        i = self._i
+        if i < len(self._log):
+            self._i = i + 1
+            return self._log[i]
+        self._next = (addr, 1, 1, 1, 1, 0)
+        raise _need_cycle
+
+    def _bus_vec (self, addr):
+        self.vpb = 0
+        i = self._i
+        if i < len(self._log):
+            self._i = i + 1
+            self.vpb = 1
+            return self._log[i]
+        self._next = (addr, 1, 0, 0, 1, 0)
+        raise _need_cycle
+
+    def _bus_wr (self, addr, value):
+        i = self._i
+        if i < len(self._log):
+            self._i = i + 1
+            return
+        self._next = (addr, 0, 0, 1, self.mlb, value)
+        raise _need_cycle
+
+    def _save (self):
+        self._saved = (self.a, self.x, self.y, self.sp, self.p, self.pc, self.irq, self.nmi_pending,
+                       self.reset_pending, self.waiting, self.stopped)
+
+    def _restore (self):
+        (self.a, self.x, self.y, self.sp, self.p, self.pc, self.irq, self.nmi_pending,
+         self.reset_pending, self.waiting, self.stopped) = self._saved
+        self.mlb = 1
+        self.vpb = 1
+
+    # advance one clock cycle on the bus
+    # data: value on the data bus during the read cycle just finished (ignored after a write or at start)
+    # returns (address, rw, sync, vpb, mlb, write_value) for the next cycle; rw 1 = read, 0 = write
+    def bus_cycle (self, data=0):
+        if self._next is not None:
+            self._log.append(data if self._next[1] else self._next[5])
+            self.cycles += 1
+        while True:
+            if len(self._log) == 0:
+                # interrupt lines are sampled at instruction boundaries; edges seen mid-instruction wait until
+                # then, otherwise replaying the instruction would restore over them
+                self.irq = self.irq_line
+                if self.nmi_edge:
+                    self.nmi_pending = True
+                    self.nmi_edge = False
+                if self.so_edge:
+                    self.p |= FLAG_V
+                    self.so_edge = False
+                self._save()
+            else:
+                self._restore()
+            self._i = 0
+            try:
+                self.step()
+            except NeedCycle:
+                return self._next
+            self._log = []
+            self._next = None
+
+    # put the CPU into reset: the 7-cycle reset sequence runs on the next step
+    def reset (self):
+        self.reset_pending = True
+        self._log = []
+        self._next = None
+
+    # -------------------------------------------------------------------------------------------------------
+    # execution
+    # -------------------------------------------------------------------------------------------------------
+
+    # execute one instruction (or interrupt/reset sequence, or one idle cycle when waiting/stopped)
+    def step (self):
+        if self.reset_pending:
+            self._reset_sequence()
+        elif self.stopped:
+            self.dummy(self.pc)
+        elif self.nmi_pending:
+            self.nmi_pending = False
+            self.waiting = False
+            self.fetch(self.pc)
+            self._interrupt(VECTOR_NMI)
+        elif self.irq and (self.waiting or not (self.p & FLAG_I)):
+            self.waiting = False  # WAI with IRQs disabled simply resumes
+            if not (self.p & FLAG_I):
+                self.fetch(self.pc)
+                self._interrupt(VECTOR_IRQ)
+        elif self.waiting:
+            self.dummy(self.pc)
+        else:
+            op = self.fetch(self.pc)
+            self.pc = (self.pc + 1) & 0xffff
+            self._ops[op]()
+
+    # fast path: run at least the given number of cycles; returns total cycles executed so far
+    def run (self, cycles):
+        end = self.cycles + cycles
+        ops = self._ops
+        mem = self.memory
+        while self.cycles < end:
+            if self.reset_pending or self.stopped or self.waiting or self.nmi_pending or self.irq:
+                self.step()
+            else:
+                pc = self.pc
+                self.cycles += 1
+                self.pc = (pc + 1) & 0xffff
+                ops[mem[pc]]()
+        return self.cycles
+
+    def _reset_sequence (self):
+        self.reset_pending = False
+        self.waiting = False
+        self.stopped = False
+        pc = self.pc
+        self.dummy(pc)
+        self.dummy(pc)
+        for _ in range(3):  # three stack accesses, read only during reset
+            self.dummy(0x100 | self.sp)
+            self.sp = (self.sp - 1) & 0xff
+        self.p = (self.p | FLAG_I | FLAG_U) & ~FLAG_D
+        lo = self.vec(VECTOR_RES)
+        hi = self.vec(VECTOR_RES + 1)
+        self.vpb = 1
+        self.pc = (hi << 8) | lo
+
+    # IRQ/NMI after the discarded opcode fetch; BRK pushes B set and skips its signature byte first
+    def _interrupt (self, vector, brk=False):
+        if brk:
+            self.rd(self.pc)
+            self.pc = (self.pc + 1) & 0xffff
+        else:
+            self.dummy(self.pc)
+        self._push(self.pc >> 8)
+        self._push(self.pc & 0xff)
+        self._push((self.p | FLAG_U | FLAG_B) if brk else ((self.p | FLAG_U) & ~FLAG_B))
+        self.p = (self.p | FLAG_I) & ~FLAG_D
+        lo = self.vec(vector)
+        hi = self.vec(vector + 1)
+        self.vpb = 1
+        self.pc = (hi << 8) | lo
+
+    def _push (self, value):
+        self.wr(0x100 | self.sp, value)
+        self.sp = (self.sp - 1) & 0xff
+
+    def _pull (self):
+        self.sp = (self.sp + 1) & 0xff
+        return self.rd(0x100 | self.sp)
+
+    def _nz (self, value):
+        self.p = (self.p & 0x7d) | (value & 0x80) | (0 if value else FLAG_Z)
+
+    # -------------------------------------------------------------------------------------------------------
+    # addressing modes: return the effective address after performing the address cycles
+    # -------------------------------------------------------------------------------------------------------
+
+    def _operand (self):
+        v = self.rd(self.pc)
+        self.pc = (self.pc + 1) & 0xffff
+        return v
+
+    def _operand16 (self):
+        lo = self._operand()
+        return lo | (self._operand() << 8)
+
+    def _ea_imm (self):
+        pc = self.pc
+        self.pc = (pc + 1) & 0xffff
+        return pc
+
+    def _ea_zp (self):
+        return self._operand()
+
+    def _ea_zpx (self):
+        zp = self._operand()
+        self.dummy((self.pc - 1) & 0xffff)
+        return (zp + self.x) & 0xff
+
+    def _ea_zpy (self):
+        zp = self._operand()
+        self.dummy((self.pc - 1) & 0xffff)
+        return (zp + self.y) & 0xff
+
+    def _ea_abs (self):
+        return self._operand16()
+
+    # indexed absolute for reads: extra cycle only when the index crosses a page
+    def _ea_abx_r (self):
+        base = self._operand16()
+        ea = (base + self.x) & 0xffff
+        if (base ^ ea) & 0xff00:
+            self.dummy((self.pc - 1) & 0xffff)
+        return ea
+
+    def _ea_aby_r (self):
+        base = self._operand16()
+        ea = (base + self.y) & 0xffff
+        if (base ^ ea) & 0xff00:
+            self.dummy((self.pc - 1) & 0xffff)
+        return ea
+
+    # indexed absolute for writes: the extra cycle is always taken
+    def _ea_abx_w (self):
+        base = self._operand16()
+        self.dummy((self.pc - 1) & 0xffff)
+        return (base + self.x) & 0xffff
+
+    def _ea_aby_w (self):
+        base = self._operand16()
+        self.dummy((self.pc - 1) & 0xffff)
+        return (base + self.y) & 0xffff
+
+    def _ea_izx (self):
+        zp = self._operand()
+        self.dummy((self.pc - 1) & 0xffff)
+        ptr = (zp + self.x) & 0xff
+        lo = self.rd(ptr)
+        return lo | (self.rd((ptr + 1) & 0xff) << 8)
+
+    def _ea_izy_r (self):
+        zp = self._operand()
+        base = self.rd(zp) | (self.rd((zp + 1) & 0xff) << 8)
+        ea = (base + self.y) & 0xffff
+        if (base ^ ea) & 0xff00:
+            self.dummy((zp + 1) & 0xff)
+        return ea
+
+    def _ea_izy_w (self):
+        zp = self._operand()
+        base = self.rd(zp) | (self.rd((zp + 1) & 0xff) << 8)
+        self.dummy((zp + 1) & 0xff)
+        return (base + self.y) & 0xffff
+
+    def _ea_izp (self):
+        zp = self._operand()
+        return self.rd(zp) | (self.rd((zp + 1) & 0xff) << 8)
+
+    # -------------------------------------------------------------------------------------------------------
+    # operations
+    # -------------------------------------------------------------------------------------------------------
+
+    def _lda (self, v):
+        self.a = v
+        self._nz(v)
+
+    def _ldx (self, v):
+        self.x = v
+        self._nz(v)
+
+    def _ldy (self, v):
+        self.y = v
+        self._nz(v)
+
+    def _ora (self, v):
+        self.a |= v
+        self._nz(self.a)
+
+    def _and (self, v):
+        self.a &= v
+        self._nz(self.a)
+
+    def _eor (self, v):
+        self.a ^= v
+        self._nz(self.a)
+
+    def _compare (self, reg, v):
+        r = reg - v
+        self.p = (self.p & 0x7c) | (r & 0x80) | (0 if r else FLAG_Z) | (FLAG_C if r >= 0 else 0)
+
+    def _cmp (self, v):
+        self._compare(self.a, v)
+
+    def _cpx (self, v):
+        self._compare(self.x, v)
+
+    def _cpy (self, v):
+        self._compare(self.y, v)
+
+    def _bit (self, v):
+        self.p = (self.p & 0x3d) | (v & 0xc0) | (0 if self.a & v else FLAG_Z)
+
+    def _bit_imm (self, v):
+        self.p = (self.p & 0xfd) | (0 if self.a & v else FLAG_Z)
+
+    def _adc (self, v):
+        a = self.a
+        c = self.p & FLAG_C
+        if self.p & FLAG_D:
+            al = (a & 0x0f) + (v & 0x0f) + c
+            if al >= 0x0a:
+                al = ((al + 0x06) & 0x0f) + 0x10
+            r = (a & 0xf0) + (v & 0xf0) + al
+            s = (a & 0xf0) - (0x100 if a & 0x80 else 0) + (v & 0xf0) - (0x100 if v & 0x80 else 0) + al
+            overflow = s < -128 or s > 127
+            if r >= 0xa0:
+                r += 0x60
+        else:
+            r = a + v + c
+            overflow = (~(a ^ v) & (a ^ r) & 0x80) != 0
+        self.a = r & 0xff
+        self.p = (self.p & 0x3c) | (FLAG_C if r > 0xff else 0) | (FLAG_V if overflow else 0)
+        self._nz(self.a)
+
+    def _sbc (self, v):
+        a = self.a
+        c = self.p & FLAG_C
+        r = a - v + c - 1
+        overflow = ((a ^ v) & (a ^ r) & 0x80) != 0
+        carry = r >= 0
+        if self.p & FLAG_D:
+            al = (a & 0x0f) - (v & 0x0f) + c - 1
+            if r < 0:
+                r -= 0x60
+            if al < 0:
+                r -= 0x06
+        self.a = r & 0xff
+        self.p = (self.p & 0x3c) | (FLAG_C if carry else 0) | (FLAG_V if overflow else 0)
+        self._nz(self.a)
+
+    def _asl (self, v):
+        self.p = (self.p & 0xfe) | (v >> 7)
+        v = (v << 1) & 0xff
+        self._nz(v)
+        return v
+
+    def _lsr (self, v):
+        self.p = (self.p & 0xfe) | (v & 0x01)
+        v >>= 1
+        self._nz(v)
+        return v
+
+    def _rol (self, v):
+        c = self.p & FLAG_C
+        self.p = (self.p & 0xfe) | (v >> 7)
+        v = ((v << 1) | c) & 0xff
+        self._nz(v)
+        return v
+
+    def _ror (self, v):
+        c = self.p & FLAG_C
+        self.p = (self.p & 0xfe) | (v & 0x01)
+        v = (v >> 1) | (c << 7)
+        self._nz(v)
+        return v
+
+    def _inc (self, v):
+        v = (v + 1) & 0xff
+        self._nz(v)
+        return v
+
+    def _dec (self, v):
+        v = (v - 1) & 0xff
+        self._nz(v)
+        return v
+
+    def _tsb (self, v):
+        self.p = (self.p & 0xfd) | (0 if self.a & v else FLAG_Z)
+        return v | self.a
+
+    def _trb (self, v):
+        self.p = (self.p & 0xfd) | (0 if self.a & v else FLAG_Z)
+        return v & ~self.a & 0xff
+
+    def _branch (self, taken):
+        off = self._operand()
+        if taken:
+            pc = self.pc
+            self.dummy(pc)
+            target = (pc + off - (0x100 if off & 0x80 else 0)) & 0xffff
+            if (target ^ pc) & 0xff00:
+                self.dummy(pc)
+            self.pc = target
+
+    # -------------------------------------------------------------------------------------------------------
+    # opcode table
+    # -------------------------------------------------------------------------------------------------------
+
+    def _make_read (self, ea, op, decimal_cycle=False):
+        def handler ():
+            addr = ea()
+            op(self.rd(addr))
+            if decimal_cycle and self.p & FLAG_D:
+                self.dummy(addr)
+        return handler
+
+    def _make_write (self, ea, reg):
+        def handler ():
+            self.wr(ea(), getattr(self, reg) if reg else 0)
+        return handler
+
+    def _make_rmw (self, ea, op, always_extra=False):
+        def handler ():
+            if always_extra:
+                base = self._operand16()
+                self.dummy((self.pc - 1) & 0xffff)
+                addr = (base + self.x) & 0xffff
+            else:
+                addr = ea()
+            self.mlb = 0
+            v = self.rd(addr)
+            self.dummy(addr)
+            self.wr(addr, op(v))
+            self.mlb = 1
+        return handler
+
+    def _make_acc (self, op):
+        def handler ():
+            self.dummy(self.pc)
+            self.a = op(self.a)
+        return handler
+
+    def _make_branch (self, mask, value):
+        def handler ():
+            self._branch((self.p & mask) == value)
+        return handler
+
+    def _make_bbx (self, bit, set_):
+        def handler ():
+            zp = self._operand()
+            v = self.rd(zp)
+            self.dummy(zp)
+            self._branch(((v >> bit) & 1) == set_)
+        return handler
+
+    def _make_mb (self, bit, set_):
+        if set_:
+            return lambda v: v | (1 << bit)
+        return lambda v: v & ~(1 << bit) & 0xff
+
+    def _make_implied (self, fn):
+        def handler ():
+            self.dummy(self.pc)
+            fn()
+        return handler
+
+    def _make_push (self, reg):
+        def handler ():
+            self.dummy(self.pc)
+            self._push(self.p | FLAG_B | FLAG_U if reg == "p" else getattr(self, reg))
+        return handler
+
+    def _make_pull (self, reg):
+        def handler ():
+            self.dummy(self.pc)
+            self.dummy(0x100 | self.sp)
+            v = self._pull()
+            if reg == "p":
+                self.p = v | FLAG_U | FLAG_B
+            else:
+                setattr(self, reg, v)
+                self._nz(v)
+        return handler
+
+    def _make_nop (self, mode):
+        def nop1 ():
+            pass
+        def nop2 ():
+            self._operand()
+        def nop_imp ():
+            self.dummy(self.pc)
+        def nop_zp ():
+            self.rd(self._operand())
+        def nop_zpx ():
+            self.rd(self._ea_zpx())
+        def nop_abs ():
+            self.rd(self._operand16())
+        def nop3 ():
+            addr = self._operand16()
+            for _ in range(5):
+                self.dummy(addr)
+        return {"nop1": nop1, "nop2": nop2, "imp": nop_imp, "zp": nop_zp, "zpx": nop_zpx, "abs": nop_abs, "nop3": nop3}[mode]
+
+    def _build_ops (self):
+        ea_read = {"imm": self._ea_imm, "zp": self._ea_zp, "zpx": self._ea_zpx, "zpy": self._ea_zpy, "abs": self._ea_abs,
+                   "abx": self._ea_abx_r, "aby": self._ea_aby_r, "izx": self._ea_izx, "izy": self._ea_izy_r, "izp": self._ea_izp}
+        ea_write = {"zp": self._ea_zp, "zpx": self._ea_zpx, "zpy": self._ea_zpy, "abs": self._ea_abs,
+                    "abx": self._ea_abx_w, "aby": self._ea_aby_w, "izx": self._ea_izx, "izy": self._ea_izy_w, "izp": self._ea_izp}
+        reads = {"LDA": self._lda, "LDX": self._ldx, "LDY": self._ldy, "ORA": self._ora, "AND": self._and, "EOR": self._eor,
+                 "CMP": self._cmp, "CPX": self._cpx, "CPY": self._cpy, "BIT": self._bit, "ADC": self._adc, "SBC": self._sbc}
+        writes = {"STA": "a", "STX": "x", "STY": "y", "STZ": None}
+        rmws = {"ASL": self._asl, "LSR": self._lsr, "ROL": self._rol, "ROR": self._ror, "INC": self._inc, "DEC": self._dec,
+                "TSB": self._tsb, "TRB": self._trb}
+        branches = {"BPL": (FLAG_N, 0), "BMI": (FLAG_N, FLAG_N), "BVC": (FLAG_V, 0), "BVS": (FLAG_V, FLAG_V),
+                    "BCC": (FLAG_C, 0), "BCS": (FLAG_C, FLAG_C), "BNE": (FLAG_Z, 0), "BEQ": (FLAG_Z, FLAG_Z), "BRA": (0, 0)}
+        implied = {"CLC": lambda: self._setp(FLAG_C, 0), "SEC": lambda: self._setp(FLAG_C, FLAG_C),
+                   "CLI": lambda: self._setp(FLAG_I, 0), "SEI": lambda: self._setp(FLAG_I, FLAG_I),
+                   "CLD": lambda: self._setp(FLAG_D, 0), "SED": lambda: self._setp(FLAG_D, FLAG_D),
+                   "CLV": lambda: self._setp(FLAG_V, 0),
+                   "TAX": lambda: self._ldx(self.a), "TAY": lambda: self._ldy(self.a), "TXA": lambda: self._lda(self.x),
+                   "TYA": lambda: self._lda(self.y), "TSX": lambda: self._ldx(self.sp), "TXS": lambda: setattr(self, "sp", self.x),
+                   "INX": lambda: self._ldx((self.x + 1) & 0xff), "INY": lambda: self._ldy((self.y + 1) & 0xff),
+                   "DEX": lambda: self._ldx((self.x - 1) & 0xff), "DEY": lambda: self._ldy((self.y - 1) & 0xff)}
+        special = {"BRK": self._op_brk, "JSR": self._op_jsr, "RTS": self._op_rts, "RTI": self._op_rti, "WAI": self._op_wai,
+                   "STP": self._op_stp}
+        ops = []
+        for mnemonic, mode in opcode_list():
+            if mnemonic == "NOP":
+                ops.append(self._make_nop(mode))
+            elif mnemonic == "BIT" and mode == "imm":
+                ops.append(self._make_read(self._ea_imm, self._bit_imm))
+            elif mnemonic in reads:
+                ops.append(self._make_read(ea_read[mode], reads[mnemonic], mnemonic in ("ADC", "SBC")))
+            elif mnemonic in writes:
+                ops.append(self._make_write(ea_write[mode], writes[mnemonic]))
+            elif mnemonic in rmws and mode == "acc":
+                ops.append(self._make_acc(rmws[mnemonic]))
+            elif mnemonic in rmws:
+                # abs,x: INC/DEC always take the extra cycle, shifts/rotates only on a page cross
+                if mode == "abx" and mnemonic in ("INC", "DEC"):
+                    ops.append(self._make_rmw(None, rmws[mnemonic], True))
+                else:
+                    ops.append(self._make_rmw(ea_read[mode], rmws[mnemonic]))
+            elif mnemonic[:3] in ("RMB", "SMB"):
+                ops.append(self._make_rmw(self._ea_zp, self._make_mb(int(mnemonic[3]), mnemonic[0] == "S")))
+            elif mnemonic[:3] in ("BBR", "BBS"):
+                ops.append(self._make_bbx(int(mnemonic[3]), 1 if mnemonic[2] == "S" else 0))
+            elif mnemonic in branches:
+                ops.append(self._make_branch(*branches[mnemonic]))
+            elif mnemonic in implied:
+                ops.append(self._make_implied(implied[mnemonic]))
+            elif mnemonic[:2] == "PH":
+                ops.append(self._make_push(mnemonic[2].lower()))
+            elif mnemonic[:2] == "PL":
+                ops.append(self._make_pull(mnemonic[2].lower()))
+            elif mnemonic == "JMP":
+                ops.append({"abs": self._op_jmp, "ind": self._op_jmp_ind, "iax": self._op_jmp_iax}[mode])
+            else:
+                ops.append(special[mnemonic])
+        return ops
+
+    def _setp (self, flag, value):
+        self.p = (self.p & ~flag) | value
+
+    def _op_brk (self):
+        self._interrupt(VECTOR_IRQ, brk=True)
+
+    def _op_jsr (self):
+        lo = self._operand()
+        self.dummy(0x100 | self.sp)
+        self._push(self.pc >> 8)
+        self._push(self.pc & 0xff)
+        hi = self.rd(self.pc)
+        self.pc = (hi << 8) | lo
+
+    def _op_rts (self):
+        self.dummy(self.pc)
+        self.dummy(0x100 | self.sp)
+        lo = self._pull()
+        hi = self._pull()
+        pc = (hi << 8) | lo
+        self.dummy(pc)
+        self.pc = (pc + 1) & 0xffff
+
+    def _op_rti (self):
+        self.dummy(self.pc)
+        self.dummy(0x100 | self.sp)
+        self.p = self._pull() | FLAG_U | FLAG_B
+        lo = self._pull()
+        hi = self._pull()
+        self.pc = (hi << 8) | lo
+
+    def _op_jmp (self):
+        self.pc = self._operand16()
+
+    def _op_jmp_ind (self):
+        ptr = self._operand16()
+        self.dummy((self.pc - 1) & 0xffff)
+        lo = self.rd(ptr)
+        self.pc = lo | (self.rd((ptr + 1) & 0xffff) << 8)
+
+    def _op_jmp_iax (self):
+        ptr = (self._operand16() + self.x) & 0xffff
+        self.dummy((self.pc - 1) & 0xffff)
+        lo = self.rd(ptr)
+        self.pc = lo | (self.rd((ptr + 1) & 0xffff) << 8)
+
+    def _op_wai (self):
+        self.dummy(self.pc)
+        self.dummy(self.pc)
+        self.waiting = True
+
+    def _op_stp (self):
+        self.dummy(self.pc)
+        self.dummy(self.pc)
+        self.stopped = True
@@ -0,0 +1,86 @@
+# cupboard_break.py
+# Breakpoints and watchpoints for the Cupboard monitors, kept as 64K-bit bitmaps (one 8 KB bytearray per kind) so
+# the check in the bus loop is one indexed bit test whatever the number set.
+#
+#   BREAK_EXEC   - an opcode fetch (SYNC cycle) from the address
+#   BREAK_READ   - any other read of the address
+#   BREAK_WRITE  - a write to the address
+# A watchpoint can also carry a value: it only triggers when the data on the bus equals it. The value is looked up
+# only after the bit test has matched, so conditional watchpoints cost the loop nothing extra either.
+#
+# In the bus loop (kind chosen from the cycle's SYNC and R/W):
+#   if breaks.count and breaks.maps[kind][addr >> 3] & (1 << (addr & 7)) and breaks.hit(kind, addr, data, cycle):
+#       stop after this cycle; breaks.triggered says why
+
+BREAK_EXEC  = 0
+BREAK_READ  = 1
+BREAK_WRITE = 2
+KIND_NAMES  = ("exec", "read", "write")
+
+class Breakpoints:
+    def __init__ (self):
+        self.maps = (bytearray(8192), bytearray(8192), bytearray(8192))  # bit per address, for each kind
+        self.values = ({}, {}, {})  # value-conditional watchpoints, for each kind: {addr: value}
+        self.count = 0              # number set, 0 lets the bus loop skip the test
+        self.triggered = None       # (kind, addr, data, cycle) of the last hit, cleared by the monitor before a run
+
+    def _test (self, kind, addr):
+        return self.maps[kind][addr >> 3] & (1 << (addr & 7)) != 0
+
+    # set a breakpoint or watchpoint; value None triggers on any data
+    def set (self, kind, addr, value=None):
+        addr &= 0xffff
+        if not self._test(kind, addr):
+            self.maps[kind][addr >> 3] |= 1 << (addr & 7)
+            self.count += 1
+        if value is None:
+            self.values[kind].pop(addr, None)
+        else:
+            self.values[kind][addr] = value & 0xff
+
+    # remove one; returns False if it wasn't set
+    def clear (self, kind, addr):
+        addr &= 0xffff
+        if not self._test(kind, addr):
+            return False
+        self.maps[kind][addr >> 3] &= ~(1 << (addr & 7)) & 0xff
+        self.values[kind].pop(addr, None)
+        self.count -= 1
+        return True
+
+    def clear_all (self):
+        for kind in range(len(self.maps)):
+            m = self.maps[kind]
+            m[:] = bytes(len(m))
+            self.values[kind].clear()
+        self.count = 0
+
+    # called when the bit test matched: checks the value condition and records the hit; returns True to stop
+    def hit (self, kind, addr, data, cycle):
+        value = self.values[kind].get(addr)
+        if value is not None and value != data:
+            return False
+        self.triggered = (kind, addr, data, cycle)
+        return True
+
+    # (kind, addr, value or None) for every one set, in address order per kind
+    def list (self):
+        found = []
+        for kind in range(len(self.maps)):
+            m = self.maps[kind]
+            for i in range(len(m)):
+                if m[i]:
+                    for bit in range(8):
+                        if m[i] & (1 << bit):
+                            addr = (i << 3) | bit
+                            found.append((kind, addr, self.values[kind].get(addr)))
+        return found
+
+    # text for the last hit
+    def describe (self):
+        if self.triggered is None:
+            return "No break"
+        kind, addr, data, cycle = self.triggered
+        if kind == BREAK_EXEC:
+            return "Break at %04x, cycle %d" % (addr, cycle)
+        return "Watch %s %04x data %02x, cycle %d" % (KIND_NAMES[kind], addr, data, cycle)
@@ -0,0 +1,569 @@
+# cupboard_bus.py
+# Address/data bus access backends for the Cupboard firmwares.
+# Copy to the root of the M4 Grand Central "CIRCUITPY" drive next to the firmware that imports it.
+#
+# Used by emon6502.py and cupboard6502.py (CPU drives the address bus) and by eep.circuitpy.py (Cupboard drives it).
+#
+# Interchangeable backends share the same methods (reset_all_pins, read_addr_bus, write_addr_bus, step_addr_bus,
+# read_data_bus, write_data_bus, reset_data_bus, drive_data_bus, release_data_bus):
+#   PinBus  - one digitalio.DigitalInOut per bus line, read and written bit-by-bit (the original method)
+#   PortBus - whole words read/written through the SAMD51 PORT registers, using pin-to-bit permutation tables
+#             built once at startup; the register file can be the real chip or SimPortRegisters on a host
+# PinGroup/PortGroup (open_group()) read a few scattered input lines, such as a CPU's status outputs, as one word.
+# Both backends remember whether Cupboard is driving the data bus and with what value. drive_data_bus() only
+# changes the bits that differ from the value already driven (a run of CPU reads keeps the pins as outputs), and
+# release_data_bus() only switches them to inputs when they are outputs, so pin directions flip only when the bus
+# changes hands. write_data_bus()/reset_data_bus() always drive/release in full.
+# When Cupboard drives the address bus, step_addr_bus() sets the next address of a run. PinBus remembers the address
+# last written and writes only the lines that differ, about two per step in order instead of all of them. PortBus
+# already writes each port group in one OUTSET/OUTCLR pair, so there it is write_addr_bus().
+# On a Linux host, cupboard_sim.py installs simulated board/digitalio/supervisor/microcontroller/memorymap
+# modules, so either backend (and the firmware using it) runs unchanged against simulated pins.
+
+import array
+
+BACKEND_PIN  = "PIN"   # per-pin digitalio access
+BACKEND_PORT = "PORT"  # bulk port-register access
+
+# SAMD51 PORT peripheral: one 0x80-byte block of registers per pin group (PA, PB, PC, PD)
+SAMD51_PORT_BASE    = 0x41008000
+SAMD51_GROUP_SIZE   = 0x80
+SAMD51_NUM_GROUPS   = 4
+SAMD51_REG_DIRCLR   = 0x04
+SAMD51_REG_DIRSET   = 0x08
+SAMD51_REG_OUTCLR   = 0x14
+SAMD51_REG_OUTSET   = 0x18
+SAMD51_REG_IN       = 0x20
+
+# -----------------------------------------------------------------------------------------------------------
+# Per-pin backend
+# -----------------------------------------------------------------------------------------------------------
+class PinBus:
+    # addr_output: True when Cupboard drives the address bus (EEPROM programmer), False when the CPU does
+    def __init__ (self, addr_pins, data_pins, addr_output=False):
+        import digitalio
+        self.pins_addr = [digitalio.DigitalInOut(p) for p in addr_pins]
+        self.pins_data = [digitalio.DigitalInOut(p) for p in data_pins]
+        self.addr_output = addr_output
+        self.backend = BACKEND_PIN
+        self.data_driven = False  # data pins are outputs...
+        self.data_value = 0       # ...driving this value
+        self.addr_value = 0       # address last written (addr_output)
+        self.addr_mask = (1 << len(self.pins_addr)) - 1
+
+    # address and data buses to their default state
+    def reset_all_pins (self):
+        self.addr_value = 0
+        for p in self.pins_addr:
+            if self.addr_output:
+                p.switch_to_output(False)  # output from Cupboard, start at address 0
+            else:
+                p.switch_to_input(None)    # output from CPU = input to Cupboard, no pull
+        for p in self.pins_data:
+            p.switch_to_input(None) # initially assume output from CPU/EEPROM = input to Cupboard, no pull
+        self.data_driven = False
+
+    # set the address bus (addr_output only, pins already outputs)
+    def write_addr_bus (self, address):
+        self.addr_value = address & self.addr_mask
+        for p in self.pins_addr:
+            p.value = address & 0x01
+            address >>= 1
+
+    # set the address bus, writing only the pins whose level differs from the last address written
+    def step_addr_bus (self, address):
+        address &= self.addr_mask
+        changed = address ^ self.addr_value
+        self.addr_value = address
+        pins = self.pins_addr
+        i = 0
+        while changed:
+            if changed & 0x01:
+                pins[i].value = (address >> i) & 0x01
+            changed >>= 1
+            i += 1
+
+    # read the 16-bit address from the address bus
+    def read_addr_bus (self):
+        addr = 0
+        val = 0x0001
+        for p in self.pins_addr:
+            if (p.value):
+                addr += val
+            val <<= 1
+        return addr
+
+    # switch data bus to output mode and write value bit-by-bit
+    def write_data_bus (self, value):
+        self.data_driven = True
+        self.data_value = value
+        for p in self.pins_data:
+            p.switch_to_output(value & 0x01)
+            value >>= 1
+
+    # reset data bus to input mode after a write
+    def reset_data_bus (self):
+        self.data_driven = False
+        for p in self.pins_data:
+            p.switch_to_input(None)
+
+    # drive value on the data bus, touching only the pins whose level changes if it is already driven
+    def drive_data_bus (self, value):
+        if not self.data_driven:
+            self.write_data_bus(value)
+            return
+        changed = value ^ self.data_value
+        if changed:
+            self.data_value = value
+            for p in self.pins_data:
+                if changed & 0x01:
+                    p.value = value & 0x01
+                changed >>= 1
+                value >>= 1
+
+    # stop driving the data bus, if it is driven
+    def release_data_bus (self):
+        if self.data_driven:
+            self.reset_data_bus()
+
+    # read the data bus (assumed to be in input mode)
+    def read_data_bus (self):
+        data = 0
+        val = 0x01
+        for p in self.pins_data:
+            if (p.value):
+                data += val
+            val <<= 1
+        return data
+
+# -----------------------------------------------------------------------------------------------------------
+# Port register files
+# -----------------------------------------------------------------------------------------------------------
+
+# the real SAMD51 PORT registers, reached through memorymap (CircuitPython) or machine.mem32 (MicroPython)
+class SAMD51PortRegisters:
+    def __init__ (self):
+        try:
+            import memorymap
+            self._mem = memorymap.AddressRange(start=SAMD51_PORT_BASE, length=SAMD51_GROUP_SIZE * SAMD51_NUM_GROUPS)
+            self._mem32 = None
+        except ImportError:
+            import machine  # raises ImportError when neither method is available
+            self._mem = None
+            self._mem32 = machine.mem32
+
+    def _read (self, offset):
+        if self._mem32 is not None:
+            return self._mem32[SAMD51_PORT_BASE + offset]
+        return int.from_bytes(self._mem[offset:offset + 4], "little")
+
+    def _write (self, offset, value):
+        if self._mem32 is not None:
+            self._mem32[SAMD51_PORT_BASE + offset] = value
+        else:
+            self._mem[offset:offset + 4] = value.to_bytes(4, "little")
+
+    def read_in (self, group):
+        return self._read(group * SAMD51_GROUP_SIZE + SAMD51_REG_IN)
+
+    def write_outset (self, group, mask):
+        self._write(group * SAMD51_GROUP_SIZE + SAMD51_REG_OUTSET, mask)
+
+    def write_outclr (self, group, mask):
+        self._write(group * SAMD51_GROUP_SIZE + SAMD51_REG_OUTCLR, mask)
+
+    def write_dirset (self, group, mask):
+        self._write(group * SAMD51_GROUP_SIZE + SAMD51_REG_DIRSET, mask)
+
+    def write_dirclr (self, group, mask):
+        self._write(group * SAMD51_GROUP_SIZE + SAMD51_REG_DIRCLR, mask)
+
+# host-side stand-in for the PORT registers: Cupboard's own DIR/OUT latches plus whatever the far side drives
+class SimPortRegisters:
+    def __init__ (self, num_groups=SAMD51_NUM_GROUPS):
+        self.dir = [0] * num_groups         # 1 = Cupboard drives the line
+        self.out = [0] * num_groups         # value Cupboard drives
+        self.ext_drive = [0] * num_groups   # 1 = far side (CPU, EEPROM, test code) drives the line
+        self.ext_value = [0] * num_groups   # value the far side drives
+
+    def read_in (self, group):
+        d = self.dir[group]
+        return (self.out[group] & d) | (self.ext_value[group] & self.ext_drive[group] & ~d)
+
+    def write_outset (self, group, mask):
+        self.out[group] |= mask
+
+    def write_outclr (self, group, mask):
+        self.out[group] &= ~mask
+
+    def write_dirset (self, group, mask):
+        self.dir[group] |= mask
+
+    def write_dirclr (self, group, mask):
+        self.dir[group] &= ~mask
+
+    # lines driven by both sides at once
+    def contention (self, group):
+        return self.dir[group] & self.ext_drive[group]
+
+# -----------------------------------------------------------------------------------------------------------
+# Bulk port backend
+# -----------------------------------------------------------------------------------------------------------
+
+# group a list of (group, bit) port locations, one per bus bit, into {group: [(bus_bit, port_bit), ...]}
+def group_port_bits (port_bits):
+    groups = {}
+    for bus_bit, (group, bit) in enumerate(port_bits):
+        groups.setdefault(group, []).append((bus_bit, bit))
+    return groups
+
+# tables that turn a raw port register value into a bus value: [(group, [(shift, table256), ...]), ...]
+# only byte lanes that carry at least one bus line get a table
+def build_read_tables (port_bits):
+    tables = []
+    for group, bits in sorted(group_port_bits(port_bits).items()):
+        lanes = []
+        for lane in range(4):
+            lane_bits = [(bus_bit, bit - lane * 8) for bus_bit, bit in bits if lane * 8 <= bit < lane * 8 + 8]
+            if len(lane_bits) == 0:
+                continue
+            table = array.array('L', [0] * 256)
+            for v in range(256):
+                word = 0
+                for bus_bit, lane_bit in lane_bits:
+                    if v & (1 << lane_bit):
+                        word |= 1 << bus_bit
+                table[v] = word
+            lanes.append((lane * 8, table))
+        tables.append((group, lanes))
+    return tables
+
+# tables that turn a bus value into the port bits to set: [(group, mask, [(shift, table256), ...]), ...]
+# one table per byte of the bus value that has lines in the group
+def build_write_tables (port_bits):
+    tables = []
+    for group, bits in sorted(group_port_bits(port_bits).items()):
+        mask = 0
+        for _, bit in bits:
+            mask |= 1 << bit
+        lanes = []
+        for lane in range((len(port_bits) + 7) // 8):
+            lane_bits = [(bus_bit - lane * 8, bit) for bus_bit, bit in bits if lane * 8 <= bus_bit < lane * 8 + 8]
+            if len(lane_bits) == 0:
+                continue
+            table = array.array('L', [0] * 256)
+            for v in range(256):
+                word = 0
+                for lane_bit, bit in lane_bits:
+                    if v & (1 << lane_bit):
+                        word |= 1 << bit
+                table[v] = word
+            lanes.append((lane * 8, table))
+        tables.append((group, mask, lanes))
+    return tables
+
+class PortBus:
+    # addr_bits/data_bits: (group, bit) port location of each bus line, least-significant bus bit first
+    # registers: SAMD51PortRegisters on the board or SimPortRegisters on a host
+    # pin_bus: optional PinBus on the same pins, kept so the pins stay claimed and configured as GPIO
+    def __init__ (self, addr_bits, data_bits, registers, pin_bus=None):
+        self.registers = registers
+        self.pin_bus = pin_bus
+        self.pins_addr = pin_bus.pins_addr if pin_bus else []
+        self.pins_data = pin_bus.pins_data if pin_bus else []
+        self.backend = BACKEND_PORT
+        self.addr_output = pin_bus.addr_output if pin_bus else False
+        self._addr_read = build_read_tables(addr_bits)
+        self._addr_write = build_write_tables(addr_bits)
+        self._data_read = build_read_tables(data_bits)
+        self._data_write = build_write_tables(data_bits)
+        self._read_in = registers.read_in
+        self._outset = registers.write_outset
+        self._outclr = registers.write_outclr
+        self._dirset = registers.write_dirset
+        self._dirclr = registers.write_dirclr
+        self.data_driven = False  # data lines are outputs...
+        self.data_value = 0       # ...driving this value
+
+    # address and data buses to their default state
+    def reset_all_pins (self):
+        if self.pin_bus:
+            self.pin_bus.reset_all_pins()
+            self.data_driven = False
+        else:
+            for group, mask, _ in self._addr_write:
+                if self.addr_output:
+                    self._outclr(group, mask)
+                    self._dirset(group, mask)
+                else:
+                    self._dirclr(group, mask)
+            self.reset_data_bus()
+
+    # read the 16-bit address from the address bus, one register read per port group
+    def read_addr_bus (self):
+        addr = 0
+        for group, lanes in self._addr_read:
+            reg = self._read_in(group)
+            for shift, table in lanes:
+                addr |= table[(reg >> shift) & 0xff]
+        return addr
+
+    # set the address bus (addr_output only, pins already outputs)
+    def write_addr_bus (self, address):
+        for group, mask, lanes in self._addr_write:
+            bits = 0
+            for shift, table in lanes:
+                bits |= table[(address >> shift) & 0xff]
+            self._outset(group, bits)
+            self._outclr(group, mask ^ bits)
+
+    # the next address of a run: an OUTSET/OUTCLR pair per group already sets every line at once, and finding the
+    # lines that changed would cost a second table lookup per lane, so this is write_addr_bus
+    step_addr_bus = write_addr_bus
+
+    # set the data bus value, then switch it to output mode
+    def write_data_bus (self, value):
+        self.data_driven = True
+        self.data_value = value
+        for group, mask, lanes in self._data_write:
+            bits = lanes[0][1][value]
+            self._outset(group, bits)
+            self._outclr(group, mask ^ bits)
+            self._dirset(group, mask)
+
+    # reset data bus to input mode after a write
+    def reset_data_bus (self):
+        self.data_driven = False
+        for group, mask, _ in self._data_write:
+            self._dirclr(group, mask)
+
+    # drive value on the data bus; if it is already driven, write only the groups and bits whose level changes
+    def drive_data_bus (self, value):
+        if not self.data_driven:
+            self.write_data_bus(value)
+            return
+        changed = value ^ self.data_value
+        if changed:
+            self.data_value = value
+            for group, mask, lanes in self._data_write:
+                table = lanes[0][1]
+                flip = table[changed]
+                if flip:
+                    bits = table[value]
+                    if bits & flip:
+                        self._outset(group, bits & flip)
+                    if ~bits & flip:
+                        self._outclr(group, ~bits & flip)
+
+    # stop driving the data bus, if it is driven
+    def release_data_bus (self):
+        if self.data_driven:
+            self.reset_data_bus()
+
+    # read the data bus (assumed to be in input mode)
+    def read_data_bus (self):
+        data = 0
+        for group, lanes in self._data_read:
+            reg = self._read_in(group)
+            for shift, table in lanes:
+                data |= table[(reg >> shift) & 0xff]
+        return data
+
+# -----------------------------------------------------------------------------------------------------------
+# Input groups: a handful of CPU status lines read as one word
+# -----------------------------------------------------------------------------------------------------------
+
+# per-pin group: ios are the lines' DigitalInOut, least-significant first
+class PinGroup:
+    def __init__ (self, ios):
+        self.ios = ios
+
+    def read (self):
+        value = 0
+        bit = 1
+        for p in self.ios:
+            if p.value:
+                value |= bit
+            bit <<= 1
+        return value
+
+# port group: one register read per port group, through the same permutation tables as the buses
+class PortGroup:
+    def __init__ (self, port_bits, registers):
+        self._tables = build_read_tables(port_bits)
+        self._read_in = registers.read_in
+
+    def read (self):
+        value = 0
+        for group, lanes in self._tables:
+            reg = self._read_in(group)
+            for shift, table in lanes:
+                value |= table[(reg >> shift) & 0xff]
+        return value
+
+# -----------------------------------------------------------------------------------------------------------
+# Backend selection
+# -----------------------------------------------------------------------------------------------------------
+
+# map a board pin to its (group, bit) port location by finding its PAxx..PDxx name in microcontroller.pin
+def port_bit (pin):
+    import microcontroller
+    for name in dir(microcontroller.pin):
+        if len(name) == 4 and name[0] == 'P' and name[1] in "ABCD" and getattr(microcontroller.pin, name) is pin:
+            return (ord(name[1]) - ord('A'), int(name[2:]))
+    raise ValueError("pin has no port location")
+
+# open the requested bus backend on the given board pins; falls back to per-pin access if port access is unavailable
+def open_bus (addr_pins, data_pins, backend=BACKEND_PORT, addr_output=False):
+    pin_bus = PinBus(addr_pins, data_pins, addr_output)
+    if backend == BACKEND_PORT:
+        try:
+            registers = SAMD51PortRegisters()
+            return PortBus([port_bit(p) for p in addr_pins], [port_bit(p) for p in data_pins], registers, pin_bus)
+        except (ImportError, ValueError) as e:
+            print("Port bus unavailable (%s), using per-pin bus" % e)
+    return pin_bus
+
+# read the lines on the given board pins (already claimed as the DigitalInOut ios) as one word, with the same
+# access method as bus
+def open_group (pins, ios, bus):
+    if bus.backend == BACKEND_PORT:
+        try:
+            return PortGroup([port_bit(p) for p in pins], bus.registers)
+        except ValueError:
+            pass
+    return PinGroup(ios)
+
+# -----------------------------------------------------------------------------------------------------------
+# Host self-check: python3 cupboard_bus.py
+# -----------------------------------------------------------------------------------------------------------
+def main ():
+    import time
+    # a deliberately scattered layout across three groups, like the emon pin map
+    addr_bits = [(1, 15), (1, 14), (2, 13), (2, 12), (2, 15), (2, 14), (2, 11), (2, 10),
+                 (0, 23), (0, 22), (0, 21), (0, 20), (0, 19), (0, 18), (0, 17), (0, 16)]
+    data_bits = [(3, 12), (0, 15), (2, 17), (2, 16), (0, 12), (0, 13), (0, 14), (1, 19)]
+    regs = SimPortRegisters()
+    bus = PortBus(addr_bits, data_bits, regs)
+    # far side drives every address, Cupboard reads it back
+    for addr in range(65536):
+        for g in range(SAMD51_NUM_GROUPS):
+            regs.ext_drive[g] = 0
+            regs.ext_value[g] = 0
+        for bus_bit, (g, bit) in enumerate(addr_bits):
+            regs.ext_drive[g] |= 1 << bit
+            if addr & (1 << bus_bit):
+                regs.ext_value[g] |= 1 << bit
+        assert bus.read_addr_bus() == addr, "address %04x" % addr
+    # Cupboard drives every address (EEPROM programmer direction)
+    for addr in range(65536):
+        bus.write_addr_bus(addr)
+        for bus_bit, (g, bit) in enumerate(addr_bits):
+            assert ((regs.out[g] >> bit) & 1) == ((addr >> bus_bit) & 1), "address out %04x" % addr
+    # PinBus: stepping through addresses in order and at random writes only the lines that change
+    class OutPin:
+        writes = 0
+        def __init__ (self):
+            self.level = 0
+        def _get (self):
+            return self.level
+        def _set (self, level):
+            OutPin.writes += 1
+            self.level = 1 if level else 0
+        value = property(_get, _set)
+    pin_bus = PinBus.__new__(PinBus)
+    pin_bus.pins_addr = [OutPin() for _ in range(15)]
+    pin_bus.addr_mask = 0x7fff
+    pin_bus.write_addr_bus(0)
+    OutPin.writes = 0
+    import random
+    rng = random.Random(28256)
+    for addr in list(range(32768)) + [rng.randrange(32768) for _ in range(10000)]:
+        pin_bus.step_addr_bus(addr)
+        for bus_bit, p in enumerate(pin_bus.pins_addr):
+            assert p.level == (addr >> bus_bit) & 1, "address step %04x" % addr
+    print("PinBus step_addr_bus: %d pin writes for 32768 sequential and 10000 random addresses (write_addr_bus: %d)" % (
+        OutPin.writes, 15 * 42768))
+    # Cupboard drives every data value, then releases the bus
+    for g in range(SAMD51_NUM_GROUPS):
+        regs.ext_drive[g] = 0
+    for v in range(256):
+        bus.write_data_bus(v)
+        assert bus.read_data_bus() == v, "data %02x" % v
+        bus.reset_data_bus()
+        assert all(d == 0 for d in regs.dir), "data bus not released"
+    # CPU cycles against the caching driver: Cupboard answers reads, the CPU drives writes during PHI2 high.
+    # Cupboard must have let go of the data bus before the CPU drives it, the data must read back on both kinds
+    # of cycle, and directions may only change when R/W does
+    rng = random.Random(6502)
+    dir_writes = [0]
+    def counting (write):
+        def counted (group, mask):
+            dir_writes[0] += 1
+            write(group, mask)
+        return counted
+    regs.write_dirset = counting(regs.write_dirset)
+    regs.write_dirclr = counting(regs.write_dirclr)
+    bus = PortBus(addr_bits, data_bits, regs)
+    data_mask = {}
+    for bus_bit, (g, bit) in enumerate(data_bits):
+        data_mask[g] = data_mask.get(g, 0) | (1 << bit)
+    data_groups = sorted(data_mask)
+    rw_changes = 0
+    last_rw = 1
+    for n in range(20000):
+        rw = 1 if rng.random() < 0.8 else 0  # mostly reads, in runs, like a CPU
+        value = rng.randrange(256)
+        if rw != last_rw:
+            rw_changes += 1
+        last_rw = rw
+        # PHI2 low: R/W is known, the monitor releases the bus if the CPU will write
+        if not rw:
+            bus.release_data_bus()
+        # PHI2 high
+        if rw:
+            bus.drive_data_bus(value)
+        else:
+            for bus_bit, (g, bit) in enumerate(data_bits):
+                regs.ext_drive[g] |= 1 << bit
+                if value & (1 << bus_bit):
+                    regs.ext_value[g] |= 1 << bit
+                else:
+                    regs.ext_value[g] &= ~(1 << bit)
+        for g in data_groups:
+            assert regs.contention(g) == 0, "contention on cycle %d" % n
+        assert bus.read_data_bus() == value, "data %02x on cycle %d" % (value, n)
+        # PHI2 falls: the CPU stops driving write data
+        for g in data_groups:
+            regs.ext_drive[g] &= ~data_mask[g]
+    assert dir_writes[0] <= (rw_changes + 1) * len(data_groups), "%d direction writes for %d R/W changes" % (dir_writes[0], rw_changes)
+    print("%d cycles, %d R/W changes, %d direction register writes, no contention" % (n + 1, rw_changes, dir_writes[0]))
+    bus.release_data_bus()
+    # rough host timing
+    n = 100000
+    start_ns = time.monotonic_ns()
+    for _ in range(n):
+        bus.read_addr_bus()
+    elapsed = time.monotonic_ns() - start_ns
+    print("read_addr_bus: %d ns/call" % (elapsed // n))
+    start_ns = time.monotonic_ns()
+    for _ in range(n):
+        bus.write_data_bus(0xa5)
+        bus.reset_data_bus()
+    elapsed = time.monotonic_ns() - start_ns
+    print("write_data_bus+reset_data_bus: %d ns/call" % (elapsed // n))
+    start_ns = time.monotonic_ns()
+    for v in range(n):
+        bus.drive_data_bus(v & 0xff)
+    elapsed = time.monotonic_ns() - start_ns
+    bus.release_data_bus()
+    print("drive_data_bus (bus already driven): %d ns/call" % (elapsed // n))
+    start_ns = time.monotonic_ns()
+    for a in range(n):
+        bus.write_addr_bus(a & 0xffff)
+    elapsed = time.monotonic_ns() - start_ns
+    print("write_addr_bus (sequential): %d ns/call" % (elapsed // n))
+    print("PortBus OK")
+
+if __name__ == "__main__":
+    main()
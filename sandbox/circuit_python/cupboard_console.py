@@ -0,0 +1,75 @@
+# cupboard_console.py
+# Emulated serial console device for programs running under the Cupboard monitors.
+#
+# Four registers from the device's base address:
+#   +0 TX      write: character out
+#   +1 RX      read:  next character in (0 when empty)
+#   +2 STATUS  read:  bit 0 = RX character waiting, bit 1 = TX ready (always, output is buffered)
+#   +3         reads 0
+# Output is collected in a buffer and written to the serial console in chunks (when the buffer fills, or when
+# the monitor calls flush()), instead of one formatted print per bus cycle. Input comes from the monitor
+# (receive()) and waits in a ring buffer until the program reads RX.
+
+import cupboard_trace
+
+CONSOLE_TX     = 0
+CONSOLE_RX     = 1
+CONSOLE_STATUS = 2
+
+STATUS_RX_READY = 0x01
+STATUS_TX_READY = 0x02
+
+class ConsoleDevice:
+    def __init__ (self, name, tx_size=64, rx_size=256):
+        self.name = name
+        self.tx = bytearray(tx_size)
+        self.tx_count = 0
+        self.rx = bytearray(rx_size)  # ring buffer, rx_size must be a power of two
+        self.rx_mask = rx_size - 1
+        self.rx_head = 0   # next slot to fill
+        self.rx_tail = 0   # next character to read
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def read (self, addr):
+        reg = addr & 3
+        if reg == CONSOLE_RX:
+            if self.rx_head == self.rx_tail:
+                return 0
+            value = self.rx[self.rx_tail]
+            self.rx_tail = (self.rx_tail + 1) & self.rx_mask
+            return value
+        if reg == CONSOLE_STATUS:
+            return STATUS_TX_READY | (STATUS_RX_READY if self.rx_head != self.rx_tail else 0)
+        return 0
+
+    def write (self, addr, value):
+        if addr & 3 == CONSOLE_TX:
+            self.tx[self.tx_count] = value
+            self.tx_count += 1
+            self.bytes_out += 1
+            if self.tx_count == len(self.tx):
+                self.flush()
+
+    # send buffered output to the serial console
+    def flush (self):
+        if self.tx_count > 0:
+            cupboard_trace.write_binary(memoryview(self.tx)[:self.tx_count])
+            self.tx_count = 0
+
+    # queue input for the program; returns the number of characters that didn't fit
+    def receive (self, data):
+        dropped = 0
+        for c in data:
+            head = (self.rx_head + 1) & self.rx_mask
+            if head == self.rx_tail:
+                dropped += 1
+            else:
+                self.rx[self.rx_head] = c
+                self.rx_head = head
+                self.bytes_in += 1
+        return dropped
+
+    # characters waiting to be read
+    def pending (self):
+        return (self.rx_head - self.rx_tail) & self.rx_mask
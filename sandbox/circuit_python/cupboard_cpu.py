@@ -0,0 +1,532 @@
+# cupboard_cpu.py
+# CPU profiles for cupboard6502.py, and the bus cycle engine built from them.
+# Copy to the root of the M4 Grand Central "CIRCUITPY" drive next to the firmware that imports it.
+#
+# A CpuProfile is data only:
+#   - pin map: the board pin of every address, data and control line of the CPU socket adapter
+#   - polarity: the active level of each status output (read by Cupboard) and control input (driven by Cupboard)
+#   - cycle classification: the status signals that make a cycle an opcode fetch, memory read or write, I/O read
+#     or write or interrupt acknowledge; anything else is idle (internal, refresh, bus released)
+#   - bus style: how the clock relates to bus cycles
+#       STYLE_PHI2       one bus cycle per clock, address valid after PHI2 falls, data in PHI2 high (65C02)
+#       STYLE_QUADRATURE one bus cycle per E clock, with Q a quarter cycle ahead (6809E)
+#       STYLE_STROBE     accesses marked by strobes lasting several clocks (Z80 MREQ/IORQ/RD/WR/M1)
+#   - reset sequence: lines to assert, clocks to give and lines to release
+#
+# CpuBus opens a profile's pins and specialise() turns it into run(cycles), a closure built by its style's
+# builder with everything it needs bound to locals. The status lines are read as one word (one register read per
+# port group with the port bus), and a table indexed by that word gives the cycle kind with polarity already
+# applied, so adding a CPU adds table entries and at most a builder, never a test in the loop.
+# Cycle rules are strings of status names: "NAME" active, "!NAME" inactive, "^NAME" active on the previous cycle
+# (the profile's `previous` signal, e.g. the 6809E's LIC: the cycle after the last cycle of an instruction is
+# the next opcode fetch).
+
+import cupboard_bus
+import cupboard_events
+import cupboard_timing
+
+STYLE_PHI2       = "PHI2"
+STYLE_QUADRATURE = "QUADRATURE"
+STYLE_STROBE     = "STROBE"
+
+# cycle kinds; from CYCLE_FETCH up Cupboard answers the cycle and drives the data bus
+CYCLE_IDLE     = 0
+CYCLE_WRITE    = 1
+CYCLE_IO_WRITE = 2
+CYCLE_FETCH    = 3
+CYCLE_READ     = 4
+CYCLE_IO_READ  = 5
+CYCLE_ACK      = 6
+KIND_NAMES = ("IDLE", "WRITE", "IO_WRITE", "FETCH", "READ", "IO_READ", "ACK")
+
+class CpuProfile:
+    # status: ((signal, active level, trace letter or None), ...) CPU outputs, least-significant status bit first
+    # controls: ((signal, active level), ...) CPU inputs Cupboard drives, also the lines events can use
+    # clocks: ((signal, idle level), ...) clock inputs, driven by Cupboard
+    # cycles: ((kind name, rule), ...) first matching rule wins
+    # reset: (("assert", signal) | ("clocks", count) | ("release", signal), ...)
+    def __init__ (self, name, family, style, addr_pins, data_pins, pins, status, controls, clocks, cycles, reset,
+                  nop, step_limit, timing, previous=None, ack_value=0xff):
+        self.name = name
+        self.family = family           # instruction set, for the disassembler: "6502", "Z80", "6809"
+        self.style = style
+        self.addr_pins = addr_pins     # board pin names, A0 first
+        self.data_pins = data_pins     # board pin names, D0 first
+        self.pins = pins               # signal: board pin name
+        self.status = status
+        self.controls = controls
+        self.clocks = clocks
+        self.cycles = cycles
+        self.reset = reset
+        self.nop = nop                 # opcode memory is filled with
+        self.step_limit = step_limit   # clocks to wait for the next opcode fetch when stepping
+        self.timing = timing           # cupboard_timing profile
+        self.previous = previous       # status signal also seen by rules one cycle later (^NAME)
+        self.ack_value = ack_value     # data answered to an interrupt acknowledge (Z80: RST 38h)
+
+ADDR_PINS = ("D30", "D31", "D32", "D33", "D34", "D35", "D36", "D37", "D38", "D39", "D40", "D41", "D42", "D43", "D44", "D45")
+DATA_PINS = ("D46", "D47", "D48", "D49", "D50", "D51", "D52", "D53")
+
+PROFILES = {
+    "65C02": CpuProfile("65C02", "6502", STYLE_PHI2, ADDR_PINS, DATA_PINS,
+        {"SYNC": "D19", "NMI": "D20", "MLB": "D21", "IRQ": "D22", "RDY": "D23", "VPB": "D24", "RST": "D25",
+         "SO": "D26", "PHI2": "D27", "BE": "D28", "RW": "D29"},
+        (("RW", 1, None), ("SYNC", 1, "s"), ("MLB", 0, "m"), ("VPB", 0, "v")),
+        (("IRQ", 0), ("NMI", 0), ("RDY", 0), ("SO", 0), ("RST", 0), ("BE", 0)),
+        (("PHI2", 1),),
+        (("FETCH", "SYNC RW"), ("READ", "RW"), ("WRITE", "!RW")),
+        (("assert", "RST"), ("clocks", 3), ("release", "RST")),
+        0xea, 16, "65C02"),
+    "Z80": CpuProfile("Z80", "Z80", STYLE_STROBE, ADDR_PINS, DATA_PINS,
+        {"M1": "D19", "NMI": "D20", "MREQ": "D21", "INT": "D22", "WAIT": "D23", "IORQ": "D24", "RESET": "D25",
+         "BUSRQ": "D26", "CLK": "D27", "RD": "D28", "WR": "D29", "RFSH": "D18", "HALT": "D17", "BUSAK": "D16"},
+        (("M1", 0, "m"), ("MREQ", 0, "q"), ("IORQ", 0, "i"), ("RD", 0, "r"), ("WR", 0, "w"), ("RFSH", 0, "f"),
+         ("HALT", 0, "h"), ("BUSAK", 0, None)),
+        (("INT", 0), ("NMI", 0), ("WAIT", 0), ("BUSRQ", 0), ("RESET", 0)),
+        (("CLK", 0),),
+        (("IDLE", "BUSAK"), ("ACK", "M1 IORQ"), ("FETCH", "M1 MREQ RD"), ("READ", "MREQ RD !RFSH"),
+         ("WRITE", "MREQ WR"), ("IO_READ", "IORQ RD"), ("IO_WRITE", "IORQ WR")),
+        (("assert", "RESET"), ("clocks", 4), ("release", "RESET")),
+        0x00, 32, "Z80"),
+    "6809E": CpuProfile("6809E", "6809", STYLE_QUADRATURE, ADDR_PINS, DATA_PINS,
+        {"BS": "D19", "NMI": "D20", "BA": "D21", "IRQ": "D22", "HALT": "D23", "LIC": "D24", "RESET": "D25",
+         "FIRQ": "D26", "E": "D27", "Q": "D28", "RW": "D29", "AVMA": "D18", "BUSY": "D17", "TSC": "D16"},
+        (("RW", 1, None), ("BS", 1, "s"), ("BA", 1, "a"), ("LIC", 1, "l"), ("AVMA", 1, "v"), ("BUSY", 1, "b")),
+        (("IRQ", 0), ("FIRQ", 0), ("NMI", 0), ("HALT", 0), ("RESET", 0), ("TSC", 1)),
+        (("E", 0), ("Q", 0)),
+        (("IDLE", "BA"), ("FETCH", "RW ^LIC"), ("READ", "RW"), ("WRITE", "!RW")),
+        (("assert", "RESET"), ("clocks", 4), ("release", "RESET")),
+        0x12, 24, "6809E", previous="LIC"),
+}
+
+# kind table: status word (plus the previous-cycle bit, if the profile has one) -> cycle kind
+def build_kinds (profile):
+    names = [s[0] for s in profile.status]
+    n = len(names)
+    rules = []
+    for kind_name, rule in profile.cycles:
+        need = []
+        for token in rule.split():
+            if token[0] == '^':
+                if token[1:] != profile.previous:
+                    raise ValueError("%s: %s is not the previous-cycle signal" % (profile.name, token))
+                need.append((n, 1))
+            elif token[0] == '!':
+                need.append((names.index(token[1:]), 0))
+            else:
+                need.append((names.index(token), 1))
+        rules.append((KIND_NAMES.index(kind_name), need))
+    size = 1 << (n + 1 if profile.previous else n)
+    kinds = bytearray(size)
+    for word in range(size):
+        for kind, need in rules:
+            matched = True
+            for bit, want in need:
+                level = (word >> bit) & 1
+                active = level if bit == n else level == profile.status[bit][1]
+                if active != want:
+                    matched = False
+                    break
+            if matched:
+                kinds[word] = kind
+                break
+    return kinds
+
+# trace text for every status word: the raw level of each status line that has a trace letter
+def build_status_text (profile):
+    texts = []
+    for word in range(1 << len(profile.status)):
+        text = ""
+        for bit, (_, _, letter) in enumerate(profile.status):
+            if letter is not None:
+                text += "%s%d " % (letter, (word >> bit) & 1)
+        texts.append(text)
+    return texts
+
+# a clock edge function, waiting spins empty loop passes after the pin write if the CPU needs it
+def clock_edge (pin, level, spins):
+    if spins == 0:
+        def edge ():
+            pin.value = level
+    else:
+        def edge ():
+            pin.value = level
+            for _ in range(spins):
+                pass
+    return edge
+
+class CpuBus:
+    # memory: the emulated 64K image; device: a 4-register device (read(addr)/write(addr, value), see
+    # cupboard_console.py) at device_address in memory, and at port_address in the I/O space of CPUs that have one
+    def __init__ (self, name, memory, device=None, device_address=-1, port_address=-1, backend=cupboard_bus.BACKEND_PORT):
+        import board
+        import digitalio
+        if name not in PROFILES:
+            raise ValueError("no CPU profile %s (%s)" % (name, " ".join(sorted(PROFILES))))
+        profile = PROFILES[name]
+        self.profile = profile
+        self.memory = memory
+        self.device = device
+        self.device_block = device_address >> 2 if device_address >= 0 else -1
+        self.port_block = (port_address & 0xff) >> 2 if port_address >= 0 else -1
+        self.bus = cupboard_bus.open_bus([getattr(board, p) for p in profile.addr_pins],
+                                         [getattr(board, p) for p in profile.data_pins], backend)
+        self.pins = {}
+        for signal, pin in profile.pins.items():
+            self.pins[signal] = digitalio.DigitalInOut(getattr(board, pin))
+        self.status_group = cupboard_bus.open_group([getattr(board, profile.pins[s[0]]) for s in profile.status],
+                                                    [self.pins[s[0]] for s in profile.status], self.bus)
+        self.read_status = self.status_group.read
+        self.kinds = build_kinds(profile)
+        self.status_text = build_status_text(profile)
+        # previous-cycle bit of the kind table index, for each status word
+        n = len(profile.status)
+        self.carry = [0] * (1 << n)
+        if profile.previous:
+            bit = [s[0] for s in profile.status].index(profile.previous)
+            for word in range(1 << n):
+                if ((word >> bit) & 1) == profile.status[bit][1]:
+                    self.carry[word] = 1 << n
+        self.active = {}
+        for signal, level in profile.controls:
+            self.active[signal] = level
+        self.reset_held = [step[1] for step in profile.reset if step[0] == "assert"]
+        self.timing = cupboard_timing.EdgeTiming(profile.timing)
+        self.trace = True            # print every bus access
+        self.cycle_count = 0         # clocks since power-up, wraps at cupboard_events.CYCLE_MASK
+        self.event_cycle = cupboard_events.NO_EVENT
+        self.lines = cupboard_events.LineScheduler(lambda: self.cycle_count, self.set_line, tuple(c[0] for c in profile.controls))
+        self.address = 0             # address of the last access
+        self.data = 0                # data of the last access
+        self.status = 0              # status word of the last clock
+        self.kind = CYCLE_IDLE       # kind of the access begun on the last clock, CYCLE_IDLE if none began
+        self.state = CYCLE_IDLE      # strobe style: kind the strobes showed on the last clock
+        self.prev = 0                # quadrature style: previous-cycle bit for the next kind lookup
+        self.reset_pins()
+        self.specialise()
+
+    # status lines to inputs, controls to outputs (inactive, except the reset lines: the CPU starts in reset),
+    # clocks to their idle level
+    def reset_pins (self):
+        self.bus.reset_all_pins()
+        for signal, _, _ in self.profile.status:
+            self.pins[signal].switch_to_input(None)
+        for signal, level in self.profile.controls:
+            self.pins[signal].switch_to_output(level if signal in self.reset_held else not level)
+        for signal, level in self.profile.clocks:
+            self.pins[signal].switch_to_output(level)
+
+    # drive a control line for an event
+    def set_line (self, line, asserted):
+        level = self.active[line]
+        self.pins[line].value = level if asserted else not level
+
+    # pick up the head of the line event heap after it changes
+    def schedule_lines (self):
+        self.event_cycle = self.lines.next_event()
+
+    # measure this board's pin write and loop costs, then rebuild the cycle function with the new edge waits
+    def calibrate (self):
+        self.timing.calibrate(self.pins[self.profile.clocks[0][0]])
+        self.specialise()
+
+    # build run() and pulse() for the profile's bus style and the current edge timing
+    def specialise (self):
+        self.run, self.pulse = BUILDERS[self.profile.style](self)
+
+    # the profile's reset sequence; scheduled events end with the reset
+    def reset (self):
+        self.lines.cancel_all()
+        self.schedule_lines()
+        for signal, level in self.profile.controls:
+            self.pins[signal].value = level if signal in self.reset_held else not level
+        for signal, level in self.profile.clocks:
+            self.pins[signal].value = level
+        self.bus.release_data_bus()
+        self.state = CYCLE_IDLE
+        self.prev = 0
+        for step, arg in self.profile.reset:
+            if step == "assert":
+                self.set_line(arg, True)
+            elif step == "release":
+                self.set_line(arg, False)
+            else:
+                self.pulse(arg)
+
+    # print one bus access
+    def show (self, address, status, kind, data, old):
+        text = "%04x %s" % (address, self.status_text[status])
+        if kind == CYCLE_FETCH or kind == CYCLE_READ:
+            print(text + "R %02x" % data)
+        elif kind == CYCLE_WRITE:
+            print(text + "W %02x -> %02x" % (old, data))
+        elif kind == CYCLE_IO_READ:
+            print(text + "IR %02x" % data)
+        elif kind == CYCLE_IO_WRITE:
+            print(text + "IW %02x" % data)
+        elif kind == CYCLE_ACK:
+            print(text + "A %02x" % data)
+        else:
+            print(text + "-")
+
+# -----------------------------------------------------------------------------------------------------------
+# Builders, one per bus style: each returns run(cycles) and pulse(count) (clocks without bus access, for reset)
+# -----------------------------------------------------------------------------------------------------------
+
+# PHI2: every clock is a bus cycle. PHI2 falls, address and status are read, the data bus is released if the
+# CPU writes (or nobody reads), PHI2 rises, then reads are answered and writes taken.
+def build_phi2 (cpu):
+    bus = cpu.bus
+    timing = cpu.timing
+    clk = cpu.pins[cpu.profile.clocks[0][0]]
+    clock_low = clock_edge(clk, 0, timing.low_spins)    # then wait out tADS
+    clock_high = clock_edge(clk, 1, timing.high_spins)  # then wait out tMDS
+    read_addr = bus.read_addr_bus
+    read_data = bus.read_data_bus
+    drive = bus.drive_data_bus
+    release = bus.release_data_bus
+    read_status = cpu.read_status
+    kinds = cpu.kinds
+    memory = cpu.memory
+    device = cpu.device
+    device_block = cpu.device_block
+    lines = cpu.lines
+    show = cpu.show
+    mask = cupboard_events.CYCLE_MASK
+
+    def run (cycles):
+        count = cpu.cycle_count
+        event_cycle = cpu.event_cycle
+        address = cpu.address
+        data = cpu.data
+        status = cpu.status
+        kind = cpu.kind
+        for _ in range(cycles):
+            # line events due on this cycle change the CPU inputs before the falling edge
+            if count == event_cycle:
+                cpu.cycle_count = count
+                lines.service(count)
+                cpu.schedule_lines()
+                event_cycle = cpu.event_cycle
+            # --\__
+            clock_low()
+            address = read_addr()
+            status = read_status()
+            kind = kinds[status]
+            # the data bus stays driven through a run of reads; released during PHI2 low, before the CPU drives it
+            if kind < CYCLE_FETCH:
+                release()
+            # __/--
+            clock_high()
+            old = 0
+            if kind >= CYCLE_FETCH:
+                if address >> 2 == device_block:
+                    data = device.read(address)
+                else:
+                    data = memory[address]
+                drive(data)
+            elif kind == CYCLE_WRITE:
+                data = read_data()
+                old = memory[address]
+                if address >> 2 == device_block:
+                    device.write(address, data)
+                else:
+                    memory[address] = data
+            if cpu.trace:
+                show(address, status, kind, data, old)
+            count = (count + 1) & mask
+        cpu.cycle_count = count
+        cpu.address = address
+        cpu.data = data
+        cpu.status = status
+        cpu.kind = kind
+
+    def pulse (count):
+        for _ in range(count):
+            clock_low()
+            clock_high()
+            cpu.cycle_count = (cpu.cycle_count + 1) & mask
+
+    return run, pulse
+
+# QUADRATURE: every E cycle is a bus cycle. E falls (waiting for address and R/W), Q rises, address and status are
+# read, the data bus released unless Cupboard answers, E rises (waiting for write data), Q falls, then reads are
+# answered and writes taken. The CPU latches read data when E next falls.
+def build_quadrature (cpu):
+    bus = cpu.bus
+    timing = cpu.timing
+    e = cpu.pins[cpu.profile.clocks[0][0]]
+    q = cpu.pins[cpu.profile.clocks[1][0]]
+    e_low = clock_edge(e, 0, timing.low_spins)
+    q_high = clock_edge(q, 1, 0)
+    e_high = clock_edge(e, 1, timing.high_spins)
+    q_low = clock_edge(q, 0, 0)
+    read_addr = bus.read_addr_bus
+    read_data = bus.read_data_bus
+    drive = bus.drive_data_bus
+    release = bus.release_data_bus
+    read_status = cpu.read_status
+    kinds = cpu.kinds
+    carry = cpu.carry
+    memory = cpu.memory
+    device = cpu.device
+    device_block = cpu.device_block
+    lines = cpu.lines
+    show = cpu.show
+    mask = cupboard_events.CYCLE_MASK
+
+    def run (cycles):
+        count = cpu.cycle_count
+        event_cycle = cpu.event_cycle
+        address = cpu.address
+        data = cpu.data
+        status = cpu.status
+        kind = cpu.kind
+        prev = cpu.prev
+        for _ in range(cycles):
+            if count == event_cycle:
+                cpu.cycle_count = count
+                lines.service(count)
+                cpu.schedule_lines()
+                event_cycle = cpu.event_cycle
+            e_low()
+            q_high()
+            address = read_addr()
+            status = read_status()
+            kind = kinds[status | prev]
+            prev = carry[status]
+            if kind < CYCLE_FETCH:
+                release()
+            e_high()
+            q_low()
+            old = 0
+            if kind >= CYCLE_FETCH:
+                if address >> 2 == device_block:
+                    data = device.read(address)
+                else:
+                    data = memory[address]
+                drive(data)
+            elif kind == CYCLE_WRITE:
+                data = read_data()
+                old = memory[address]
+                if address >> 2 == device_block:
+                    device.write(address, data)
+                else:
+                    memory[address] = data
+            if cpu.trace:
+                show(address, status, kind, data, old)
+            count = (count + 1) & mask
+        cpu.cycle_count = count
+        cpu.address = address
+        cpu.data = data
+        cpu.status = status
+        cpu.kind = kind
+        cpu.prev = prev
+
+    def pulse (count):
+        for _ in range(count):
+            e_low()
+            q_high()
+            e_high()
+            q_low()
+            cpu.cycle_count = (cpu.cycle_count + 1) & mask
+
+    return run, pulse
+
+# STROBE: a clock is a rising then a falling edge; the strobes change just after the edges, so they are read after
+# the falling edge (waiting for MREQ/IORQ/RD/WR). An access lasts while its strobes do: it is handled on the clock
+# its kind first appears, and the data bus is released as soon as the strobes of a read go away. Memory and I/O
+# write data is valid by the time WR falls.
+def build_strobe (cpu):
+    bus = cpu.bus
+    timing = cpu.timing
+    clk = cpu.pins[cpu.profile.clocks[0][0]]
+    clock_high = clock_edge(clk, 1, timing.high_spins)
+    clock_low = clock_edge(clk, 0, timing.low_spins)
+    read_addr = bus.read_addr_bus
+    read_data = bus.read_data_bus
+    drive = bus.drive_data_bus
+    release = bus.release_data_bus
+    read_status = cpu.read_status
+    kinds = cpu.kinds
+    memory = cpu.memory
+    device = cpu.device
+    device_block = cpu.device_block
+    port_block = cpu.port_block
+    ack_value = cpu.profile.ack_value
+    lines = cpu.lines
+    show = cpu.show
+    mask = cupboard_events.CYCLE_MASK
+
+    def run (cycles):
+        count = cpu.cycle_count
+        event_cycle = cpu.event_cycle
+        address = cpu.address
+        data = cpu.data
+        status = cpu.status
+        state = cpu.state
+        kind = CYCLE_IDLE
+        for _ in range(cycles):
+            if count == event_cycle:
+                cpu.cycle_count = count
+                lines.service(count)
+                cpu.schedule_lines()
+                event_cycle = cpu.event_cycle
+            clock_high()
+            clock_low()
+            status = read_status()
+            kind = kinds[status]
+            if kind == state:
+                kind = CYCLE_IDLE  # same access continues (or still idle)
+            else:
+                state = kind
+                old = 0
+                if kind >= CYCLE_FETCH:
+                    address = read_addr()
+                    if kind == CYCLE_IO_READ:
+                        data = device.read(address) if (address & 0xff) >> 2 == port_block else 0xff
+                    elif kind == CYCLE_ACK:
+                        data = ack_value
+                    elif address >> 2 == device_block:
+                        data = device.read(address)
+                    else:
+                        data = memory[address]
+                    drive(data)
+                else:
+                    release()
+                    if kind == CYCLE_WRITE:
+                        address = read_addr()
+                        data = read_data()
+                        old = memory[address]
+                        if address >> 2 == device_block:
+                            device.write(address, data)
+                        else:
+                            memory[address] = data
+                    elif kind == CYCLE_IO_WRITE:
+                        address = read_addr()
+                        data = read_data()
+                        if (address & 0xff) >> 2 == port_block:
+                            device.write(address, data)
+                if kind and cpu.trace:
+                    show(address, status, kind, data, old)
+            count = (count + 1) & mask
+        cpu.cycle_count = count
+        cpu.address = address
+        cpu.data = data
+        cpu.status = status
+        cpu.state = state
+        cpu.kind = kind
+
+    def pulse (count):
+        for _ in range(count):
+            clock_high()
+            clock_low()
+            cpu.cycle_count = (cpu.cycle_count + 1) & mask
+
+    return run, pulse
+
+BUILDERS = {
+    STYLE_PHI2: build_phi2,
+    STYLE_QUADRATURE: build_quadrature,
+    STYLE_STROBE: build_strobe,
+}
@@ -0,0 +1,163 @@
+# cupboard_events.py
+# Cycle-timed events on the CPU's input lines (IRQ, NMI, RDY, SO, RST on a 65C02) for the Cupboard monitors, for exercising
+# interrupt handlers, wait states and resets from the monitor.
+#
+# An event pulls a line low (asserts it) for a number of cycles, once or every period cycles. Pending edges are
+# kept in a binary heap ordered by the cycle they fall on, so the bus loop only compares its cycle count against
+# the head of the heap (next_event()) and calls service() on that cycle; with nothing scheduled it costs nothing.
+# CircuitPython has no heapq, so the heap is a plain list sifted here.
+#
+# Cycle numbers wrap at CYCLE_MASK like the monitors' cycle counter. Heap entries are compared by their distance
+# ahead of the current cycle, which orders them correctly as long as no edge is scheduled more than MAX_DELAY
+# cycles ahead.
+#
+# Several events may hold the same line; it is released when the last of them lets go.
+
+LINES         = ("IRQ", "NMI", "RDY", "SO", "RST")
+NO_EVENT      = -1
+CYCLE_MASK    = 0x3fffffff  # the monitor's cycle counter wraps here (see cupboard_trace.CYCLE_MASK)
+MAX_DELAY     = CYCLE_MASK >> 1
+DEFAULT_WIDTH = 8           # cycles a line is held: covers the longest instruction, so IRQ is seen at its end
+
+class LineEvent:
+    def __init__ (self, event_id, line, width, period):
+        self.id = event_id
+        self.line = line
+        self.width = width
+        self.period = period   # 0 = one-shot
+        self.fired = 0         # times asserted so far
+        self.holding = False   # line currently held by this event
+
+class LineScheduler:
+    # clock() returns the current cycle; set_line(line, asserted) drives a line; lines names the lines events may use
+    def __init__ (self, clock, set_line, lines=LINES):
+        self.clock = clock
+        self.set_line = set_line
+        self.lines = lines
+        self.heap = []         # [cycle, seq, event, assert] edges, earliest first
+        self.events = {}       # id: LineEvent
+        self.held = {}         # line: number of events holding it
+        self.next_id = 1
+        self.seq = 0           # insertion order, keeps edges on the same cycle in the order they were queued
+
+    # True if heap entry a comes before b, counting cycles from now
+    def _before (self, a, b, now):
+        da = (a[0] - now) & CYCLE_MASK
+        db = (b[0] - now) & CYCLE_MASK
+        return da < db or (da == db and a[1] < b[1])
+
+    def _push (self, cycle, event, asserting):
+        heap = self.heap
+        now = self.clock()
+        self.seq += 1
+        entry = [cycle & CYCLE_MASK, self.seq, event, asserting]
+        heap.append(entry)
+        i = len(heap) - 1
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not self._before(entry, heap[parent], now):
+                break
+            heap[i] = heap[parent]
+            i = parent
+        heap[i] = entry
+
+    def _pop (self):
+        heap = self.heap
+        now = self.clock()
+        top = heap[0]
+        last = heap.pop()
+        if len(heap) > 0:
+            # sift the last entry down from the root
+            i = 0
+            n = len(heap)
+            while True:
+                child = 2 * i + 1
+                if child >= n:
+                    break
+                if child + 1 < n and self._before(heap[child + 1], heap[child], now):
+                    child += 1
+                if not self._before(heap[child], last, now):
+                    break
+                heap[i] = heap[child]
+                i = child
+            heap[i] = last
+        return top
+
+    def _hold (self, event):
+        event.holding = True
+        count = self.held.get(event.line, 0)
+        self.held[event.line] = count + 1
+        if count == 0:
+            self.set_line(event.line, True)
+
+    def _let_go (self, event):
+        event.holding = False
+        count = self.held[event.line] - 1
+        self.held[event.line] = count
+        if count == 0:
+            self.set_line(event.line, False)
+
+    # schedule line to be asserted delay cycles from now for width cycles, repeating every period cycles if
+    # period > 0; returns the event id. Raises ValueError for a bad line or timing.
+    def add (self, line, delay, width=DEFAULT_WIDTH, period=0):
+        if line not in self.lines:
+            raise ValueError("line must be one of %s" % " ".join(self.lines))
+        if delay < 0 or delay > MAX_DELAY or period < 0 or period > MAX_DELAY:
+            raise ValueError("delay and period must be 0 to %d cycles" % MAX_DELAY)
+        if width < 1 or (period > 0 and width >= period):
+            raise ValueError("width must be at least 1 cycle and shorter than the period")
+        event = LineEvent(self.next_id, line, width, period)
+        self.next_id += 1
+        self.events[event.id] = event
+        self._push(self.clock() + delay, event, True)
+        return event.id
+
+    # remove an event, releasing its line if it holds it; returns False for an unknown id
+    def cancel (self, event_id):
+        event = self.events.pop(event_id, None)
+        if event is None:
+            return False
+        kept = [entry for entry in self.heap if entry[2] is not event]
+        self.heap = []
+        for entry in kept:
+            self._push(entry[0], entry[2], entry[3])
+        if event.holding:
+            self._let_go(event)
+        return True
+
+    def cancel_all (self):
+        for event_id in list(self.events):
+            self.cancel(event_id)
+
+    # cycle of the next edge, or NO_EVENT
+    def next_event (self):
+        return self.heap[0][0] if len(self.heap) > 0 else NO_EVENT
+
+    # handle the edges falling on cycle now
+    def service (self, now):
+        heap = self.heap
+        while len(heap) > 0 and heap[0][0] == now:
+            _, _, event, asserting = self._pop()
+            if asserting:
+                self._hold(event)
+                event.fired += 1
+                self._push(now + event.width, event, False)
+                if event.period > 0:
+                    self._push(now + event.period, event, True)
+            else:
+                self._let_go(event)
+                if event.period == 0:
+                    self.events.pop(event.id, None)
+
+    # (event, cycle of its next edge) for every event, by id
+    def list (self):
+        now = self.clock()
+        found = []
+        for event_id in sorted(self.events):
+            event = self.events[event_id]
+            when = NO_EVENT
+            for entry in self.heap:
+                if entry[2] is event and (when == NO_EVENT or (entry[0] - now) & CYCLE_MASK < (when - now) & CYCLE_MASK):
+                    when = entry[0]
+            found.append((event, when))
+        return found
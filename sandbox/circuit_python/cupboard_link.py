@@ -0,0 +1,257 @@
+# cupboard_link.py
+# Binary link between a Cupboard firmware and its host client: CRC-checked frames, several in flight at a time,
+# instead of one echoed text line per round trip. Used by ../eep/eep_grandcentral/eep.circuitpy.py (BIN command)
+# and ../eep/eep_client/eep_client.py.
+#
+#   a5 5a kind seq len_lo len_hi payload[len] crc[4]     (crc = CRC-32 of kind..payload, little-endian)
+#
+# Frames from the host are escaped so the stream never holds 03: the CircuitPython console turns Ctrl-C into
+# KeyboardInterrupt whoever is reading it. 03 is sent as 10 23 and 10 as 10 30. Frames from the board are sent as
+# they are; bytes outside frames (console text) are skipped.
+#
+# The host numbers its requests and keeps up to `window` of them unanswered. The board answers each request in
+# order with the same seq. A damaged frame, or one out of order, gets a NAK naming the seq the board expects and the
+# host sends again from there (go-back-N). Requests are idempotent, so a request the board has already answered
+# (its answer was lost) is simply carried out again.
+#
+#   host:  R addr count      -> board: D addr data     read
+#          W addr data       -> board: A failed        write, failed = bytes that didn't verify
+#          C addr count size -> board: C crc...        CRC-32 of each size bytes in the range (at most LINK_BLOCK/4)
+#          E                 -> board: A 0             end of binary mode
+#   board: N                                           damaged or out-of-order request, seq = the one expected
+
+import sys
+import time
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+try:
+    import usb_cdc
+    _console = usb_cdc.console
+except ImportError:
+    _console = None
+
+LINK_VERSION = 1
+LINK_SYNC    = b'\xa5\x5a'
+LINK_HEADER  = 6
+LINK_BLOCK   = 256     # most data bytes in one read or write
+LINK_MAX     = LINK_BLOCK + 2
+LINK_WINDOW  = 8       # requests in flight
+
+LINK_BAD     = 0       # returned by receive() for a damaged frame
+LINK_READ    = 0x52    # 'R'
+LINK_DATA    = 0x44    # 'D'
+LINK_WRITE   = 0x57    # 'W'
+LINK_ACK     = 0x41    # 'A'
+LINK_CRC     = 0x43    # 'C'
+LINK_NAK     = 0x4e    # 'N'
+LINK_END     = 0x45    # 'E'
+
+ESCAPE       = 0x10
+
+class LinkError(Exception):
+    pass
+
+# CRC-32 (the zlib/binascii one) for builds without binascii.crc32
+if crc32 is None:
+    _crc_table = []
+    for _n in range(256):
+        _c = _n
+        for _ in range(8):
+            _c = (_c >> 1) ^ 0xedb88320 if _c & 1 else _c >> 1
+        _crc_table.append(_c)
+
+    def crc32 (data, crc=0):
+        crc ^= 0xffffffff
+        for b in data:
+            crc = _crc_table[(crc ^ b) & 0xff] ^ (crc >> 8)
+        return crc ^ 0xffffffff
+
+# escape a frame for sending from the host
+def escape (frame):
+    return bytes(frame).replace(b'\x10', b'\x10\x30').replace(b'\x03', b'\x10\x23')
+
+class Link:
+    # read() returns the bytes available now (possibly none), write(data) sends them; the host escapes what it
+    # sends, the board unescapes what it receives
+    def __init__ (self, read, write, host):
+        self.read = read
+        self.write = write
+        self.host = host
+        self.pending = b''      # received bytes (unescaped) not yet parsed
+        self.held = b''         # an escape byte whose pair hasn't arrived yet
+        self.frame = bytearray(LINK_HEADER + LINK_MAX + 4)
+        self.bad_frames = 0
+        self.next_seq = 0       # host: seq of the next request
+        self.window = LINK_WINDOW
+        self.block = LINK_BLOCK
+
+    def send (self, kind, seq, payload=b''):
+        n = LINK_HEADER + len(payload)
+        frame = self.frame
+        frame[0] = 0xa5
+        frame[1] = 0x5a
+        frame[2] = kind
+        frame[3] = seq
+        frame[4] = len(payload) & 0xff
+        frame[5] = len(payload) >> 8
+        frame[LINK_HEADER:n] = payload
+        crc = crc32(memoryview(frame)[2:n])
+        frame[n] = crc & 0xff
+        frame[n + 1] = (crc >> 8) & 0xff
+        frame[n + 2] = (crc >> 16) & 0xff
+        frame[n + 3] = crc >> 24
+        if self.host:
+            self.write(escape(memoryview(frame)[:n + 4]))
+        else:
+            self.write(memoryview(frame)[:n + 4])
+
+    def _fill (self):
+        data = self.read()
+        if not data:
+            return False
+        if not self.host:
+            data = self.held + data
+            self.held = b''
+            if data[-1] == ESCAPE:
+                # wait for the escape's pair (the second byte of a pair is never an escape, see escape())
+                self.held = data[-1:]
+                data = data[:-1]
+            data = bytes(data).replace(b'\x10\x23', b'\x03').replace(b'\x10\x30', b'\x10')
+        self.pending += data
+        return True
+
+    # the next frame received as (kind, seq, payload), (LINK_BAD, 0, b'') for a damaged one, or None if no whole
+    # frame has arrived
+    def receive (self):
+        while True:
+            frame = self._parse()
+            if frame is not None or not self._fill():
+                return frame
+
+    def _parse (self):
+        pending = self.pending
+        start = pending.find(LINK_SYNC)
+        if start < 0:
+            self.pending = pending[-1:] if pending.endswith(LINK_SYNC[:1]) else b''
+            return None
+        pending = pending[start:]
+        self.pending = pending
+        if len(pending) < LINK_HEADER:
+            return None
+        length = pending[4] | (pending[5] << 8)
+        if length > LINK_MAX:
+            self.pending = pending[1:]
+            self.bad_frames += 1
+            return (LINK_BAD, 0, b'')
+        end = LINK_HEADER + length
+        if len(pending) < end + 4:
+            return None
+        crc = pending[end] | (pending[end + 1] << 8) | (pending[end + 2] << 16) | (pending[end + 3] << 24)
+        if crc32(pending[2:end]) != crc:
+            self.pending = pending[1:]
+            self.bad_frames += 1
+            return (LINK_BAD, 0, b'')
+        self.pending = pending[end + 4:]
+        return (pending[2], pending[3], pending[LINK_HEADER:end])
+
+# send requests (kind, payload) keeping up to window unanswered, resending on NAK or timeout; returns the answers
+# (kind, payload) in request order
+def exchange (link, requests, timeout=2.0, retries=8):
+    window = link.window
+    answers = [None] * len(requests)
+    first = link.next_seq
+    base = 0          # oldest request not answered
+    sent = 0          # next request to send
+    gap = -1          # base when its answer was last found missing
+    tries = 0
+    deadline = time.monotonic() + timeout
+    while base < len(requests):
+        while sent < len(requests) and sent - base < window:
+            if answers[sent] is None:
+                link.send(requests[sent][0], (first + sent) & 0xff, requests[sent][1])
+            sent += 1
+        frame = link.receive()
+        if frame is None:
+            if time.monotonic() < deadline:
+                continue
+            frame = (LINK_NAK, (first + base) & 0xff, b'')
+        kind, seq, payload = frame
+        if kind == LINK_BAD:
+            continue
+        k = base + ((seq - first - base) & 0xff)
+        if kind == LINK_NAK:
+            # go back to the request the board expects, or to the oldest unanswered one
+            sent = k if k < sent else base
+            tries += 1
+            if tries > retries:
+                raise LinkError("no answer to request %d" % base)
+            deadline = time.monotonic() + timeout
+            continue
+        if k < sent and answers[k] is None:
+            answers[k] = (kind, payload)
+            while base < len(requests) and answers[base] is not None:
+                base += 1
+                tries = 0
+            if base < k and gap != base:
+                # answers come in order, so the answer to base was lost: ask for it again now
+                gap = base
+                link.send(requests[base][0], (first + base) & 0xff, requests[base][1])
+            deadline = time.monotonic() + timeout
+    link.next_seq = (first + len(requests)) & 0xff
+    return answers
+
+# ------------------------------------------------------------------------------------------------------------------
+# board side
+# ------------------------------------------------------------------------------------------------------------------
+
+# the USB serial console on the board, stdin/stdout elsewhere
+def board_read ():
+    if _console is not None:
+        n = _console.in_waiting
+        return _console.read(n) if n > 0 else b''
+    import select
+    if select.select([sys.stdin], [], [], 0)[0]:
+        return sys.stdin.buffer.read1(4096)
+    return b''
+
+def board_write (data):
+    if _console is not None:
+        _console.write(data)
+    else:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+# serve requests until an end request or idle_ns without one; handle(kind, payload) returns the answer
+# (kind, payload) for a read or write
+def serve (handle, idle_ns=10000000000, link=None):
+    if link is None:
+        link = Link(board_read, board_write, False)
+    expected = 0
+    nak_sent = False
+    last_ns = time.monotonic_ns()
+    while True:
+        frame = link.receive()
+        if frame is None:
+            if time.monotonic_ns() - last_ns > idle_ns:
+                return
+            continue
+        last_ns = time.monotonic_ns()
+        kind, seq, payload = frame
+        behind = (expected - seq) & 0xff
+        if kind == LINK_BAD or (seq != expected and behind > LINK_WINDOW):
+            # damaged, or ahead of one that was: ask once for everything from the expected request
+            if not nak_sent:
+                link.send(LINK_NAK, expected)
+                nak_sent = True
+            continue
+        if kind == LINK_END:
+            link.send(LINK_ACK, seq, b'\x00\x00')
+            return
+        answer = handle(kind, payload)
+        link.send(answer[0], seq, answer[1])
+        if seq == expected:
+            expected = (expected + 1) & 0xff
+            nak_sent = False
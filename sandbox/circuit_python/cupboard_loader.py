@@ -0,0 +1,160 @@
+# cupboard_loader.py
+# Load program images into emulated memory: raw binary, Intel HEX and Motorola S-record.
+#
+# Records are decoded a whole line at a time (binascii.unhexlify) and stored with slice assignment, so a 32 KB
+# ROM image loads in well under a second on the M4. Every record's checksum is checked; a bad record raises
+# LoadError naming the line, and records before it stay loaded.
+#
+#   load_file(memory, "ROM.HEX")           - format from the first character: ':' Intel HEX, 'S' S-record
+#   load_file(memory, "ROM.BIN", 0x8000)   - anything else is raw binary, loaded at the address given
+#                                            (default: so that the image ends at $FFFF, like a ROM)
+#   loader = ImageLoader(memory); loader.feed(line) ... - records arriving one line at a time (serial)
+#   loader, error = load_stream(memory)    - records read from the console until the end record or a '.' line
+
+import binascii
+import time
+
+class LoadError(Exception):
+    pass
+
+class ImageLoader:
+    def __init__ (self, memory):
+        self.memory = memory
+        self.lines = 0
+        self.count = 0        # data bytes stored
+        self.low = 0x10000    # lowest and highest address written
+        self.high = -1
+        self.start = None     # start address record, if any
+        self.done = False     # end-of-file record seen
+        self.base = 0         # Intel HEX extended address
+        self.t0 = time.monotonic_ns()
+
+    def _store (self, address, data):
+        end = address + len(data)
+        if end > len(self.memory):
+            raise LoadError("line %d: data at %x runs past the end of memory" % (self.lines, address))
+        self.memory[address:end] = data
+        self.count += len(data)
+        self.low = min(self.low, address)
+        self.high = max(self.high, end - 1)
+
+    # decode one text record (Intel HEX or S-record); returns True once the end record has been seen
+    def feed (self, line):
+        line = line.strip()
+        self.lines += 1
+        if len(line) == 0:
+            return self.done
+        try:
+            if line[0] == ':':
+                self._ihex(binascii.unhexlify(line[1:]))
+            elif line[0] in 'Ss':
+                self._srec(line[1], binascii.unhexlify(line[2:]))
+            else:
+                raise LoadError("line %d: not an Intel HEX or S-record line" % self.lines)
+        except ValueError:
+            raise LoadError("line %d: bad hex digits" % self.lines)
+        return self.done
+
+    # Intel HEX: count, address (2), type, data, checksum; all bytes sum to 0
+    def _ihex (self, rec):
+        if len(rec) < 5 or len(rec) != rec[0] + 5:
+            raise LoadError("line %d: bad record length" % self.lines)
+        if sum(rec) & 0xff != 0:
+            raise LoadError("line %d: checksum error" % self.lines)
+        kind = rec[3]
+        address = (rec[1] << 8) | rec[2]
+        if kind == 0x00:    # data
+            self._store(self.base + address, rec[4:-1])
+        elif kind == 0x01:  # end of file
+            self.done = True
+        elif kind == 0x02:  # extended segment address
+            self.base = ((rec[4] << 8) | rec[5]) << 4
+        elif kind == 0x04:  # extended linear address
+            self.base = ((rec[4] << 8) | rec[5]) << 16
+        elif kind in (0x03, 0x05):  # start address
+            self.start = int.from_bytes(rec[4:-1], 'big')
+
+    # S-record: type digit, then count, address (2/3/4), data, checksum; count..checksum sum to ff
+    def _srec (self, kind, rec):
+        if len(rec) < 3 or len(rec) != rec[0] + 1:
+            raise LoadError("line %d: bad record length" % self.lines)
+        if sum(rec) & 0xff != 0xff:
+            raise LoadError("line %d: checksum error" % self.lines)
+        if kind in '123':
+            size = ord(kind) - ord('0') + 1
+            self._store(int.from_bytes(rec[1:1 + size], 'big'), rec[1 + size:-1])
+        elif kind in '789':
+            self.start = int.from_bytes(rec[1:-1], 'big')
+            self.done = True
+        # S0 header and S5/S6 record counts carry no data
+
+    # one-line summary: bytes, address range, time and throughput
+    def report (self):
+        ns = max(time.monotonic_ns() - self.t0, 1)
+        if self.count == 0:
+            return "Loaded 0 bytes"
+        text = "Loaded %d bytes %04x-%04x in %d ms (%d KB/s)" % (self.count, self.low, self.high, ns // 1000000, self.count * 1000000 // ns)
+        if self.start is not None:
+            text += ", start %04x" % self.start
+        return text
+
+# load a raw binary image; returns a loader holding the statistics
+def load_binary (memory, data, address=None):
+    loader = ImageLoader(memory)
+    if address is None:
+        address = len(memory) - len(data)
+    loader._store(address, data)
+    loader.done = True
+    return loader
+
+# load an image file of any supported format; returns the loader
+def load_file (memory, filename, address=None):
+    with open(filename, "rb") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first in (b':', b'S', b's'):
+            loader = ImageLoader(memory)
+            for line in f:
+                if loader.feed(line.decode()):
+                    break
+            return loader
+        return load_binary(memory, f.read(), address)
+
+# is a text line an end record (Intel HEX type 01, S-record S7/S8/S9)? Looks only at the type, for lines that
+# can't be trusted to decode
+def is_end_record (line):
+    if line[:1] == ':':
+        return line[7:9] == '01'
+    return line[:2] in ('S7', 'S8', 'S9', 's7', 's8', 's9')
+
+# load records read a line at a time by read_line() (default input(), the console) until the end record or a '.'
+# line; returns the loader and the LoadError that stopped the load (None if it didn't). After an error the rest of
+# the records are still read, and dropped, up to the end record or '.', so that a sender that doesn't wait for
+# replies can't have them taken as commands.
+def load_stream (memory, read_line=None):
+    if read_line is None:
+        read_line = input
+    loader = ImageLoader(memory)
+    error = None
+    while True:
+        line = read_line().strip()
+        if line == '.':
+            break
+        if error is not None:
+            if is_end_record(line):
+                break
+            continue
+        try:
+            if loader.feed(line):
+                break
+        except LoadError as e:
+            error = e
+    return loader, error
+
+# store "addr b0 b1 ..." hex-dump text (as in the monitors' built-in demo programs) in memory
+def load_hex_dump_line (memory, text):
+    fields = text.split()
+    if len(fields) > 1:
+        address = int(fields[0], 16)
+        data = binascii.unhexlify("".join(fields[1:]))
+        memory[address:address + len(data)] = data
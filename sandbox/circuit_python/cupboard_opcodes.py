@@ -0,0 +1,83 @@
+# cupboard_opcodes.py
+# 65C02 instruction decode table shared by the monitors, the trace client and the software CPU.
+#
+# The table is four 256-byte arrays indexed by opcode - instruction length, base cycle count, addressing mode
+# and mnemonic index - so decoding an opcode is a few indexed reads. Base cycles exclude the page-crossing,
+# taken-branch and decimal-mode extra cycles. The text map is parsed once at import and not kept.
+
+# addressing modes; nop1/nop2/nop3 are the unused opcodes (NOP of 1, 2 or 3 bytes), zpr is BBR/BBS zp,rel
+MODES = ("imp", "acc", "imm", "zp", "zpx", "zpy", "abs", "abx", "aby", "izx", "izy", "izp", "rel", "ind", "iax", "zpr", "nop1", "nop2", "nop3")
+MODE_LENGTHS = bytes((1, 1, 2, 2, 2, 2, 3, 3, 3, 2, 2, 2, 2, 3, 3, 3, 1, 2, 3))
+MODE_FORMATS = ("", " A", " #$%02x", " $%02x", " $%02x,X", " $%02x,Y", " $%04x", " $%04x,X", " $%04x,Y", " ($%02x,X)",
+                " ($%02x),Y", " ($%02x)", " $%04x", " ($%04x)", " ($%04x,X)", " $%02x,$%04x", "", " #$%02x", " $%04x")
+MODE_REL = MODES.index("rel")
+MODE_ZPR = MODES.index("zpr")
+
+opcode_length   = bytearray(256)  # instruction length in bytes
+opcode_cycles   = bytearray(256)  # base cycle count
+opcode_mode     = bytearray(256)  # index into MODES
+opcode_mnemonic = bytearray(256)  # index into MNEMONICS
+MNEMONICS = []
+
+# fill the tables from the opcode map: mnemonic, mode and base cycles for each opcode, 16 per row
+def _build (opcode_map):
+    fields = opcode_map.split()
+    for op in range(256):
+        mnemonic, mode, cycles = fields[op * 3], fields[op * 3 + 1], fields[op * 3 + 2]
+        if mnemonic not in MNEMONICS:
+            MNEMONICS.append(mnemonic)
+        m = MODES.index(mode)
+        opcode_mnemonic[op] = MNEMONICS.index(mnemonic)
+        opcode_mode[op] = m
+        opcode_length[op] = MODE_LENGTHS[m]
+        opcode_cycles[op] = int(cycles)
+
+_build("""
+BRK imp 7      ORA izx 6      NOP nop2 2     NOP nop1 1     TSB zp 5       ORA zp 3       ASL zp 5       RMB0 zp 5      PHP imp 3      ORA imm 2      ASL acc 2      NOP nop1 1     TSB abs 6      ORA abs 4      ASL abs 6      BBR0 zpr 5
+BPL rel 2      ORA izy 5      ORA izp 5      NOP nop1 1     TRB zp 5       ORA zpx 4      ASL zpx 6      RMB1 zp 5      CLC imp 2      ORA aby 4      INC acc 2      NOP nop1 1     TRB abs 6      ORA abx 4      ASL abx 6      BBR1 zpr 5
+JSR abs 6      AND izx 6      NOP nop2 2     NOP nop1 1     BIT zp 3       AND zp 3       ROL zp 5       RMB2 zp 5      PLP imp 4      AND imm 2      ROL acc 2      NOP nop1 1     BIT abs 4      AND abs 4      ROL abs 6      BBR2 zpr 5
+BMI rel 2      AND izy 5      AND izp 5      NOP nop1 1     BIT zpx 4      AND zpx 4      ROL zpx 6      RMB3 zp 5      SEC imp 2      AND aby 4      DEC acc 2      NOP nop1 1     BIT abx 4      AND abx 4      ROL abx 6      BBR3 zpr 5
+RTI imp 6      EOR izx 6      NOP nop2 2     NOP nop1 1     NOP zp 3       EOR zp 3       LSR zp 5       RMB4 zp 5      PHA imp 3      EOR imm 2      LSR acc 2      NOP nop1 1     JMP abs 3      EOR abs 4      LSR abs 6      BBR4 zpr 5
+BVC rel 2      EOR izy 5      EOR izp 5      NOP nop1 1     NOP zpx 4      EOR zpx 4      LSR zpx 6      RMB5 zp 5      CLI imp 2      EOR aby 4      PHY imp 3      NOP nop1 1     NOP nop3 8     EOR abx 4      LSR abx 6      BBR5 zpr 5
+RTS imp 6      ADC izx 6      NOP nop2 2     NOP nop1 1     STZ zp 3       ADC zp 3       ROR zp 5       RMB6 zp 5      PLA imp 4      ADC imm 2      ROR acc 2      NOP nop1 1     JMP ind 6      ADC abs 4      ROR abs 6      BBR6 zpr 5
+BVS rel 2      ADC izy 5      ADC izp 5      NOP nop1 1     STZ zpx 4      ADC zpx 4      ROR zpx 6      RMB7 zp 5      SEI imp 2      ADC aby 4      PLY imp 4      NOP nop1 1     JMP iax 6      ADC abx 4      ROR abx 6      BBR7 zpr 5
+BRA rel 3      STA izx 6      NOP nop2 2     NOP nop1 1     STY zp 3       STA zp 3       STX zp 3       SMB0 zp 5      DEY imp 2      BIT imm 2      TXA imp 2      NOP nop1 1     STY abs 4      STA abs 4      STX abs 4      BBS0 zpr 5
+BCC rel 2      STA izy 6      STA izp 5      NOP nop1 1     STY zpx 4      STA zpx 4      STX zpy 4      SMB1 zp 5      TYA imp 2      STA aby 5      TXS imp 2      NOP nop1 1     STZ abs 4      STA abx 5      STZ abx 5      BBS1 zpr 5
+LDY imm 2      LDA izx 6      LDX imm 2      NOP nop1 1     LDY zp 3       LDA zp 3       LDX zp 3       SMB2 zp 5      TAY imp 2      LDA imm 2      TAX imp 2      NOP nop1 1     LDY abs 4      LDA abs 4      LDX abs 4      BBS2 zpr 5
+BCS rel 2      LDA izy 5      LDA izp 5      NOP nop1 1     LDY zpx 4      LDA zpx 4      LDX zpy 4      SMB3 zp 5      CLV imp 2      LDA aby 4      TSX imp 2      NOP nop1 1     LDY abx 4      LDA abx 4      LDX aby 4      BBS3 zpr 5
+CPY imm 2      CMP izx 6      NOP nop2 2     NOP nop1 1     CPY zp 3       CMP zp 3       DEC zp 5       SMB4 zp 5      INY imp 2      CMP imm 2      DEX imp 2      WAI imp 3      CPY abs 4      CMP abs 4      DEC abs 6      BBS4 zpr 5
+BNE rel 2      CMP izy 5      CMP izp 5      NOP nop1 1     NOP zpx 4      CMP zpx 4      DEC zpx 6      SMB5 zp 5      CLD imp 2      CMP aby 4      PHX imp 3      STP imp 3      NOP abs 4      CMP abx 4      DEC abx 7      BBS5 zpr 5
+CPX imm 2      SBC izx 6      NOP nop2 2     NOP nop1 1     CPX zp 3       SBC zp 3       INC zp 5       SMB6 zp 5      INX imp 2      SBC imm 2      NOP imp 2      NOP nop1 1     CPX abs 4      SBC abs 4      INC abs 6      BBS6 zpr 5
+BEQ rel 2      SBC izy 5      SBC izp 5      NOP nop1 1     NOP zpx 4      SBC zpx 4      INC zpx 6      SMB7 zp 5      SED imp 2      SBC aby 4      PLX imp 4      NOP nop1 1     NOP abs 4      SBC abx 4      INC abx 7      BBS7 zpr 5
+""")
+MNEMONICS = tuple(MNEMONICS)
+
+# (mnemonic, mode name) of an opcode
+def opcode_name (opcode):
+    return MNEMONICS[opcode_mnemonic[opcode]], MODES[opcode_mode[opcode]]
+
+# disassemble one instruction at pc from its opcode and operand bytes, e.g. "LDA ($12),Y"
+def disassemble (pc, opcode, b1=0, b2=0):
+    mode = opcode_mode[opcode]
+    text = MNEMONICS[opcode_mnemonic[opcode]]
+    fmt = MODE_FORMATS[mode]
+    if mode == MODE_REL:
+        return text + fmt % ((pc + 2 + (b1 - 256 if b1 & 0x80 else b1)) & 0xffff)
+    if mode == MODE_ZPR:
+        return text + fmt % (b1, (pc + 3 + (b2 - 256 if b2 & 0x80 else b2)) & 0xffff)
+    if opcode_length[opcode] == 3:
+        return text + fmt % (b1 | (b2 << 8))
+    if opcode_length[opcode] == 2:
+        return text + fmt % b1
+    return text + fmt
+
+# listing line for one instruction: address, instruction bytes and disassembly, e.g. "8003  a9 ff     LDA #$ff"
+def listing (pc, opcode, b1=0, b2=0):
+    length = opcode_length[opcode]
+    if length == 3:
+        code = "%02x %02x %02x" % (opcode, b1, b2)
+    elif length == 2:
+        code = "%02x %02x" % (opcode, b1)
+    else:
+        code = "%02x" % opcode
+    return "%04x  %-8s  %s" % (pc, code, disassemble(pc, opcode, b1, b2))
@@ -0,0 +1,141 @@
+# cupboard_profile.py
+# Execution profiler for the program on the target CPU: executions and bus cycles per instruction address, cycles
+# per subroutine (JSR/RTS pairing) and read/write counts per memory page.
+#
+# Everything is counted in arrays allocated once, so the monitor can leave profiling on during free-run:
+#   - every cycle: one increment in the page read or write heat map (done inline in the monitor's bus loop)
+#   - every opcode fetch (SYNC): sync() finds the address in an open-addressed table and adds to its counters
+# A full 64K-entry table of 32-bit counters would not fit in the M4's RAM, so instruction addresses share SLOTS
+# slots (linear probing, filled to at most 3/4); fetches from addresses beyond that are counted in `other`.
+#
+# A subroutine's cycles run from its JSR's opcode fetch to the opcode fetch after the matching RTS, so they
+# include everything it calls. Calls deeper than STACK_DEPTH are not timed.
+
+import array
+import cupboard_opcodes
+
+SLOTS       = 4096
+SLOT_MASK   = SLOTS - 1
+SLOT_LIMIT  = SLOTS * 3 // 4
+STACK_DEPTH = 64
+CYCLE_MASK  = 0x3fffffff  # the monitor's cycle counter wraps here (see cupboard_trace.CYCLE_MASK)
+
+OP_JSR = 0x20
+OP_RTS = 0x60
+
+HEAT_CHARS = " .:-=+*#%@"
+
+class Profiler:
+    def __init__ (self):
+        self.keys = array.array('L', [0] * SLOTS)      # instruction address + 1, 0 = empty slot
+        self.counts = array.array('L', [0] * SLOTS)    # executions
+        self.cycles = array.array('L', [0] * SLOTS)    # bus cycles from this opcode fetch to the next
+        self.opcodes = bytearray(SLOTS)
+        self.reads = array.array('L', [0] * 256)       # read cycles per page (opcode fetches included)
+        self.writes = array.array('L', [0] * 256)      # write cycles per page
+        self.stack_pc = array.array('H', [0] * STACK_DEPTH)    # subroutine address of each open call
+        self.stack_cycle = array.array('L', [0] * STACK_DEPTH) # cycle of its JSR
+        self.subroutines = {}                         # address: [calls, cycles]
+        self.clear()
+
+    def clear (self):
+        for a in (self.keys, self.counts, self.cycles, self.reads, self.writes):
+            for i in range(len(a)):
+                a[i] = 0
+        self.subroutines.clear()
+        self.used = 0
+        self.other = 0           # opcode fetches that found the table full
+        self.last_slot = -1      # slot of the previous opcode fetch
+        self.last_cycle = 0
+        self.depth = 0
+        self.call_cycle = -1     # cycle of a JSR whose target is the next opcode fetch, -1 = none
+        self.returning = False   # an RTS was fetched: the next opcode fetch closes the innermost call
+
+    # the slot for an instruction address, claiming an empty one; -1 if the table is full
+    def _slot (self, pc):
+        keys = self.keys
+        key = pc + 1
+        slot = pc & SLOT_MASK
+        while keys[slot] != key:
+            if keys[slot] == 0:
+                if self.used >= SLOT_LIMIT:
+                    return -1
+                keys[slot] = key
+                self.used += 1
+                return slot
+            slot = (slot + 1) & SLOT_MASK
+        return slot
+
+    # an opcode fetch of opcode from pc on the given cycle
+    def sync (self, pc, opcode, cycle):
+        # the previous instruction ran until this fetch
+        if self.last_slot >= 0:
+            self.cycles[self.last_slot] += (cycle - self.last_cycle) & CYCLE_MASK
+        slot = self._slot(pc)
+        if slot >= 0:
+            self.counts[slot] += 1
+            self.opcodes[slot] = opcode
+        else:
+            self.other += 1
+        self.last_slot = slot
+        self.last_cycle = cycle
+        # subroutine calls: the fetch after a JSR is the subroutine's first instruction
+        if self.call_cycle >= 0:
+            if self.depth < STACK_DEPTH:
+                self.stack_pc[self.depth] = pc
+                self.stack_cycle[self.depth] = self.call_cycle
+            self.depth += 1
+            self.call_cycle = -1
+        elif self.returning:
+            self.returning = False
+            if self.depth > 0:
+                self.depth -= 1
+                if self.depth < STACK_DEPTH:
+                    target = self.stack_pc[self.depth]
+                    entry = self.subroutines.get(target)
+                    if entry is None:
+                        entry = [0, 0]
+                        self.subroutines[target] = entry
+                    entry[0] += 1
+                    entry[1] += (cycle - self.stack_cycle[self.depth]) & CYCLE_MASK
+        if opcode == OP_JSR:
+            self.call_cycle = cycle
+        elif opcode == OP_RTS:
+            self.returning = True
+
+    # (pc, opcode, executions, cycles) of the n instructions with the most cycles
+    def top (self, n):
+        slots = [i for i in range(SLOTS) if self.keys[i] != 0]
+        slots.sort(key=lambda i: self.cycles[i], reverse=True)
+        return [(self.keys[i] - 1, self.opcodes[i], self.counts[i], self.cycles[i]) for i in slots[:n]]
+
+    # (address, calls, cycles) of every subroutine that has returned, most cycles first
+    def subroutine_list (self):
+        found = [(pc, entry[0], entry[1]) for pc, entry in self.subroutines.items()]
+        found.sort(key=lambda s: s[2], reverse=True)
+        return found
+
+    # total cycles charged to instructions
+    def total_cycles (self):
+        total = 0
+        for i in range(SLOTS):
+            total += self.cycles[i]
+        return total
+
+    # print a page heat map: 16 rows of 16 pages, one character per page scaled to the busiest page
+    def show_heat (self, counts, title):
+        busiest = max(counts)
+        print("%s, busiest page %d cycles" % (title, busiest))
+        print("     " + "".join("%x" % col for col in range(16)))
+        for row in range(16):
+            line = ""
+            for col in range(16):
+                c = counts[row * 16 + col]
+                line += HEAT_CHARS[0 if c == 0 else 1 + (c * (len(HEAT_CHARS) - 2)) // busiest]
+            print("  %x0 %s" % (row, line))
+
+# disassembly of an instruction for the profiler listings; operands come from memory (emulated pages only)
+def listing (memory, emulated, pc, opcode):
+    if emulated:
+        return cupboard_opcodes.listing(pc, opcode, memory[(pc + 1) & 0xffff], memory[(pc + 2) & 0xffff])
+    return "%04x  %02x        %s ?" % (pc, opcode, cupboard_opcodes.MNEMONICS[cupboard_opcodes.opcode_mnemonic[opcode]])
@@ -0,0 +1,837 @@
+# cupboard_sim.py
+# Host-side (Linux) stand-in for the M4 Grand Central so the Cupboard firmwares run unchanged off-board.
+#
+# install() puts simulated board, digitalio, supervisor, microcontroller and memorymap modules into sys.modules.
+# All pins live in one SimPins register file (a SimPortRegisters from cupboard_bus.py), so the per-pin
+# (digitalio) and bulk port (memorymap) bus backends see exactly the same simulated wires.
+#
+# Run a firmware:  python3 cupboard_sim.py emon6502.py -c "C 10" -c "V"
+#                  python3 cupboard_sim.py ../eep/eep_grandcentral/eep.circuitpy.py --eeprom -i   (simulated 28C256)
+#                  python3 cupboard_sim.py cupboard6502.py --cpu -c "C 40"    (software 65C02 on the CPU pins)
+#                  python3 cupboard_sim.py cupboard6502.py --cpu --profile Z80 -c "C 40"   (bus-level Z80)
+
+import sys
+import os
+import types
+import random
+import select
+import builtins
+import importlib.util
+import argparse
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import cupboard_bus
+import cpu65c02
+
+NUM_DIGITAL_PINS = 54  # D0..D53 on the Grand Central
+LED_PIN          = 13  # board.LED is D13
+
+registers   = None     # SimPins instance shared by every simulated pin
+input_queue = deque()  # scripted serial input lines, consumed before real stdin
+exit_when_idle = False # scripted run: stop the firmware once input_queue is empty
+
+# -----------------------------------------------------------------------------------------------------------
+# Pins and the register file behind them
+# -----------------------------------------------------------------------------------------------------------
+
+# one physical pin: port group and bit, plus the board name it was created for
+class SimPin:
+    def __init__ (self, name, group, bit):
+        self.name = name
+        self.group = group
+        self.bit = bit
+        self.mask = 1 << bit
+
+    def __repr__ (self):
+        return "board.%s" % self.name
+
+# register file with watchers that fire when Cupboard changes an output latch (e.g. the clock pin)
+class SimPins(cupboard_bus.SimPortRegisters):
+    def __init__ (self):
+        super().__init__()
+        self.watchers = [[] for _ in range(cupboard_bus.SAMD51_NUM_GROUPS)]  # per group: [(mask, callback), ...]
+
+    # callback(level) whenever Cupboard changes the output value of pin
+    def watch (self, pin, callback):
+        self.watchers[pin.group].append((pin.mask, callback))
+
+    def _notify (self, group, old):
+        changed = old ^ self.out[group]
+        if changed:
+            for mask, callback in self.watchers[group]:
+                if changed & mask:
+                    callback(1 if self.out[group] & mask else 0)
+
+    def write_outset (self, group, mask):
+        old = self.out[group]
+        self.out[group] = old | mask
+        self._notify(group, old)
+
+    def write_outclr (self, group, mask):
+        old = self.out[group]
+        self.out[group] = old & ~mask
+        self._notify(group, old)
+
+    # far side drives a single pin
+    def drive (self, pin, value):
+        self.ext_drive[pin.group] |= pin.mask
+        if value:
+            self.ext_value[pin.group] |= pin.mask
+        else:
+            self.ext_value[pin.group] &= ~pin.mask
+
+    # far side stops driving a single pin
+    def release (self, pin):
+        self.ext_drive[pin.group] &= ~pin.mask
+
+    # level on a pin as the far side sees it (whoever drives it); idle = level of an undriven (pulled) line
+    def level (self, pin, idle=0):
+        group = pin.group
+        if self.dir[group] & pin.mask:
+            return 1 if self.out[group] & pin.mask else 0
+        if self.ext_drive[group] & pin.mask:
+            return 1 if self.ext_value[group] & pin.mask else 0
+        return idle
+
+    # True if Cupboard is driving the pin
+    def driven (self, pin):
+        return (self.dir[pin.group] & pin.mask) != 0
+
+# fast far-side access to a group of pins (a bus), least-significant line first
+class SimBusDriver:
+    def __init__ (self, pins, regs):
+        self.regs = regs
+        bits = [(p.group, p.bit) for p in pins]
+        self._read = cupboard_bus.build_read_tables(bits)
+        self._write = cupboard_bus.build_write_tables(bits)
+
+    # far side drives the value onto the bus
+    def drive (self, value):
+        regs = self.regs
+        for group, mask, lanes in self._write:
+            bits = 0
+            for shift, table in lanes:
+                bits |= table[(value >> shift) & 0xff]
+            regs.ext_value[group] = (regs.ext_value[group] & ~mask) | bits
+            regs.ext_drive[group] |= mask
+
+    # far side stops driving the bus
+    def release (self):
+        regs = self.regs
+        for group, mask, _ in self._write:
+            regs.ext_drive[group] &= ~mask
+
+    # value Cupboard is driving onto the bus (lines it doesn't drive read as 0)
+    def read (self):
+        regs = self.regs
+        value = 0
+        for group, lanes in self._read:
+            reg = regs.out[group] & regs.dir[group]
+            for shift, table in lanes:
+                value |= table[(reg >> shift) & 0xff]
+        return value
+
+    # True if Cupboard drives any line of the bus
+    def driven (self):
+        regs = self.regs
+        for group, mask, _ in self._write:
+            if regs.dir[group] & mask:
+                return True
+        return False
+
+    # lines driven by both sides at once
+    def contention (self):
+        regs = self.regs
+        for group, mask, _ in self._write:
+            if regs.dir[group] & regs.ext_drive[group] & mask:
+                return True
+        return False
+
+# -----------------------------------------------------------------------------------------------------------
+# Virtual CPUs
+# -----------------------------------------------------------------------------------------------------------
+
+# the simulated pin behind one of a firmware's CPU signals: from its CPU profile (cupboard6502.py's cpu) or from
+# its pin_<name> globals (emon6502.py); None if the firmware doesn't wire the signal
+def firmware_pin (fw, signal):
+    cpu = getattr(fw, "cpu", None)
+    if cpu is not None and hasattr(cpu, "pins"):
+        pin = cpu.pins.get(signal)
+    else:
+        pin = getattr(fw, "pin_" + {"PHI2": "clk"}.get(signal, signal.lower()), None)
+    return pin._pin if pin is not None else None
+
+# a software 65C02 wired to a monitor firmware's CPU pins (emon6502.py / cupboard6502.py), clocked by PHI2
+# memory: the "physical" RAM/ROM on the CPU side, answering the addresses the monitor doesn't emulate
+# (those where the firmware's is_emulated_memory() is False); defaults to the firmware's emulated_memory image
+class SimCPU65C02:
+    def __init__ (self, fw, memory=None, cpu=None):
+        self.fw = fw
+        self.regs = registers
+        self.cpu = cpu if cpu is not None else cpu65c02.CPU65C02()
+        self.cpu.use_bus()
+        self.memory = memory if memory is not None else fw.emulated_memory
+        self.addr = SimBusDriver([p._pin for p in fw.pins_addr], registers)
+        self.data = SimBusDriver([p._pin for p in fw.pins_data], registers)
+        self.pin_rw = firmware_pin(fw, "RW")
+        self.pin_sync = firmware_pin(fw, "SYNC")
+        self.pin_vpb = firmware_pin(fw, "VPB")
+        self.pin_mlb = firmware_pin(fw, "MLB")
+        self.pin_rst = firmware_pin(fw, "RST")
+        self.pin_irq = firmware_pin(fw, "IRQ")
+        self.pin_nmi = firmware_pin(fw, "NMI")
+        self.pin_rdy = firmware_pin(fw, "RDY")
+        self.pin_so = firmware_pin(fw, "SO")
+        self.cycle = None           # (addr, rw, sync, vpb, mlb, write_value) on the bus now
+        self.claimed = False        # current cycle is answered by self.memory
+        self.nmi_level = 1
+        self.so_level = 1
+        self.contention = 0         # cycles where both sides drove the data bus
+        for pin, value in ((self.pin_rw, 1), (self.pin_sync, 0), (self.pin_vpb, 1), (self.pin_mlb, 1)):
+            registers.drive(pin, value)
+        registers.watch(firmware_pin(fw, "PHI2"), self.on_clock)
+
+    # True if the CPU-side memory answers this address
+    def claims (self, address):
+        served = getattr(self.fw, "is_emulated_memory", None)
+        return served is not None and not served(address)
+
+    def on_clock (self, level):
+        if level:
+            self._rising()
+        else:
+            self._falling()
+
+    # PHI2 rises: the CPU (write) or CPU-side memory (read) drives the data bus
+    def _rising (self):
+        c = self.cycle
+        if c is None:
+            return
+        if not c[1]:
+            self.data.drive(c[5])
+        elif self.claimed:
+            self.data.drive(self.memory[c[0]])
+
+    # PHI2 falls: finish the current cycle, then start the next one
+    def _falling (self):
+        regs = self.regs
+        c = self.cycle
+        data = 0xff  # floating bus
+        if c is not None:
+            if self.data.contention():
+                self.contention += 1
+            if c[1]:
+                if self.data.driven():
+                    data = self.data.read()
+                elif self.claimed:
+                    data = self.memory[c[0]]
+            elif self.claimed:
+                self.memory[c[0]] = c[5]
+        self.data.release()
+        if not regs.level(self.pin_rst, 1):
+            self.cpu.reset()
+            self.cycle = None
+            return
+        if self.pin_rdy is not None and not regs.level(self.pin_rdy, 1) and c is not None:
+            return  # RDY low: hold the current cycle
+        nmi = regs.level(self.pin_nmi, 1)
+        if self.nmi_level and not nmi:
+            self.cpu.nmi_edge = True
+        self.nmi_level = nmi
+        if self.pin_so is not None:
+            so = regs.level(self.pin_so, 1)
+            if self.so_level and not so:
+                self.cpu.so_edge = True
+            self.so_level = so
+        self.cpu.irq_line = not regs.level(self.pin_irq, 1)
+        c = self.cpu.bus_cycle(data)
+        self.cycle = c
+        self.claimed = self.claims(c[0])
+        self.addr.drive(c[0])
+        regs.drive(self.pin_rw, c[1])
+        regs.drive(self.pin_sync, c[2])
+        regs.drive(self.pin_vpb, c[3])
+        regs.drive(self.pin_mlb, c[4])
+
+# a bus-level Z80 on cupboard6502.py's Z80 profile pins, clocked by CLK. A small instruction subset (NOP, LD A,n,
+# LD A,(nn), LD (nn),A, INC A, JP nn, IN A,(n), OUT (n),A; anything else runs as a NOP) produces every machine cycle
+# type: opcode fetch with refresh (4 T), memory read and write (3 T), I/O read and write (4 T, with the automatic
+# wait state). The strobes change on the clock edges the datasheet gives them. Only RESET is acted on.
+class SimCPUZ80:
+    # T-states of each machine cycle type
+    LENGTH = {"M1": 4, "MR": 3, "MW": 3, "IOR": 4, "IOW": 4}
+
+    def __init__ (self, fw):
+        self.fw = fw
+        self.regs = registers
+        self.addr = SimBusDriver([p._pin for p in fw.pins_addr], registers)
+        self.data = SimBusDriver([p._pin for p in fw.pins_data], registers)
+        self.strobes = {}
+        for name in ("M1", "MREQ", "IORQ", "RD", "WR", "RFSH", "HALT", "BUSAK"):
+            self.strobes[name] = firmware_pin(fw, name)
+            registers.drive(self.strobes[name], 1)
+        self.pin_reset = firmware_pin(fw, "RESET")
+        self.core = None            # machine cycle generator, None while in reset
+        self.mcycle = None          # (type, address, write value) running now
+        self.t = 0                  # its T-state, from 1
+        self.value = 0              # data sampled by the last read
+        self.r = 0                  # refresh counter
+        self.contention = 0         # clock edges where both sides drove the data bus
+        self.machine_cycles = 0
+        registers.watch(firmware_pin(fw, "CLK"), self.on_clock)
+
+    def _set (self, name, active):
+        self.regs.drive(self.strobes[name], 0 if active else 1)
+
+    # data on the bus as the CPU samples it (floating bus reads ff)
+    def _sample (self):
+        return self.data.read() if self.data.driven() else 0xff
+
+    def _reset (self):
+        self.core = None
+        self.mcycle = None
+        for name in ("M1", "MREQ", "IORQ", "RD", "WR", "RFSH"):
+            self._set(name, False)
+        self.data.release()
+
+    def on_clock (self, level):
+        if self.data.contention():
+            self.contention += 1
+        if not self.regs.level(self.pin_reset, 1):
+            self._reset()
+            return
+        if level:
+            self._rising()
+        elif self.mcycle is not None:
+            self._falling()
+
+    def _rising (self):
+        if self.core is None:
+            self.core = self._run()
+            self.mcycle = next(self.core)
+            self.t = 0
+        elif self.t == self.LENGTH[self.mcycle[0]]:
+            self.mcycle = self.core.send(self.value)
+            self.t = 0
+        self.t += 1
+        kind, address, _ = self.mcycle
+        t = self.t
+        if t == 1:
+            self.machine_cycles += 1
+            self._set("RFSH", False)
+            self.data.release()      # write data is held until the next machine cycle
+            self.addr.drive(address)
+            if kind == "M1":
+                self._set("M1", True)
+        elif kind == "M1" and t == 3:
+            # opcode sampled on the rising edge of T3, then the refresh address goes out
+            self.value = self._sample()
+            self._set("M1", False)
+            self._set("MREQ", False)
+            self._set("RD", False)
+            self._set("RFSH", True)
+            self.addr.drive(self.r)
+            self.r = (self.r + 1) & 0x7f
+        elif kind in ("IOR", "IOW") and t == 2:
+            self._set("IORQ", True)
+            self._set("RD" if kind == "IOR" else "WR", True)
+
+    def _falling (self):
+        kind, address, value = self.mcycle
+        t = self.t
+        if kind == "M1":
+            if t == 1:
+                self._set("MREQ", True)
+                self._set("RD", True)
+            elif t == 3:
+                self._set("MREQ", True)   # refresh
+            elif t == 4:
+                self._set("MREQ", False)
+        elif kind == "MR":
+            if t == 1:
+                self._set("MREQ", True)
+                self._set("RD", True)
+            elif t == 3:
+                self.value = self._sample()
+                self._set("MREQ", False)
+                self._set("RD", False)
+        elif kind == "MW":
+            if t == 1:
+                self._set("MREQ", True)
+                self.data.drive(value)
+            elif t == 2:
+                self._set("WR", True)
+            elif t == 3:
+                self._set("MREQ", False)
+                self._set("WR", False)
+        else:
+            if t == 1 and kind == "IOW":
+                self.data.drive(value)
+            elif t == 4:
+                if kind == "IOR":
+                    self.value = self._sample()
+                self._set("IORQ", False)
+                self._set("RD", False)
+                self._set("WR", False)
+
+    # the instruction subset, as machine cycles; reads receive the sampled data
+    def _run (self):
+        pc = 0
+        a = 0
+        while True:
+            op = yield ("M1", pc, 0)
+            pc = (pc + 1) & 0xffff
+            if op == 0x3e:                     # LD A,n
+                a = yield ("MR", pc, 0)
+                pc = (pc + 1) & 0xffff
+            elif op == 0x3c:                   # INC A
+                a = (a + 1) & 0xff
+            elif op in (0x3a, 0x32, 0xc3):     # LD A,(nn) / LD (nn),A / JP nn
+                lo = yield ("MR", pc, 0)
+                hi = yield ("MR", (pc + 1) & 0xffff, 0)
+                pc = (pc + 2) & 0xffff
+                nn = lo | (hi << 8)
+                if op == 0x3a:
+                    a = yield ("MR", nn, 0)
+                elif op == 0x32:
+                    yield ("MW", nn, a)
+                else:
+                    pc = nn
+            elif op in (0xdb, 0xd3):           # IN A,(n) / OUT (n),A: port address A:n
+                n = yield ("MR", pc, 0)
+                pc = (pc + 1) & 0xffff
+                if op == 0xdb:
+                    a = yield ("IOR", (a << 8) | n, 0)
+                else:
+                    yield ("IOW", (a << 8) | n, a)
+
+# a bus-level 6809E on cupboard6502.py's 6809E profile pins: one bus cycle per E clock, started when E falls
+# (address, R/W, BS/BA and LIC change), write data driven when E rises. A small instruction subset (NOP, LDA #n,
+# LDA ext, STA ext, INCA, JMP ext, BRA; anything else runs as a NOP) with the datasheet's cycle-by-cycle bus
+# activity, dummy cycles at FFFF, and the reset vector fetch. Only RESET is acted on.
+class SimCPU6809E:
+    def __init__ (self, fw):
+        self.fw = fw
+        self.regs = registers
+        self.addr = SimBusDriver([p._pin for p in fw.pins_addr], registers)
+        self.data = SimBusDriver([p._pin for p in fw.pins_data], registers)
+        self.pin_rw = firmware_pin(fw, "RW")
+        self.pin_bs = firmware_pin(fw, "BS")
+        self.pin_ba = firmware_pin(fw, "BA")
+        self.pin_lic = firmware_pin(fw, "LIC")
+        self.pin_reset = firmware_pin(fw, "RESET")
+        for pin, value in ((self.pin_rw, 1), (self.pin_bs, 0), (self.pin_ba, 0), (self.pin_lic, 0),
+                           (firmware_pin(fw, "AVMA"), 1), (firmware_pin(fw, "BUSY"), 0)):
+            registers.drive(pin, value)
+        self.core = None            # bus cycle generator, None while in reset
+        self.cycle = None           # (address, rw, bs, lic, write value) on the bus now
+        self.contention = 0
+        self.cycles = 0
+        registers.watch(firmware_pin(fw, "E"), self.on_clock)
+
+    def on_clock (self, level):
+        if self.data.contention():
+            self.contention += 1
+        if level:
+            if self.cycle is not None and not self.cycle[1]:
+                self.data.drive(self.cycle[4])
+            return
+        # E falls: the CPU latches read data and the next cycle starts
+        data = self.data.read() if self.data.driven() else 0xff
+        self.data.release()
+        if not self.regs.level(self.pin_reset, 1):
+            self.core = None
+            self.cycle = None
+            return
+        if self.core is None:
+            self.core = self._run()
+            self.cycle = next(self.core)
+        else:
+            self.cycle = self.core.send(data)
+        self.cycles += 1
+        address, rw, bs, lic, _ = self.cycle
+        self.addr.drive(address)
+        self.regs.drive(self.pin_rw, rw)
+        self.regs.drive(self.pin_bs, bs)
+        self.regs.drive(self.pin_lic, lic)
+
+    # bus cycles (address, rw, bs, lic, write value); reads receive the data latched
+    def _run (self):
+        yield (0xffff, 1, 0, 0, 0)
+        yield (0xffff, 1, 0, 0, 0)
+        hi = yield (0xfffe, 1, 1, 0, 0)
+        lo = yield (0xffff, 1, 1, 0, 0)
+        yield (0xffff, 1, 0, 1, 0)
+        pc = (hi << 8) | lo
+        a = 0
+        while True:
+            op = yield (pc, 1, 0, 0, 0)
+            pc = (pc + 1) & 0xffff
+            if op == 0x86:                       # LDA #n
+                a = yield (pc, 1, 0, 1, 0)
+                pc = (pc + 1) & 0xffff
+            elif op in (0xb6, 0xb7, 0x7e):       # LDA ext / STA ext / JMP ext
+                hi = yield (pc, 1, 0, 0, 0)
+                lo = yield ((pc + 1) & 0xffff, 1, 0, 0, 0)
+                pc = (pc + 2) & 0xffff
+                ea = (hi << 8) | lo
+                yield (0xffff, 1, 0, 1 if op == 0x7e else 0, 0)
+                if op == 0xb6:
+                    a = yield (ea, 1, 0, 1, 0)
+                elif op == 0xb7:
+                    yield (ea, 0, 0, 1, a)
+                else:
+                    pc = ea
+            elif op == 0x20:                     # BRA
+                offset = yield (pc, 1, 0, 0, 0)
+                pc = (pc + 1) & 0xffff
+                yield (0xffff, 1, 0, 1, 0)
+                pc = (pc + offset - (256 if offset & 0x80 else 0)) & 0xffff
+            else:                                # NOP, INCA and the rest: inherent, 2 cycles
+                if op == 0x4c:
+                    a = (a + 1) & 0xff
+                yield (pc, 1, 0, 1, 0)
+
+# the simulated CPU for a firmware: the one matching its CPU profile, the 65C02 if it has none
+def attach_cpu (fw):
+    cpu = getattr(fw, "cpu", None)
+    name = cpu.profile.name if cpu is not None and hasattr(cpu, "profile") else "65C02"
+    return {"65C02": SimCPU65C02, "Z80": SimCPUZ80, "6809E": SimCPU6809E}[name](fw)
+
+# -----------------------------------------------------------------------------------------------------------
+# Virtual EEPROM
+# -----------------------------------------------------------------------------------------------------------
+
+# a 28C256 on the EEP programmer's pins (eep.circuitpy.py): address latched when WE falls, data when it rises.
+# Loads into one 64-byte page follow each other within the byte-load window (tBLC); when it runs out, or the chip is
+# read, the page is written in a single write cycle (tWC). During the cycle reads return DATA polling: bit 7 the
+# complement of the last byte loaded, bit 6 toggling on every read. The software data protection sequences are
+# recognised: once locked, loads only count when the lock sequence precedes them.
+class SimEEPROM28C256:
+    SIZE        = 32768
+    PAGE        = 64
+    SDP_LOCK    = [(0x5555, 0xaa), (0x2aaa, 0x55), (0x5555, 0xa0)]
+    SDP_UNLOCK  = [(0x5555, 0xaa), (0x2aaa, 0x55), (0x5555, 0x80), (0x5555, 0xaa), (0x2aaa, 0x55), (0x5555, 0x20)]
+
+    def __init__ (self, fw, write_cycle_ns=5000000, load_window_ns=150000, image=None):
+        self.regs = registers
+        self.memory = bytearray(image) if image is not None else bytearray(b'\xff' * self.SIZE)
+        self.write_cycle_ns = write_cycle_ns
+        self.load_window_ns = load_window_ns
+        self.addr = SimBusDriver([p._pin for p in fw.pins_addr], registers)
+        self.data = SimBusDriver([p._pin for p in fw.pins_data], registers)
+        self.pin_we = fw.pin_we._pin
+        self.pin_oe = fw.pin_oe._pin
+        self.pin_ce = fw.pin_ce._pin
+        self.latched = 0            # address latched by the last WE falling edge
+        self.page = {}              # offset in page: byte, loaded and not yet written
+        self.page_base = 0
+        self.last_load_ns = 0
+        self.last = (0, 0)          # (address, data) of the last byte loaded
+        self.busy_until_ns = 0      # end of the write cycle in progress, 0 = none
+        self.toggle = 0
+        self.recent = []            # last few loads, for the SDP sequences
+        self.sdp = False
+        self.sdp_open = False       # lock sequence given: loads in this window are written
+        self.write_cycles = 0
+        self.bytes_written = 0
+        self.reads = 0
+        self.contention = 0
+        registers.watch(self.pin_we, self.on_we)
+        registers.watch(self.pin_oe, self.on_output)
+        registers.watch(self.pin_ce, self.on_output)
+        for p in fw.pins_addr:
+            registers.watch(p._pin, self.on_address)
+
+    def _active (self, pin):
+        return not self.regs.level(pin, 1)
+
+    # finish the load window and the write cycle if their time is up
+    def _update (self, now):
+        if (self.page or self.sdp_open) and now - self.last_load_ns > self.load_window_ns:
+            self._start_cycle(self.last_load_ns + self.load_window_ns)
+        if self.busy_until_ns and now >= self.busy_until_ns:
+            for offset, value in self.page.items():
+                self.memory[self.page_base + offset] = value
+            self.bytes_written += len(self.page)
+            self.page = {}
+            self.busy_until_ns = 0
+            self.sdp_open = False
+
+    def _start_cycle (self, start):
+        if self.busy_until_ns == 0:
+            self.busy_until_ns = start + self.write_cycle_ns
+            self.write_cycles += 1
+
+    def on_we (self, level):
+        if not self._active(self.pin_ce):
+            return
+        if not level:
+            self.latched = self.addr.read() & (self.SIZE - 1)
+            return
+        now = time.monotonic_ns()
+        self._update(now)
+        if self.busy_until_ns:
+            return  # loads during a write cycle are ignored
+        address, value = self.latched, self.data.read()
+        self.recent = (self.recent + [(address, value)])[-6:]
+        if self.recent == self.SDP_UNLOCK:
+            self.sdp = False
+            self.page = {}
+            return
+        if self.recent[-3:] == self.SDP_LOCK:
+            # enables SDP if it isn't already; bytes loaded in the rest of the window are written
+            self.sdp = True
+            self.sdp_open = True
+            self.page = {}
+            self.last_load_ns = now
+            return
+        if self.sdp and not self.sdp_open:
+            return
+        if not self.page:
+            self.page_base = address & ~(self.PAGE - 1)
+        self.page[address & (self.PAGE - 1)] = value
+        self.last = (self.page_base | (address & (self.PAGE - 1)), value)
+        self.last_load_ns = now
+
+    def on_address (self, level):
+        if self._active(self.pin_oe):
+            self.on_output(level)
+
+    # OE, CE or the address changed: drive the addressed byte (or the polling status) while both are low
+    def on_output (self, level):
+        if self.data.contention():
+            self.contention += 1
+        if not (self._active(self.pin_ce) and self._active(self.pin_oe)) or self._active(self.pin_we):
+            self.data.release()
+            return
+        now = time.monotonic_ns()
+        if (self.page or self.sdp_open) and not self.busy_until_ns:
+            self._start_cycle(now)  # reading ends the load window
+        self._update(now)
+        self.reads += 1
+        if self.busy_until_ns:
+            self.toggle ^= 0x40
+            self.data.drive(((self.last[1] ^ 0x80) & 0x80) | self.toggle | (self.last[1] & 0x3f))
+        else:
+            self.data.drive(self.memory[self.addr.read() & (self.SIZE - 1)])
+
+# -----------------------------------------------------------------------------------------------------------
+# Simulated CircuitPython modules
+# -----------------------------------------------------------------------------------------------------------
+
+def _make_board (regs):
+    board = types.ModuleType("board")
+    mcu_pin = types.ModuleType("microcontroller.pin")
+    # a fixed, deliberately scattered pin-to-port assignment so the port backend's permutation tables get exercised
+    slots = random.Random(6502).sample(range(cupboard_bus.SAMD51_NUM_GROUPS * 32), NUM_DIGITAL_PINS)
+    for n, slot in enumerate(slots):
+        group, bit = slot // 32, slot % 32
+        pin = SimPin("D%d" % n, group, bit)
+        setattr(board, pin.name, pin)
+        setattr(mcu_pin, "P%s%02d" % ("ABCD"[group], bit), pin)
+    board.LED = getattr(board, "D%d" % LED_PIN)
+    return board, mcu_pin
+
+def _make_digitalio (regs):
+    digitalio = types.ModuleType("digitalio")
+
+    class Direction:
+        INPUT = "INPUT"
+        OUTPUT = "OUTPUT"
+
+    class Pull:
+        UP = "UP"
+        DOWN = "DOWN"
+
+    class DriveMode:
+        PUSH_PULL = "PUSH_PULL"
+        OPEN_DRAIN = "OPEN_DRAIN"
+
+    class DigitalInOut:
+        def __init__ (self, pin):
+            self._pin = pin
+            self._group = pin.group
+            self._mask = pin.mask
+            self.pull = None
+            regs.write_dirclr(pin.group, pin.mask)
+
+        def deinit (self):
+            regs.write_dirclr(self._group, self._mask)
+
+        @property
+        def direction (self):
+            return Direction.OUTPUT if regs.dir[self._group] & self._mask else Direction.INPUT
+
+        @direction.setter
+        def direction (self, d):
+            if d == Direction.OUTPUT:
+                regs.write_dirset(self._group, self._mask)
+            else:
+                regs.write_dirclr(self._group, self._mask)
+
+        @property
+        def value (self):
+            return (regs.read_in(self._group) & self._mask) != 0
+
+        @value.setter
+        def value (self, v):
+            if v:
+                regs.write_outset(self._group, self._mask)
+            else:
+                regs.write_outclr(self._group, self._mask)
+
+        def switch_to_output (self, value=False, drive_mode=DriveMode.PUSH_PULL):
+            self.value = value
+            regs.write_dirset(self._group, self._mask)
+
+        def switch_to_input (self, pull=None):
+            self.pull = pull
+            regs.write_dirclr(self._group, self._mask)
+
+    digitalio.Direction = Direction
+    digitalio.Pull = Pull
+    digitalio.DriveMode = DriveMode
+    digitalio.DigitalInOut = DigitalInOut
+    return digitalio
+
+def _make_memorymap (regs):
+    memorymap = types.ModuleType("memorymap")
+
+    # the SAMD51 PORT block as seen through memorymap, backed by the simulated register file
+    class AddressRange:
+        def __init__ (self, start, length):
+            self._start = start
+            self._length = length
+
+        def _split (self, key):
+            offset = self._start - cupboard_bus.SAMD51_PORT_BASE + key.start
+            return offset // cupboard_bus.SAMD51_GROUP_SIZE, offset % cupboard_bus.SAMD51_GROUP_SIZE
+
+        def __getitem__ (self, key):
+            group, reg = self._split(key)
+            if reg == cupboard_bus.SAMD51_REG_IN:
+                value = regs.read_in(group)
+            elif reg == 0x00:
+                value = regs.dir[group]
+            elif reg == 0x10:
+                value = regs.out[group]
+            else:
+                value = 0
+            return value.to_bytes(4, "little")
+
+        def __setitem__ (self, key, data):
+            group, reg = self._split(key)
+            value = int.from_bytes(data, "little")
+            if reg == cupboard_bus.SAMD51_REG_OUTSET:
+                regs.write_outset(group, value)
+            elif reg == cupboard_bus.SAMD51_REG_OUTCLR:
+                regs.write_outclr(group, value)
+            elif reg == cupboard_bus.SAMD51_REG_DIRSET:
+                regs.write_dirset(group, value)
+            elif reg == cupboard_bus.SAMD51_REG_DIRCLR:
+                regs.write_dirclr(group, value)
+
+    memorymap.AddressRange = AddressRange
+    return memorymap
+
+def _make_supervisor ():
+    supervisor = types.ModuleType("supervisor")
+
+    class Runtime:
+        @property
+        def serial_bytes_available (self):
+            if len(input_queue) > 0:
+                return len(input_queue[0]) + 1
+            if exit_when_idle:
+                raise SystemExit(0)
+            if sys.stdin.isatty() and select.select([sys.stdin], [], [], 0)[0]:
+                return 1
+            return 0
+
+    supervisor.runtime = Runtime()
+    return supervisor
+
+# serial input: scripted lines first (echoed like a terminal would), then the real console
+def _sim_input (prompt=""):
+    if len(input_queue) > 0:
+        line = input_queue.popleft()
+        print(prompt + line)
+        return line
+    return _real_input(prompt)
+
+_real_input = builtins.input
+
+# install the simulated modules; call before importing a firmware
+def install ():
+    global registers
+    if registers is not None:
+        return registers
+    registers = SimPins()
+    board, mcu_pin = _make_board(registers)
+    microcontroller = types.ModuleType("microcontroller")
+    microcontroller.pin = mcu_pin
+    sys.modules["board"] = board
+    sys.modules["microcontroller"] = microcontroller
+    sys.modules["microcontroller.pin"] = mcu_pin
+    sys.modules["digitalio"] = _make_digitalio(registers)
+    sys.modules["memorymap"] = _make_memorymap(registers)
+    sys.modules["supervisor"] = _make_supervisor()
+    builtins.input = _sim_input
+    return registers
+
+# queue a line of serial input for the firmware
+def feed (line):
+    input_queue.append(line)
+
+# load a firmware file (as the board would load code.py) without starting main(); returns the module
+def load_firmware (path):
+    install()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    spec = importlib.util.spec_from_file_location("firmware", path)
+    fw = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fw)
+    return fw
+
+# -----------------------------------------------------------------------------------------------------------
+# MAIN
+# -----------------------------------------------------------------------------------------------------------
+def main ():
+    global exit_when_idle
+    parser = argparse.ArgumentParser(description='Run a Cupboard firmware against simulated Grand Central pins')
+    parser.add_argument('firmware', type=str, help='firmware file, e.g. emon6502.py')
+    parser.add_argument('-c', '--command', action='append', default=[], help='serial command to send (repeatable)')
+    parser.add_argument('-i', '--interactive', action="store_true", help='keep reading the console after the commands')
+    parser.add_argument('--cpu', action="store_true", help='attach a software CPU (the firmware\'s CPU profile, default 65C02) to the CPU pins')
+    parser.add_argument('--eeprom', action="store_true", help='attach a simulated 28C256 to the EEP programmer pins')
+    parser.add_argument('--profile', type=str, help='CPU profile for cupboard6502.py (sets CUPBOARD_CPU), e.g. Z80')
+    parser.add_argument('--fast', type=int, default=0, help='skip the monitor: reset memory, run this many cycles on the fast path')
+    args = parser.parse_args()
+    for c in args.command:
+        feed(c)
+    exit_when_idle = not args.interactive
+    if args.profile:
+        os.environ["CUPBOARD_CPU"] = args.profile
+    fw = load_firmware(args.firmware)
+    if args.fast:
+        fw.reset_memory()
+        cpu = cpu65c02.CPU65C02(fw.emulated_memory)
+        start_ns = time.monotonic_ns()
+        cpu.run(args.fast)
+        elapsed = time.monotonic_ns() - start_ns
+        print("%d cycles in %.3f s = %d cycles/s, PC=%04x A=%02x X=%02x Y=%02x SP=%02x P=%02x" %
+              (cpu.cycles, elapsed / 1e9, cpu.cycles * 1e9 / elapsed, cpu.pc, cpu.a, cpu.x, cpu.y, cpu.sp, cpu.p))
+        return
+    sim_cpu = attach_cpu(fw) if args.cpu else None
+    if args.eeprom:
+        SimEEPROM28C256(fw)
+    try:
+        fw.main()
+    finally:
+        if sim_cpu is not None and sim_cpu.contention:
+            sys.stderr.write("%d cycles with data bus contention\n" % sim_cpu.contention)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# cupboard_snapshot.py
+# Named snapshots of emulated memory, restored with bulk copies instead of refilling memory byte by byte.
+#
+# The power-on image is kept whole; every other snapshot keeps only the 256-byte pages that differ from it.
+# Restoring copies the power-on image back in one slice assignment and then writes the snapshot's pages.
+
+import time
+
+POWER_ON  = "POWERON"   # name of the built-in snapshot
+PAGE_SIZE = 256
+
+class Snapshots:
+    def __init__ (self, memory):
+        self.memory = memory
+        self.base = bytes(memory)  # power-on image
+        self.saved = {}            # name: {page: page bytes}
+
+    # capture the pages of memory that differ from the power-on image; returns the number of pages kept
+    def save (self, name):
+        memory = self.memory
+        base = self.base
+        pages = {}
+        for page in range(len(memory) // PAGE_SIZE):
+            a = page * PAGE_SIZE
+            if memory[a:a + PAGE_SIZE] != base[a:a + PAGE_SIZE]:
+                pages[page] = bytes(memory[a:a + PAGE_SIZE])
+        self.saved[name] = pages
+        return len(pages)
+
+    # put memory back to a snapshot; returns the time taken in ns, or None for an unknown name
+    def restore (self, name=POWER_ON):
+        if name != POWER_ON and name not in self.saved:
+            return None
+        t0 = time.monotonic_ns()
+        memory = self.memory
+        memory[:] = self.base
+        if name != POWER_ON:
+            for page, data in self.saved[name].items():
+                a = page * PAGE_SIZE
+                memory[a:a + PAGE_SIZE] = data
+        return time.monotonic_ns() - t0
+
+    def delete (self, name):
+        return self.saved.pop(name, None) is not None
+
+    # (name, pages) for every snapshot, power-on first
+    def list (self):
+        return [(POWER_ON, len(self.memory) // PAGE_SIZE)] + sorted((name, len(pages)) for name, pages in self.saved.items())
@@ -0,0 +1,98 @@
+# cupboard_stats.py
+# Self-instrumentation for the monitors' bus loop: time spent in each phase of a clock cycle, cycle time
+# min/avg/max, the clock rate that gives and a histogram of cycle times (jitter).
+#
+# Only sampled cycles are timed, about 1 in SAMPLE_INTERVAL. The gap between samples is varied pseudo-randomly
+# (SAMPLE_INTERVAL/2 .. 3*SAMPLE_INTERVAL/2) so that sampling doesn't lock onto a program loop with the same period.
+# Unsampled cycles cost the loop a countdown. A sampled cycle reads time.monotonic_ns() six times; the cost of a
+# reading is measured by clear() and taken off the phase times it inflates.
+#
+#   stats.countdown -= 1; if <= 0: t0..t5 = phase boundaries, stats.record(t0, t1, t2, t3, t4, t5)
+#   stats.countdown = stats.next_interval()
+
+import array
+import time
+
+SAMPLE_INTERVAL = 64
+PHASES = ("clock low", "address + status", "clock high", "data", "output + delay")
+HIST_BINS = 16   # bin k: cycle time 2^k .. 2^(k+1) us (bin 0 includes under 1 us)
+
+class CycleStats:
+    def __init__ (self):
+        self.phase_ns = array.array('L', [0] * len(PHASES))
+        self.hist = array.array('L', [0] * HIST_BINS)
+        self.seed = 0x2f6b
+        self.clear()
+
+    def clear (self):
+        for a in (self.phase_ns, self.hist):
+            for i in range(len(a)):
+                a[i] = 0
+        self.samples = 0
+        self.total_ns = 0
+        self.total_sq = 0        # sum of squared cycle times in us, for the standard deviation
+        self.min_ns = 0
+        self.max_ns = 0
+        self.countdown = self.next_interval()
+        # cost of one time reading: the smallest gap between back-to-back readings
+        best = None
+        for _ in range(16):
+            t = time.monotonic_ns()
+            gap = time.monotonic_ns() - t
+            if best is None or gap < best:
+                best = gap
+        self.timer_ns = best
+
+    # cycles until the next sample
+    def next_interval (self):
+        # 16-bit xorshift
+        x = self.seed
+        x ^= (x << 7) & 0xffff
+        x ^= x >> 9
+        x ^= (x << 8) & 0xffff
+        self.seed = x
+        return SAMPLE_INTERVAL // 2 + x % SAMPLE_INTERVAL
+
+    # timestamps of a sampled cycle: start, and the end of each phase
+    def record (self, t0, t1, t2, t3, t4, t5):
+        timer = self.timer_ns
+        phase = self.phase_ns
+        phase[0] += max(t1 - t0 - timer, 0)
+        phase[1] += max(t2 - t1 - timer, 0)
+        phase[2] += max(t3 - t2 - timer, 0)
+        phase[3] += max(t4 - t3 - timer, 0)
+        phase[4] += max(t5 - t4 - timer, 0)
+        cycle = max(t5 - t0 - 5 * timer, 0)
+        if self.samples == 0 or cycle < self.min_ns:
+            self.min_ns = cycle
+        if cycle > self.max_ns:
+            self.max_ns = cycle
+        self.samples += 1
+        self.total_ns += cycle
+        us = cycle // 1000
+        self.total_sq += us * us
+        k = 0
+        while us > 1 and k < HIST_BINS - 1:
+            us >>= 1
+            k += 1
+        self.hist[k] += 1
+
+    def report (self):
+        n = self.samples
+        if n == 0:
+            print("No cycles sampled")
+            return
+        avg = self.total_ns / n
+        avg_us = avg / 1000
+        sd = max(self.total_sq / n - avg_us * avg_us, 0) ** 0.5
+        print("%d cycles sampled (1 in about %d), timer reading %d ns" % (n, SAMPLE_INTERVAL, self.timer_ns))
+        print("Cycle time min %.1f avg %.1f max %.1f us, std dev %.1f us: %.2f kHz" % (
+            self.min_ns / 1000, avg_us, self.max_ns / 1000, sd, 1000000 / avg if avg else 0))
+        for i in range(len(PHASES)):
+            print("  %-18s %8.1f us %5.1f%%" % (PHASES[i], self.phase_ns[i] / n / 1000, self.phase_ns[i] * 100 / max(self.total_ns, 1)))
+        busiest = max(self.hist)
+        print("Cycle time histogram")
+        for k in range(HIST_BINS):
+            if self.hist[k]:
+                low = 0 if k == 0 else 1 << k
+                print("  %6d-%-6d us %7d %s" % (low, (1 << (k + 1)) - 1, self.hist[k], "#" * ((self.hist[k] * 40 + busiest - 1) // busiest)))
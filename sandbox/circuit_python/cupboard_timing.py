@@ -0,0 +1,97 @@
+# cupboard_timing.py
+# Clock-edge timing for the monitors: per-CPU minimum bus timings and a calibration of the board they run on, giving
+# the busy-wait (if any) each clock edge needs.
+#
+# The monitors used to follow every clock edge with time.sleep(0) as a settle delay. That takes ~16 us on the M4,
+# hundreds of times the 40 ns tADS/tMDS a 65C02 needs (see bus_timing_6502.md), and it capped the clock well under
+# 30 kHz. Instead:
+#   - a TimingProfile gives the CPU's minimum times in ns after the falling edge (address valid, tADS) and after the
+#     rising edge (write data valid, tMDS)
+#   - calibrate() measures, on the running board, a pin write and an empty loop iteration
+#   - the statement after an edge is at least another pin access, so an edge only waits for what the profile needs
+#     beyond one pin write, in empty loop iterations; usually that is none
+# Pulse widths (tPWL/tPWH) and read data setup/hold are covered by the bus reads and writes done in each phase,
+# which each cost more than a pin write.
+
+import time
+
+class TimingProfile:
+    def __init__ (self, name, addr_setup, write_data, read_setup, read_hold, pulse_low, pulse_high):
+        self.name = name
+        self.addr_setup = addr_setup   # tADS: PHI2 falling to address and R/W valid
+        self.write_data = write_data   # tMDS: PHI2 rising to write data valid
+        self.read_setup = read_setup   # tDSR: read data setup before PHI2 falls
+        self.read_hold = read_hold     # tDHR: read data hold after PHI2 falls
+        self.pulse_low = pulse_low     # tPWL: minimum PHI2 low time
+        self.pulse_high = pulse_high   # tPWH: minimum PHI2 high time
+
+# minimum times in ns, from the datasheets (W65C02S at 5 V; MOS 6502 at 1 MHz; Z80 at 4 MHz; MC6809E at 1 MHz).
+# For CPUs without PHI2 the first two are the equivalent waits of cupboard_cpu.py's bus styles: Z80 clock falling
+# to MREQ/IORQ/RD/WR (write data is valid before WR falls); 6809E E falling to address and R/W valid, and E rising
+# to write data valid.
+PROFILES = {
+    "65C02": TimingProfile("65C02", 40, 40, 10, 10, 35, 35),
+    "6502":  TimingProfile("6502", 300, 200, 100, 10, 430, 470),
+    "Z80":   TimingProfile("Z80", 85, 0, 35, 0, 110, 110),
+    "6809E": TimingProfile("6809E", 200, 225, 80, 10, 430, 450),
+}
+
+CALIBRATION_COUNT = 1000
+
+class EdgeTiming:
+    def __init__ (self, profile="65C02"):
+        self.profile = PROFILES[profile]
+        # until calibrated, assume nothing about the board: a pin write covers nothing, a loop pass takes 100 ns
+        self.pin_write_ns = 0
+        self.loop_ns = 100
+        self.sleep0_ns = 0
+        self.calibrated = False
+        self._apply()
+
+    # empty loop passes needed to cover need_ns beyond one pin write
+    def _spins (self, need_ns):
+        extra = need_ns - self.pin_write_ns
+        if extra <= 0:
+            return 0
+        return (extra + self.loop_ns - 1) // self.loop_ns
+
+    def _apply (self):
+        self.low_spins = self._spins(self.profile.addr_setup)
+        self.high_spins = self._spins(self.profile.write_data)
+
+    # choose a CPU profile by name; returns False if there is none
+    def select (self, name):
+        if name not in PROFILES:
+            return False
+        self.profile = PROFILES[name]
+        self._apply()
+        return True
+
+    # measure a pin write (writing pin's current level, so no edge reaches the CPU), an empty loop pass and
+    # time.sleep(0) on this board
+    def calibrate (self, pin, count=CALIBRATION_COUNT):
+        level = pin.value
+        t0 = time.monotonic_ns()
+        for _ in range(count):
+            pass
+        t1 = time.monotonic_ns()
+        for _ in range(count):
+            pin.value = level
+        t2 = time.monotonic_ns()
+        for _ in range(count // 10):
+            time.sleep(0)
+        t3 = time.monotonic_ns()
+        self.loop_ns = max((t1 - t0) // count, 1)
+        self.pin_write_ns = max((t2 - t1) // count - self.loop_ns, 0)
+        self.sleep0_ns = (t3 - t2) // (count // 10) - self.loop_ns
+        self.calibrated = True
+        self._apply()
+
+    def show (self):
+        p = self.profile
+        print("CPU timing %s: tADS %d tMDS %d tDSR %d tDHR %d tPWL %d tPWH %d ns" % (
+            p.name, p.addr_setup, p.write_data, p.read_setup, p.read_hold, p.pulse_low, p.pulse_high))
+        print("Board%s: pin write %d ns, loop pass %d ns, sleep(0) %d ns" % (
+            "" if self.calibrated else " (not calibrated)", self.pin_write_ns, self.loop_ns, self.sleep0_ns))
+        print("Edge wait: falling %d loop passes, rising %d loop passes" % (self.low_spins, self.high_spins))
+        print("Profiles: %s" % " ".join(sorted(PROFILES)))
@@ -0,0 +1,323 @@
+# cupboard_trace.py
+# Bus cycle trace for the Cupboard monitors: a preallocated ring buffer of packed cycle records.
+#
+# Each cycle is stored as address (16 bits), data (8 bits), flags (8 bits) and cycle number (32 bits) in
+# parallel arrays sized once at startup, so recording a cycle performs no allocation. Formatting, filtering
+# and streaming happen only when the user asks for them.
+#
+# Binary stream: records go to the host in frames, each frame self-contained so a lost frame costs only its
+# own records:
+#   a5 5a type seq len_lo len_hi payload[len] sum_lo sum_hi     (sum = 16-bit sum of the payload bytes)
+# A trace frame's payload is a run of delta-encoded records:
+#   header: bits 0-4 = record flags, bits 5-6 = address (next, previous, same, absolute), bit 7 = cycle follows
+#   [cycle u32 little-endian, if bit 7; otherwise previous cycle + 1]
+#   [address u16 little-endian, if absolute]
+#   data
+# so sequential fetches and stack pushes/pulls take 2 bytes per cycle.
+
+import array
+import sys
+try:
+    import usb_cdc
+    _binary_out = usb_cdc.console
+except ImportError:
+    _binary_out = None
+
+# flag bits of a record
+TRACE_RW       = 0x01  # R/W high: CPU reads from memory
+TRACE_SYNC     = 0x02  # SYNC high: opcode fetch
+TRACE_MLB      = 0x04  # MLB high: memory not locked
+TRACE_VPB      = 0x08  # VPB high: not a vector pull
+TRACE_EMULATED = 0x10  # cycle was served by (or stored into) emulated memory
+
+TRACE_SIZE     = 4096  # records kept, must be a power of two
+CYCLE_MASK     = 0x3fffffff  # cycle counters wrap here so they stay small ints (no allocation) on CircuitPython
+
+# binary stream framing
+FRAME_SYNC     = b'\xa5\x5a'
+FRAME_TRACE    = 0x54  # 'T' payload is delta-encoded records
+FRAME_END      = 0x45  # 'E' end of a dump or of a stream, empty payload
+FRAME_RECORDS  = 256   # records per trace frame
+FRAME_HEADER   = 6
+FRAME_SIZE     = FRAME_HEADER + FRAME_RECORDS * 8 + 2  # worst case: every record absolute with a cycle number
+
+REC_FLAGS      = 0x1f
+REC_ADDR       = 0x60
+REC_ADDR_NEXT  = 0x00
+REC_ADDR_PREV  = 0x20
+REC_ADDR_SAME  = 0x40
+REC_ADDR_ABS   = 0x60
+REC_CYCLE      = 0x80
+
+class BusTrace:
+    def __init__ (self, size=TRACE_SIZE):
+        self.size = size
+        self.mask = size - 1
+        self.addr = array.array('H', [0] * size)
+        self.data = bytearray(size)
+        self.flags = bytearray(size)
+        self.cycle = array.array('L', [0] * size)
+        self.head = 0    # next slot to write
+        self.count = 0   # valid records, up to size
+        self.sent = 0    # oldest record not yet streamed to the host
+        self.frame = bytearray(FRAME_SIZE)
+        self.frame_seq = 0
+
+    def clear (self):
+        self.head = 0
+        self.count = 0
+        self.sent = 0
+
+    # store one cycle, overwriting the oldest record when full
+    def record (self, addr, data, flags, cycle):
+        i = self.head
+        self.addr[i] = addr
+        self.data[i] = data
+        self.flags[i] = flags
+        self.cycle[i] = cycle
+        self.head = (i + 1) & self.mask
+        if self.count < self.size:
+            self.count += 1
+
+    # buffer indexes of the last n records (all if None), oldest first
+    def indexes (self, last=None):
+        n = self.count if last is None or last > self.count else last
+        start = (self.head - n) & self.mask
+        for k in range(n):
+            yield (start + k) & self.mask
+
+    # one record as text, in the same layout as the monitor's per-cycle output
+    def format (self, i):
+        flags = self.flags[i]
+        return "%8d %04x %s %s %02x" % (self.cycle[i], self.addr[i], status_text(flags), op_text(flags), self.data[i])
+
+    # print the last n records (all if None), or the last n the filter accepts; returns how many were shown
+    def dump (self, last=None, match=None):
+        if match is None:
+            selected = list(self.indexes(last))
+        else:
+            selected = [i for i in self.indexes() if match(self.addr[i], self.data[i], self.flags[i])]
+            if last is not None:
+                selected = selected[-last:] if last > 0 else []
+        for i in selected:
+            print(self.format(i))
+        return len(selected)
+
+    # bulk output of every record as packed hex: cycle(8) addr(4) data(2) flags(2), several records per line
+    def stream (self, per_line=8):
+        print("TRACE %d" % self.count)
+        line = []
+        for i in self.indexes():
+            line.append("%08x%04x%02x%02x" % (self.cycle[i], self.addr[i], self.data[i], self.flags[i]))
+            if len(line) >= per_line:
+                print(" ".join(line))
+                line = []
+        if len(line) > 0:
+            print(" ".join(line))
+        print("END")
+
+    # records recorded since the last send (the caller sends before this reaches the buffer size)
+    def pending (self):
+        return (self.head - self.sent) & self.mask
+
+    # encode the records at the given buffer indexes (at most FRAME_RECORDS) into one frame; returns its length
+    def encode_frame (self, indexes):
+        frame = self.frame
+        n = FRAME_HEADER
+        addrs = self.addr
+        cycles = self.cycle
+        prev_addr = 0
+        prev_cycle = -1
+        first = True
+        for i in indexes:
+            addr = addrs[i]
+            cycle = cycles[i]
+            h = self.flags[i]
+            if first or cycle != ((prev_cycle + 1) & CYCLE_MASK):
+                h |= REC_CYCLE
+            if first:
+                h |= REC_ADDR_ABS
+            elif addr == ((prev_addr + 1) & 0xffff):
+                pass
+            elif addr == ((prev_addr - 1) & 0xffff):
+                h |= REC_ADDR_PREV
+            elif addr == prev_addr:
+                h |= REC_ADDR_SAME
+            else:
+                h |= REC_ADDR_ABS
+            frame[n] = h
+            n += 1
+            if h & REC_CYCLE:
+                frame[n] = cycle & 0xff
+                frame[n + 1] = (cycle >> 8) & 0xff
+                frame[n + 2] = (cycle >> 16) & 0xff
+                frame[n + 3] = (cycle >> 24) & 0xff
+                n += 4
+            if h & REC_ADDR == REC_ADDR_ABS:
+                frame[n] = addr & 0xff
+                frame[n + 1] = addr >> 8
+                n += 2
+            frame[n] = self.data[i]
+            n += 1
+            prev_addr = addr
+            prev_cycle = cycle
+            first = False
+        return self.finish_frame(FRAME_TRACE, n)
+
+    # fill in the frame header and checksum around a payload already in self.frame
+    def finish_frame (self, kind, n):
+        frame = self.frame
+        length = n - FRAME_HEADER
+        frame[0] = 0xa5
+        frame[1] = 0x5a
+        frame[2] = kind
+        frame[3] = self.frame_seq
+        frame[4] = length & 0xff
+        frame[5] = length >> 8
+        total = sum(memoryview(frame)[FRAME_HEADER:n]) & 0xffff
+        frame[n] = total & 0xff
+        frame[n + 1] = total >> 8
+        self.frame_seq = (self.frame_seq + 1) & 0xff
+        return n + 2
+
+    # send the given buffer indexes as trace frames
+    def send_records (self, indexes):
+        batch = []
+        for i in indexes:
+            batch.append(i)
+            if len(batch) == FRAME_RECORDS:
+                write_binary(memoryview(self.frame)[:self.encode_frame(batch)])
+                batch = []
+        if len(batch) > 0:
+            write_binary(memoryview(self.frame)[:self.encode_frame(batch)])
+
+    # send the records recorded since the last send
+    def send_pending (self):
+        self.send_records(self.indexes(self.pending()))
+        self.sent = self.head
+
+    # send an end-of-stream frame
+    def send_end (self):
+        write_binary(memoryview(self.frame)[:self.finish_frame(FRAME_END, FRAME_HEADER)])
+
+    # the whole buffer as binary frames, followed by an end frame
+    def send_all (self):
+        self.send_records(self.indexes())
+        self.sent = self.head
+        self.send_end()
+
+# write binary data to the host: the USB serial console on the board, stdout elsewhere
+def write_binary (data):
+    if _binary_out is not None:
+        _binary_out.write(data)
+    else:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+# split a byte stream from the board into console text and frames; keeps partial input between calls
+class FrameDecoder:
+    def __init__ (self):
+        self.pending = b''
+        self.bad_frames = 0
+        self.lost_frames = 0
+        self.next_seq = None
+
+    # returns a list of ("text", bytes) and ("frame", kind, payload) items found in the data so far
+    def feed (self, data):
+        self.pending += data
+        items = []
+        while True:
+            start = self.pending.find(FRAME_SYNC)
+            if start < 0:
+                # keep a trailing first sync byte, it may start a frame
+                keep = 1 if self.pending.endswith(FRAME_SYNC[:1]) else 0
+                text = self.pending[:len(self.pending) - keep]
+                if text:
+                    items.append(("text", text))
+                self.pending = self.pending[len(self.pending) - keep:]
+                return items
+            if start > 0:
+                items.append(("text", self.pending[:start]))
+                self.pending = self.pending[start:]
+            if len(self.pending) < FRAME_HEADER:
+                return items
+            length = self.pending[4] | (self.pending[5] << 8)
+            if length > FRAME_SIZE:
+                self.bad_frames += 1
+                items.append(("text", self.pending[:1]))
+                self.pending = self.pending[1:]
+                continue
+            end = FRAME_HEADER + length
+            if len(self.pending) < end + 2:
+                return items
+            payload = self.pending[FRAME_HEADER:end]
+            total = self.pending[end] | (self.pending[end + 1] << 8)
+            if sum(payload) & 0xffff != total:
+                # not a frame after all (or a damaged one): treat the sync byte as text and rescan
+                self.bad_frames += 1
+                items.append(("text", self.pending[:1]))
+                self.pending = self.pending[1:]
+                continue
+            seq = self.pending[3]
+            if self.next_seq is not None and seq != self.next_seq:
+                self.lost_frames += (seq - self.next_seq) & 0xff
+            self.next_seq = (seq + 1) & 0xff
+            items.append(("frame", self.pending[2], payload))
+            self.pending = self.pending[end + 2:]
+
+# decode a trace frame payload into (cycle, addr, data, flags) records
+def decode_records (payload):
+    records = []
+    addr = 0
+    cycle = -1
+    n = 0
+    while n < len(payload):
+        h = payload[n]
+        n += 1
+        if h & REC_CYCLE:
+            cycle = payload[n] | (payload[n + 1] << 8) | (payload[n + 2] << 16) | (payload[n + 3] << 24)
+            n += 4
+        else:
+            cycle = (cycle + 1) & CYCLE_MASK
+        mode = h & REC_ADDR
+        if mode == REC_ADDR_ABS:
+            addr = payload[n] | (payload[n + 1] << 8)
+            n += 2
+        elif mode == REC_ADDR_NEXT:
+            addr = (addr + 1) & 0xffff
+        elif mode == REC_ADDR_PREV:
+            addr = (addr - 1) & 0xffff
+        records.append((cycle, addr, payload[n], h & REC_FLAGS))
+        n += 1
+    return records
+
+# "smvSMV" status pin text of a cycle
+def status_text (flags):
+    return "smv%d%d%d" % (1 if flags & TRACE_SYNC else 0, 1 if flags & TRACE_MLB else 0, 1 if flags & TRACE_VPB else 0)
+
+# R/r = read from emulated/external memory, W/w = write to emulated/external memory
+def op_text (flags):
+    if flags & TRACE_RW:
+        return "R" if flags & TRACE_EMULATED else "r"
+    return "W" if flags & TRACE_EMULATED else "w"
+
+# build a record filter from monitor command fields, e.g. ["R"], ["W"], ["S"], ["V"], ["A", lo, hi], ["D", value]
+# numbers are already converted; returns None for an unknown filter
+def make_filter (kind, values):
+    if kind == 'R':
+        return lambda a, d, f: f & TRACE_RW
+    if kind == 'W':
+        return lambda a, d, f: not (f & TRACE_RW)
+    if kind == 'S':
+        return lambda a, d, f: f & TRACE_SYNC
+    if kind == 'V':
+        return lambda a, d, f: not (f & TRACE_VPB)
+    if kind == 'A' and len(values) >= 1:
+        lo = values[0]
+        hi = values[1] if len(values) > 1 else lo
+        return lambda a, d, f: lo <= a <= hi
+    if kind == 'D' and len(values) == 1:
+        value = values[0]
+        return lambda a, d, f: d == value
+    return None
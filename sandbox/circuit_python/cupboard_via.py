@@ -0,0 +1,210 @@
+# cupboard_via.py
+# Emulated 6522 VIA for the Cupboard monitors: ports A/B with data direction registers, timer 1 (one-shot and
+# free-run), timer 2 (one-shot) and the IFR/IER interrupt registers, as an I/O page handler (read/write).
+#
+# Timers are not ticked. Starting a timer records the cycle it will expire on; counter reads are computed from
+# the monitor's cycle count, and the monitor calls service() only on the cycle returned by next_event(), so an
+# idle VIA costs the bus loop nothing. The IRQ output changes exactly on the expiry cycle (the chip sets the
+# flag N+1.5 cycles after the counter is loaded; the monitor works in whole cycles, so that is cycle N+2).
+#
+# Not emulated: the shift register (SR reads back what was written), CA1/CA2/CB1/CB2 handshaking, PB7 timer
+# output and timer 2 pulse counting.
+
+# registers (RS3..RS0)
+VIA_ORB   = 0x0
+VIA_ORA   = 0x1
+VIA_DDRB  = 0x2
+VIA_DDRA  = 0x3
+VIA_T1CL  = 0x4
+VIA_T1CH  = 0x5
+VIA_T1LL  = 0x6
+VIA_T1LH  = 0x7
+VIA_T2CL  = 0x8
+VIA_T2CH  = 0x9
+VIA_SR    = 0xa
+VIA_ACR   = 0xb
+VIA_PCR   = 0xc
+VIA_IFR   = 0xd
+VIA_IER   = 0xe
+VIA_ORA_NH = 0xf
+
+# IFR/IER bits
+IRQ_T1    = 0x40
+IRQ_T2    = 0x20
+IRQ_ANY   = 0x80
+
+ACR_T1_FREE_RUN = 0x40
+ACR_T2_COUNT    = 0x20
+
+CYCLE_MASK = 0x3fffffff  # the monitor's cycle counter wraps here (see cupboard_trace.CYCLE_MASK)
+NO_EVENT   = -1
+
+class VIA6522:
+    # clock() returns the current cycle; irq_changed(asserted) follows the IRQ output;
+    # schedule_changed() is called when next_event() may have changed
+    def __init__ (self, name, clock, irq_changed, schedule_changed):
+        self.name = name
+        self.clock = clock
+        self.irq_changed = irq_changed
+        self.schedule_changed = schedule_changed
+        self.reset()
+
+    def reset (self):
+        self.orb = 0
+        self.ora = 0
+        self.ddrb = 0
+        self.ddra = 0
+        self.port_b_in = 0x00  # levels on the port pins set as inputs
+        self.port_a_in = 0x00
+        self.t1_latch = 0xffff
+        self.t1_expiry = 0
+        self.t1_running = False  # counting and will set IFR T1 at t1_expiry
+        self.t2_latch_lo = 0xff
+        self.t2_expiry = 0
+        self.t2_running = False
+        self.sr = 0
+        self.acr = 0
+        self.pcr = 0
+        self.ifr = 0
+        self.ier = 0
+        self.irq = False
+
+    # output pin levels of a port: ORx on output bits, the external level on input bits
+    def port_b (self):
+        return (self.orb & self.ddrb) | (self.port_b_in & ~self.ddrb & 0xff)
+
+    def port_a (self):
+        return (self.ora & self.ddra) | (self.port_a_in & ~self.ddra & 0xff)
+
+    # counter value at cycle now, counting down from the load and wrapping through ffff
+    def _counter (self, expiry, now):
+        return ((expiry - 1 - now) & CYCLE_MASK) & 0xffff
+
+    def _update_irq (self):
+        irq = (self.ifr & self.ier & 0x7f) != 0
+        if irq != self.irq:
+            self.irq = irq
+            self.irq_changed(irq)
+
+    def _set_flags (self, bits):
+        self.ifr |= bits
+        self._update_irq()
+
+    def _clear_flags (self, bits):
+        self.ifr &= ~bits
+        self._update_irq()
+
+    def read (self, addr):
+        reg = addr & 0x0f
+        if reg == VIA_ORB:
+            return self.port_b()
+        if reg == VIA_ORA or reg == VIA_ORA_NH:
+            return self.port_a()
+        if reg == VIA_DDRB:
+            return self.ddrb
+        if reg == VIA_DDRA:
+            return self.ddra
+        if reg == VIA_T1CL:
+            self._clear_flags(IRQ_T1)
+            return self._counter(self.t1_expiry, self.clock()) & 0xff
+        if reg == VIA_T1CH:
+            return self._counter(self.t1_expiry, self.clock()) >> 8
+        if reg == VIA_T1LL:
+            return self.t1_latch & 0xff
+        if reg == VIA_T1LH:
+            return self.t1_latch >> 8
+        if reg == VIA_T2CL:
+            self._clear_flags(IRQ_T2)
+            return self._counter(self.t2_expiry, self.clock()) & 0xff
+        if reg == VIA_T2CH:
+            return self._counter(self.t2_expiry, self.clock()) >> 8
+        if reg == VIA_SR:
+            return self.sr
+        if reg == VIA_ACR:
+            return self.acr
+        if reg == VIA_PCR:
+            return self.pcr
+        if reg == VIA_IFR:
+            return self.ifr | (IRQ_ANY if self.irq else 0)
+        return self.ier | 0x80  # VIA_IER
+
+    def write (self, addr, value):
+        reg = addr & 0x0f
+        if reg == VIA_ORB:
+            self.orb = value
+        elif reg == VIA_ORA or reg == VIA_ORA_NH:
+            self.ora = value
+        elif reg == VIA_DDRB:
+            self.ddrb = value
+        elif reg == VIA_DDRA:
+            self.ddra = value
+        elif reg == VIA_T1CL or reg == VIA_T1LL:
+            self.t1_latch = (self.t1_latch & 0xff00) | value
+        elif reg == VIA_T1CH:
+            # load the counter from the latch and start timer 1
+            self.t1_latch = (self.t1_latch & 0x00ff) | (value << 8)
+            self.t1_expiry = (self.clock() + self.t1_latch + 2) & CYCLE_MASK
+            self.t1_running = True
+            self._clear_flags(IRQ_T1)
+            self.schedule_changed()
+        elif reg == VIA_T1LH:
+            self.t1_latch = (self.t1_latch & 0x00ff) | (value << 8)
+            self._clear_flags(IRQ_T1)
+        elif reg == VIA_T2CL:
+            self.t2_latch_lo = value
+        elif reg == VIA_T2CH:
+            # load the counter and start timer 2 (interval mode; pulse counting is not emulated)
+            self.t2_expiry = (self.clock() + (self.t2_latch_lo | (value << 8)) + 2) & CYCLE_MASK
+            self.t2_running = not (self.acr & ACR_T2_COUNT)
+            self._clear_flags(IRQ_T2)
+            self.schedule_changed()
+        elif reg == VIA_SR:
+            self.sr = value
+        elif reg == VIA_ACR:
+            self.acr = value
+        elif reg == VIA_PCR:
+            self.pcr = value
+        elif reg == VIA_IFR:
+            self._clear_flags(value & 0x7f)
+        else:  # VIA_IER
+            if value & 0x80:
+                self.ier |= value & 0x7f
+            else:
+                self.ier &= ~value & 0x7f
+            self._update_irq()
+
+    # cycle of the next timer expiry, or NO_EVENT
+    def next_event (self):
+        now = self.clock()
+        best = NO_EVENT
+        if self.t1_running:
+            best = self.t1_expiry
+        if self.t2_running and (best == NO_EVENT or ((self.t2_expiry - now) & CYCLE_MASK) < ((best - now) & CYCLE_MASK)):
+            best = self.t2_expiry
+        return best
+
+    # handle the timers expiring on cycle now
+    def service (self, now):
+        flags = 0
+        if self.t1_running and self.t1_expiry == now:
+            flags |= IRQ_T1
+            if self.acr & ACR_T1_FREE_RUN:
+                self.t1_expiry = (now + self.t1_latch + 2) & CYCLE_MASK
+            else:
+                self.t1_running = False  # one-shot: keeps counting down, no further interrupts until reloaded
+        if self.t2_running and self.t2_expiry == now:
+            flags |= IRQ_T2
+            self.t2_running = False
+        if flags:
+            self._set_flags(flags)
+
+    # register summary for the monitor
+    def show (self):
+        now = self.clock()
+        print("%s PA %02x (DDRA %02x) PB %02x (DDRB %02x) ACR %02x PCR %02x IFR %02x IER %02x IRQ %s" % (
+            self.name, self.port_a(), self.ddra, self.port_b(), self.ddrb, self.acr, self.pcr, self.ifr | (IRQ_ANY if self.irq else 0),
+            self.ier | 0x80, "low" if self.irq else "high"))
+        print("%s T1 %04x latch %04x %s  T2 %04x %s" % (
+            self.name, self._counter(self.t1_expiry, now), self.t1_latch,
+            ("free-run" if self.acr & ACR_T1_FREE_RUN else "one-shot") if self.t1_running else "stopped",
+            self._counter(self.t2_expiry, now), "running" if self.t2_running else "stopped"))
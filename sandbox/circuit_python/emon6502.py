@@ -4,6 +4,16 @@ import board
 import digitalio
 import time
 import supervisor
+import cupboard_bus
+import cupboard_opcodes
+import cupboard_trace
+import cupboard_via
+import cupboard_loader
+import cupboard_snapshot
+import cupboard_break
+import cupboard_profile
+import cupboard_stats
+import cupboard_timing
 
 # global data
 dump_prev_addr       = 0x0000  # track previously dumped address...
@@ -11,51 +21,36 @@ dump_prev_count      = 16      # ...and width
 write_prev_address   = 0x0000  # track previously written address
 output_width         = 16      # number of bytes to display per line of dumped memory
 force_hex            = True    # assume arguments are hexadecimal; otherwise assume decimal and use 'x', 'o', or '%' prefixes for hex, octal, or binary
-force_data_bus_reset = False   # global flag to indicate that the data bus needs reset at start of next clock cycle
 address_bus_value    = 0x0000  # current state of the address bus
 data_bus_value       = 0x00    # current state of the data bus
 free_run_enable      = False   # free mode
 free_run_delay       = 0       # when in free-run, the delay
+free_run_hz          = 0       # free-run target clock rate, 0 = as fast as possible
+FR_BATCH             = 64      # free-run clocks at most this many cycles between checks of the time
+FR_POLL_CYCLES       = 1024    # free-run checks for keyboard input at least every this many cycles...
+FR_POLL_MS           = 50      # ...or this many milliseconds
+bus_backend          = cupboard_bus.BACKEND_PORT  # PORT = bulk port-register bus access, PIN = per-pin digitalio access
+cycle_count          = 0       # cycles clocked since power-up, wraps at cupboard_trace.CYCLE_MASK
+trace_enable         = True    # record every cycle in the trace buffer
+trace_verbose        = False   # also print every cycle as it happens (slow: console output dominates the cycle)
+trace_stream         = False   # send every recorded cycle to the host as binary trace frames
+trace                = cupboard_trace.BusTrace()  # ring buffer of the most recent bus cycles
+cycle_flags          = 0       # trace flags (R/W, SYNC, ...) of the last cycle clocked
+STEP_LIMIT           = 16      # cycles to wait for the next opcode fetch when stepping (longest instruction 8, interrupt 7)
+event_cycle          = cupboard_via.NO_EVENT  # cycle of the next scheduled device event (timer expiry)
+devices              = []      # emulated devices with scheduled events (next_event() / service(cycle))
+breaks               = cupboard_break.Breakpoints()  # breakpoints and watchpoints, checked every cycle
+profile_enable       = False   # count executions, cycles and page accesses for the profiler
+profiler             = cupboard_profile.Profiler()  # per-instruction, per-subroutine and per-page counts
+stats_enable         = False   # time a sample of cycles, phase by phase (STATS)
+stats                = cupboard_stats.CycleStats()  # phase times, cycle time and jitter of the sampled cycles
+VIA_ADDRESS          = 0x6000  # emulated 6522 VIA page, registers repeat every 16 bytes
+via_enable           = False   # True = emulated VIA at VIA_ADDRESS driving IRQ, False = physical VIA on the bus
 
 # on-board red LED
 led = digitalio.DigitalInOut(board.LED)
 led.direction = digitalio.Direction.OUTPUT
 
-# Dictionary of all possible 256 opcode bytes mapped to the instruction length/cycles/mnemonic tuple - used to disassemble
-# opcode : (length, cycles, mnemonic)
-opcodes = {0x00 : (1, 1, "BRK a"),   0x01 : (1, 1, "ORA (zp,x)"),  0x02 : (1, 1, "ILLEGAL"),     0x03 : (1, 1, "ILLEGAL"),  0x04 : (1, 1, "TSB zp •"),     0x05 : (1, 1, "ORA zp"),    0x06 : (1, 1, "ASL zp"),     0x07 : (1, 1, "RMB0 zp •"),    
-           0x08 : (1, 1, "PHP s"),   0x09 : (1, 1, "ORA #"),       0x0A : (1, 1, "ASL A"),       0x0B : (1, 1, "ILLEGAL"),  0x0C : (1, 1, "TSB a •"),      0x0D : (1, 1, "ORA a"),     0x0E : (1, 1, "ASL a"),      0x0F : (1, 1, "BBR0 r •"),     
-           0x10 : (1, 1, "BPL r"),   0x11 : (1, 1, "ORA (zp),y"),  0x12 : (1, 1, "ORA (zp) ∗"),  0x13 : (1, 1, "ILLEGAL"),  0x14 : (1, 1, "TRB zp •"),     0x15 : (1, 1, "ORA zp,x"),  0x16 : (1, 1, "ASL zp,x"),   0x17 : (1, 1, "RMB1 zp •"),    
-           0x18 : (1, 1, "CLC i"),   0x19 : (1, 1, "ORA a,y"),     0x1A : (1, 1, "INC A ∗"),     0x1B : (1, 1, "ILLEGAL"),  0x1C : (1, 1, "TRB a •"),      0x1D : (1, 1, "ORA a,x"),   0x1E : (1, 1, "ASL a,x"),    0x1F : (1, 1, "BBR1 r •"),     
-           0x20 : (1, 1, "JSR a"),   0x21 : (1, 1, "AND (zp,x)"),  0x22 : (1, 1, "ILLEGAL"),     0x23 : (1, 1, "ILLEGAL"),  0x24 : (1, 1, "BIT zp"),       0x25 : (1, 1, "AND zp"),    0x26 : (1, 1, "ROL zp"),     0x27 : (1, 1, "RMB2 zp •"),    
-           0x28 : (1, 1, "PLP s"),   0x29 : (1, 1, "AND #"),       0x2A : (1, 1, "ROL A"),       0x2B : (1, 1, "ILLEGAL"),  0x2C : (1, 1, "BIT a"),        0x2D : (1, 1, "AND a"),     0x2E : (1, 1, "ROL a"),      0x2F : (1, 1, "BBR2 r •"),     
-           0x30 : (1, 1, "BMI r"),   0x31 : (1, 1, "AND (zp),y"),  0x32 : (1, 1, "AND (zp) ∗"),  0x33 : (1, 1, "ILLEGAL"),  0x34 : (1, 1, "BIT zp,x •"),   0x35 : (1, 1, "AND zp,x"),  0x36 : (1, 1, "ROL zp,x"),   0x37 : (1, 1, "RMB3 zp •"),    
-           0x38 : (1, 1, "SEC I"),   0x39 : (1, 1, "AND a,y"),     0x3A : (1, 1, "DEC A"),       0x3B : (1, 1, "ILLEGAL"),  0x3C : (1, 1, "BIT a,x ∗"),    0x3D : (1, 1, "AND a,x"),   0x3E : (1, 1, "ROL a,x"),    0x3F : (1, 1, "BBR3 r •"),     
-           0x40 : (1, 1, "RTI s"),   0x41 : (1, 1, "EOR (zp,x)"),  0x42 : (1, 1, "ILLEGAL"),     0x43 : (1, 1, "ILLEGAL"),  0x44 : (1, 1, "ILLEGAL"),      0x45 : (1, 1, "EOR zp"),    0x46 : (1, 1, "LSR zp"),     0x47 : (1, 1, "RMB4 zp •"),    
-           0x48 : (1, 1, "PHA s"),   0x49 : (1, 1, "EOR #"),       0x4A : (1, 1, "LSR A ∗"),     0x4B : (1, 1, "ILLEGAL"),  0x4C : (1, 1, "JMP a"),        0x4D : (1, 1, "EOR a"),     0x4E : (1, 1, "LSR a"),      0x4F : (1, 1, "BBR4 r •"),     
-           0x50 : (1, 1, "BVC r"),   0x51 : (1, 1, "EOR (zp),y"),  0x52 : (1, 1, "EOR (zp) ∗"),  0x53 : (1, 1, "ILLEGAL"),  0x54 : (1, 1, "ILLEGAL"),      0x55 : (1, 1, "EOR zp,x"),  0x56 : (1, 1, "LSR zp,x"),   0x57 : (1, 1, "RMB5 zp •"),    
-           0x58 : (1, 1, "CLI i"),   0x59 : (1, 1, "EOR a,y"),     0x5A : (1, 1, "PHY s •"),     0x5B : (1, 1, "ILLEGAL"),  0x5C : (1, 1, "ILLEGAL"),      0x5D : (1, 1, "EOR a,x"),   0x5E : (1, 1, "LSR a,x"),    0x5F : (1, 1, "BBR5 r •"),     
-           0x60 : (1, 1, "RTS s"),   0x61 : (1, 1, "ADC (zp,x)"),  0x62 : (1, 1, "ILLEGAL"),     0x63 : (1, 1, "ILLEGAL"),  0x64 : (1, 1, "STZ zp •"),     0x65 : (1, 1, "ADC zp"),    0x66 : (1, 1, "ROR zp"),     0x67 : (1, 1, "RMB6 zp •"),    
-           0x68 : (1, 1, "PLA s"),   0x69 : (1, 1, "ADC #"),       0x6A : (1, 1, "ROR A"),       0x6B : (1, 1, "ILLEGAL"),  0x6C : (1, 1, "JMP (a)"),      0x6D : (1, 1, "ADC a"),     0x6E : (1, 1, "ROR a"),      0x6F : (1, 1, "BBR6 r •"),     
-           0x70 : (1, 1, "BVS r"),   0x71 : (1, 1, "ADC (zp),y"),  0x72 : (1, 1, "ADC (zp) ∗"),  0x73 : (1, 1, "ILLEGAL"),  0x74 : (1, 1, "STZ zp,x •"),   0x75 : (1, 1, "ADC zp,x"),  0x76 : (1, 1, "ROR zp,x"),   0x77 : (1, 1, "RMB7 zp •"),    
-           0x78 : (1, 1, "SEI i"),   0x79 : (1, 1, "ADC a,y"),     0x7A : (1, 1, "PLY s •"),     0x7B : (1, 1, "ILLEGAL"),  0x7C : (1, 1, "JMP (a.x) ∗"),  0x7D : (1, 1, "ADC a,x"),   0x7E : (1, 1, "ROR a,x"),    0x7F : (1, 1, "BBR7 r •"),     
-           0x80 : (1, 1, "BRA r •"), 0x81 : (1, 1, "STA (zp,x)"),  0x82 : (1, 1, "ILLEGAL"),     0x83 : (1, 1, "ILLEGAL"),  0x84 : (1, 1, "STY zp"),       0x85 : (1, 1, "STA zp"),    0x86 : (1, 1, "STZ zp"),     0x87 : (1, 1, "SMB0 zp •"),    
-           0x88 : (1, 1, "DEY i"),   0x89 : (1, 1, "BIT #"),       0x8A : (1, 1, "TXA i"),       0x8B : (1, 1, "ILLEGAL"),  0x8C : (1, 1, "STY a •"),      0x8D : (1, 1, "STA a"),     0x8E : (1, 1, "STX a"),      0x8F : (1, 1, "BBS0 r •"),     
-           0x90 : (1, 1, "BCC r"),   0x91 : (1, 1, "STA (zp),y"),  0x92 : (1, 1, "STA (zp) ∗"),  0x93 : (1, 1, "ILLEGAL"),  0x94 : (1, 1, "STY zp,x"),     0x95 : (1, 1, "STA zp,x"),  0x96 : (1, 1, "STZ zp,y"),   0x97 : (1, 1, "SMB1 zp •"),    
-           0x98 : (1, 1, "TYA i"),   0x99 : (1, 1, "STA a,y"),     0x9A : (1, 1, "TSX i"),       0x9B : (1, 1, "ILLEGAL"),  0x9C : (1, 1, "STZ a"),        0x9D : (1, 1, "STA a,x"),   0x9E : (1, 1, "STZ a,x •"),  0x9F : (1, 1, "BBS1 r •"),     
-           0xA0 : (1, 1, "LDY #"),   0xA1 : (1, 1, "LDA (zp,x)"),  0xA2 : (1, 1, "LDX # ∗"),     0xA3 : (1, 1, "ILLEGAL"),  0xA4 : (1, 1, "LDY zp"),       0xA5 : (1, 1, "LDA zp"),    0xA6 : (1, 1, "LDX zp"),     0xA7 : (1, 1, "SMB2 zp •"),    
-           0xA8 : (1, 1, "TAY i"),   0xA9 : (1, 1, "LDA #"),       0xAA : (1, 1, "TAX i"),       0xAB : (1, 1, "ILLEGAL"),  0xAC : (1, 1, "LDY a"),        0xAD : (1, 1, "LDA a"),     0xAE : (1, 1, "LDX a"),      0xAF : (1, 1, "BBS2 r •"),     
-           0xB0 : (1, 1, "BCS r"),   0xB1 : (1, 1, "LDA (zp),y"),  0xB2 : (1, 1, "LDA (zp) ∗"),  0xB3 : (1, 1, "ILLEGAL"),  0xB4 : (1, 1, "LDY zp,x"),     0xB5 : (1, 1, "LDA zp,x"),  0xB6 : (1, 1, "LDX zp,y"),   0xB7 : (1, 1, "SMB3 zp •"),    
-           0xB8 : (1, 1, "CLV i"),   0xB9 : (1, 1, "LDA A,y"),     0xBA : (1, 1, "TSX i"),       0xBB : (1, 1, "ILLEGAL"),  0xBC : (1, 1, "LDY a,x"),      0xBD : (1, 1, "LDA a,x"),   0xBE : (1, 1, "LDX a,x"),    0xBF : (1, 1, "BBS3 r •"),     
-           0xC0 : (1, 1, "CPY #"),   0xC1 : (1, 1, "CMP (zp,x)"),  0xC2 : (1, 1, "ILLEGAL"),     0xC3 : (1, 1, "ILLEGAL"),  0xC4 : (1, 1, "CPY zp"),       0xC5 : (1, 1, "CMP zp"),    0xC6 : (1, 1, "DEC zp"),     0xC7 : (1, 1, "SMB4 zp •"),    
-           0xC8 : (1, 1, "INY i"),   0xC9 : (1, 1, "CMP #"),       0xCA : (1, 1, "DEX i"),       0xCB : (1, 1, "WAI I •"),  0xCC : (1, 1, "CPY a"),        0xCD : (1, 1, "CMP a"),     0xCE : (1, 1, "DEC a"),      0xCF : (1, 1, "BBS4 r •"),     
-           0xD0 : (1, 1, "BNE r"),   0xD1 : (1, 1, "CMP (zp),y"),  0xD2 : (1, 1, "CMP (zp) ∗"),  0xD3 : (1, 1, "ILLEGAL"),  0xD4 : (1, 1, "ILLEGAL"),      0xD5 : (1, 1, "CMP zp,x"),  0xD6 : (1, 1, "DEC zp,x"),   0xD7 : (1, 1, "SMB5 zp •"),    
-           0xD8 : (1, 1, "CLD i"),   0xD9 : (1, 1, "CMP a,y"),     0xDA : (1, 1, "PHX s •"),     0xDB : (1, 1, "STP I •"),  0xDC : (1, 1, "ILLEGAL"),      0xDD : (1, 1, "CMP a,x"),   0xDE : (1, 1, "DEC a,x"),    0xDF : (1, 1, "BBS5 r •"),     
-           0xE0 : (1, 1, "CPX #"),   0xE1 : (1, 1, "SBC (zp,x)"),  0xE2 : (1, 1, "ILLEGAL"),     0xE3 : (1, 1, "ILLEGAL"),  0xE4 : (1, 1, "CPX zp"),       0xE5 : (1, 1, "SBC zp"),    0xE6 : (1, 1, "INC zp"),     0xE7 : (1, 1, "SMB6 zp •"),    
-           0xE8 : (1, 1, "INX i"),   0xE9 : (1, 1, "SBC #"),       0xEA : (1, 1, "NOP i"),       0xEB : (1, 1, "ILLEGAL"),  0xEC : (1, 1, "CPX a"),        0xED : (1, 1, "SBC a"),     0xEE : (1, 1, "INC a"),      0xEF : (1, 1, "BBS6 r •"),     
-           0xF0 : (1, 1, "BEQ r"),   0xF1 : (1, 1, "SBC (zp),y"),  0xF2 : (1, 1, "SBC (zp) ∗"),  0xF3 : (1, 1, "ILLEGAL"),  0xF4 : (1, 1, "ILLEGAL"),      0xF5 : (1, 1, "SBC zp,x"),  0xF6 : (1, 1, "INC zp,x"),   0xF7 : (1, 1, "SMB7 zp •"),    
-           0xF8 : (1, 1, "SED i"),   0xF9 : (1, 1, "SBC a,y"),     0xFA : (1, 1, "PLX s •"),     0xFB : (1, 1, "ILLEGAL"),  0xFC : (1, 1, "ILLEGAL"),      0xFD : (1, 1, "SBC a,x"),   0xFE : (1, 1, "INC a,x"),    0xFF : (1, 1, "BBS7 r •")}     
-
 # pre-compiled demo programs
 # blinky
 pgm_blinky = ["8000 a2 ff 9a a9 ff 8d 02 60 a9 f0 8d 03 60 a9 00 8d",
@@ -88,27 +83,25 @@ emulated_memory = bytearray(65536)
 
 # take a hex-dump output line and store the data in emulated memory
 def store_emulated_memory (asm_out_string):
-    global emulated_memory
-    fields = asm_out_string.strip().split(' ')
-    if len(fields) > 1:
-        addr = int(fields[0], 16)
-        for d in fields[1:]:
-            emulated_memory[addr] = int(d, 16)
-            addr += 1
+    cupboard_loader.load_hex_dump_line(emulated_memory, asm_out_string)
 
 # load a pre-compiled program into emulated ROM
 def load_emulated_program (pgm):
     for l in pgm:
         store_emulated_memory(l)
 
-# reset emulated memory to default state
+# named memory snapshots, created with the power-on image by the first reset_memory()
+snapshots = None
+
+# reset emulated memory to the power-on snapshot; the first call builds it (NOPs plus the demo program)
 def reset_memory ():
-    global emulated_memory
-    # fill with NOPs
-    for i in range(65536): 
-        emulated_memory[i] = 0xea
-    # load emulated program
-    load_emulated_program(pgm_hello)
+    global emulated_memory, snapshots
+    if snapshots is None:
+        emulated_memory[:] = b'\xea' * 65536
+        load_emulated_program(pgm_hello)
+        snapshots = cupboard_snapshot.Snapshots(emulated_memory)
+    else:
+        snapshots.restore()
 
 # dump the contents of emulated memory
 def dump_memory (start_address, num_bytes):
@@ -117,8 +110,11 @@ def dump_memory (start_address, num_bytes):
     for a in range(start_address, start_address + num_bytes):
         if num_cols == 0:
             print("%04x: " % a, end='')
-        if is_emulated_memory(a):
+        region = page_map[a >> 8]
+        if region == PAGE_RAM or region == PAGE_ROM:
             print("%02x " % emulated_memory[a], end='')
+        elif region == PAGE_IO:
+            print("-- ", end='')  # not read: I/O reads can have side effects
         else:
             print("?? ", end='')
         num_cols += 1
@@ -130,13 +126,88 @@ def dump_memory (start_address, num_bytes):
     if num_cols > 0:
         print()
 
-# returns True if the address is part of the emulated memory
+# memory map: the region type of each 256-byte page, looked up once per bus access
+PAGE_EXT   = 0   # external: physical memory/devices on the CPU bus, only observed
+PAGE_RAM   = 1   # emulated RAM
+PAGE_ROM   = 2   # emulated ROM, CPU writes are discarded
+PAGE_IO    = 3   # memory-mapped I/O, served by the page's handler (read(addr) / write(addr, value))
+PAGE_NAMES = ("EXT", "RAM", "ROM", "IO")
+page_map    = bytearray(256)   # PAGE_* for each page
+io_handlers = [None] * 256     # I/O handler for each PAGE_IO page
+rom_discard = bytearray(256)   # CPU writes to ROM pages land here
+write_pages = [rom_discard] * 256  # where CPU writes to each emulated page go: its slice of emulated_memory, or rom_discard
+
+# set the region type of the pages covering start..end
+def map_pages (start, end, region, handler=None):
+    for page in range(start >> 8, (end >> 8) + 1):
+        page_map[page] = region
+        io_handlers[page] = handler if region == PAGE_IO else None
+        write_pages[page] = memoryview(emulated_memory)[page << 8:(page + 1) << 8] if region == PAGE_RAM else rom_discard
+
+# print the memory map as runs of pages of the same type (and handler)
+def show_memory_map ():
+    start = 0
+    for page in range(1, 257):
+        if page == 256 or page_map[page] != page_map[start] or io_handlers[page] is not io_handlers[start]:
+            region = page_map[start]
+            name = PAGE_NAMES[region]
+            if region == PAGE_IO:
+                name += " " + io_handlers[start].name
+            print("%04x-%04x %s" % (start << 8, (page << 8) - 1, name))
+            start = page
+
+# returns True if the address is part of the emulated memory (RAM, ROM or I/O)
 def is_emulated_memory (address):
-    return False # address >= 0x8000
+    return page_map[address >> 8] != PAGE_EXT
+
+# find the next cycle any device has an event on
+def schedule_events ():
+    global event_cycle
+    event_cycle = cupboard_via.NO_EVENT
+    best = 0
+    for dev in devices:
+        when = dev.next_event()
+        if when != cupboard_via.NO_EVENT:
+            distance = (when - cycle_count) & cupboard_trace.CYCLE_MASK
+            if event_cycle == cupboard_via.NO_EVENT or distance < best:
+                event_cycle = when
+                best = distance
+
+# run the device events due on this cycle
+def service_events ():
+    for dev in devices:
+        dev.service(cycle_count)
+    schedule_events()
+
+# emulated VIA: its IRQ output drives the CPU IRQ pin while it is enabled
+def via_irq_changed (asserted):
+    pin_irq.value = not asserted
+
+via = cupboard_via.VIA6522("VIA", lambda: cycle_count, via_irq_changed, schedule_events)
+
+# switch between the emulated and a physical VIA
+def enable_via (enable):
+    global via_enable
+    via_enable = enable
+    via.reset()
+    if enable:
+        map_pages(VIA_ADDRESS, VIA_ADDRESS + 0xff, PAGE_IO, via)
+        pin_irq.switch_to_output(True)  # CPU input = output from Cupboard
+        if via not in devices:
+            devices.append(via)
+    else:
+        map_pages(VIA_ADDRESS, VIA_ADDRESS + 0xff, PAGE_EXT)
+        pin_irq.switch_to_input(None)   # CPU input = output from VIA = input to Cupboard
+        if via in devices:
+            devices.remove(via)
+    schedule_events()
 
 # assigned GPIO pins for CPU interface
-pins_addr = [digitalio.DigitalInOut(i) for i in [board.D38, board.D39, board.D40, board.D41, board.D42, board.D43, board.D44, board.D45, board.D30, board.D31, board.D32, board.D33, board.D34, board.D35, board.D36, board.D37]]  # CPU outputs
-pins_data = [digitalio.DigitalInOut(i) for i in [board.D22, board.D23, board.D24, board.D25, board.D26, board.D27, board.D28, board.D29]] # CPU bidirectional
+bus = cupboard_bus.open_bus([board.D38, board.D39, board.D40, board.D41, board.D42, board.D43, board.D44, board.D45, board.D30, board.D31, board.D32, board.D33, board.D34, board.D35, board.D36, board.D37],  # CPU outputs
+                           [board.D22, board.D23, board.D24, board.D25, board.D26, board.D27, board.D28, board.D29],  # CPU bidirectional
+                           bus_backend)
+pins_addr = bus.pins_addr
+pins_data = bus.pins_data
 pin_clk   = digitalio.DigitalInOut(board.D14)  # CPU input
 pin_rst   = digitalio.DigitalInOut(board.D15)  # CPU input
 pin_irq   = digitalio.DigitalInOut(board.D16)  # CPU input
@@ -152,13 +223,13 @@ pin_mlb   = digitalio.DigitalInOut(board.D21)  # CPU output
 # reset all pins to their default state
 def reset_all_pins ():
     global pins_addr, pins_data, pin_clk, pin_rst, pin_irq, pin_nmi, pin_sync, pin_vpb, pin_rw, pin_mlb
-    for p in pins_addr:
-        p.switch_to_input(None) # output from CPU = input to Cupboard, no pull
-    for p in pins_data:
-        p.switch_to_input(None) # initially assume output from CPU = input to Cupboard, no pull; will switch when need to "write" data to the CPU (on a CPU read instruction)
+    bus.reset_all_pins()  # address and data = output from CPU = input to Cupboard, no pull; data switches when need to "write" data to the CPU (on a CPU read instruction)
     pin_clk.switch_to_output(True)   # CPU input = output from Cupboard
     pin_rst.switch_to_output(False)  # CPU input = output from Cupboard
-    pin_irq.switch_to_input(None)    # CPU input = output from VIA = input to Cupboard
+    if via_enable:
+        pin_irq.switch_to_output(not via.irq)  # CPU input = output from emulated VIA = output from Cupboard
+    else:
+        pin_irq.switch_to_input(None)    # CPU input = output from VIA = input to Cupboard
     pin_nmi.switch_to_output(True)   # CPU input = output from Cupboard (pulled high by 1K)
     pin_sync.switch_to_input(None)   # CPU output = input to Cupboard
     pin_vpb.switch_to_input(None)    # CPU output = input to Cupboard
@@ -168,52 +239,49 @@ def reset_all_pins ():
     # pin_so.switch_to_output(True)    # CPU input = output from Cupboard
     # pin_be.switch_to_output(True)    # CPU input = output from Cupboard
 
-# read the 16-bit address from the address bus
-def read_addr_bus ():
-    global pins_addr
-    addr = 0
-    val = 0x0001
-    for p in pins_addr:
-        if (p.value):
-            addr += val
-        val <<= 1
-    return addr
-
-# switch data bus to output mode and write value bit-by-bit
-def write_data_bus (value):
-    global pins_data
-    for p in pins_data:
-        p.switch_to_output(value & 0x01)
-        value >>= 1
-
-# reset data bus to input mode after a write
-def reset_data_bus ():
-    global pins_data
-    for p in pins_data:
-        p.switch_to_input(None)
-
-# read the data bus (assumed to be in input mode)
-def read_data_bus ():
-    global pins_data
-    data = 0
-    val = 0x01
-    for p in pins_data:
-        if (p.value):
-            data += val
-        val <<= 1
-    return data
+# bus access goes through the selected backend (see cupboard_bus.py)
+read_addr_bus  = bus.read_addr_bus   # read the 16-bit address from the address bus
+write_data_bus = bus.write_data_bus  # switch data bus to output mode and write value
+reset_data_bus = bus.reset_data_bus  # reset data bus to input mode after a write
+drive_data_bus = bus.drive_data_bus  # drive a value, switching to output mode only if not already driving
+release_data_bus = bus.release_data_bus  # back to input mode, if driving
+read_data_bus  = bus.read_data_bus   # read the data bus (assumed to be in input mode)
+
+# clock edges wait only as long as the CPU's timing profile needs beyond the pin write itself (see
+# cupboard_timing.py); calibrate_edges() measures the board and picks the plain or waiting version of each edge
+edge_timing = cupboard_timing.EdgeTiming("65C02")
 
 # clock falling edge = set clock to low phase
-def clock_low ():
-    global pin_clk
+def clock_low_now ():
     pin_clk.value = 0
-    time.sleep(0)   # wait a minimum of 40ns for tADS - sleep(0) takes ~16us on M4 in Circuit Python
+
+def clock_low_wait ():
+    pin_clk.value = 0
+    for _ in range(edge_timing.low_spins):  # wait out tADS
+        pass
 
 # clock rising edge = set clock to high phase
-def clock_high ():
-    global pin_clk  
+def clock_high_now ():
+    pin_clk.value = 1
+
+def clock_high_wait ():
     pin_clk.value = 1
-    time.sleep(0)   # wait a minimum of 40ns for tMDS - sleep(0) takes ~16us on M4 in Circuit Python
+    for _ in range(edge_timing.high_spins):  # wait out tMDS
+        pass
+
+clock_low = clock_low_wait
+clock_high = clock_high_wait
+
+# bind the edge functions for the current timing profile
+def apply_edge_timing ():
+    global clock_low, clock_high
+    clock_low = clock_low_wait if edge_timing.low_spins else clock_low_now
+    clock_high = clock_high_wait if edge_timing.high_spins else clock_high_now
+
+# measure this board's pin write and loop costs (pin_clk must be an output)
+def calibrate_edges ():
+    edge_timing.calibrate(pin_clk)
+    apply_edge_timing()
 
 # cycle the clock without inspection, used during power-up to reset chip
 def dummy_cycle (count):  
@@ -225,55 +293,245 @@ def dummy_cycle (count):
 
 # perform one or more complete clock cycles
 def cycle_clock (cycles=1, inter_cycle_delay=0):
-    global force_data_bus_reset, address_bus_value, data_bus_value, emulated_memory
+    global address_bus_value, data_bus_value, emulated_memory, cycle_count, cycle_flags
     global pins_addr, pins_data, pin_clk, pin_rst, pin_irq, pin_nmi, pin_sync, pin_vpb, pin_rw, pin_mlb
+    record = trace.record
+    flags = cycle_flags
+    watching = breaks.count != 0
+    break_maps = breaks.maps
+    profiling = profile_enable
+    profile_sync = profiler.sync
+    profile_reads = profiler.reads
+    profile_writes = profiler.writes
+    timing = stats_enable
+    countdown = stats.countdown
+    ns = time.monotonic_ns
     for _ in range(cycles):
+        # time this cycle if it is the next sample
+        sampling = False
+        if timing:
+            countdown -= 1
+            if countdown <= 0:
+                sampling = True
+                t0 = ns()
+        # device events (timer expiries) due on this cycle
+        if cycle_count == event_cycle:
+            service_events()
         # bring the clock (PHI2) low to start the cycle
         # --\__
         clock_low()
-        # if the previous cycle was a read from the CPU, free bus after falling edge
-        if (force_data_bus_reset):
-            reset_data_bus()
-            force_data_bus_reset = False
+        if sampling:
+            t1 = ns()
         # capture the address bus
         address_bus_value = read_addr_bus()
+        page = address_bus_value >> 8
+        region = page_map[page]
         # capture output status pins
         rw_signal = pin_rw.value      # Read-Write: high = CPU reads from memory, low = CPU writes to memory
-        sync_signal = pin_sync.value  # SYNC: high indicates that we're reading an opcode & begin command disassembly
-        mlb_signal = pin_mlb.value    # Memory Lock: low indicates memory hold (for delaying RAM access in multi-processor systems)
-        vpb_signal = pin_vpb.value    # Vector Pull: low indicates that vector is being fetched during interrupt sequence
-        status = "smv%d%d%d" % (1 if sync_signal else 0, 1 if mlb_signal else 0, 1 if vpb_signal else 0)
+        flags = 0
+        if rw_signal:
+            flags |= cupboard_trace.TRACE_RW
+        if pin_sync.value:            # SYNC: high indicates that we're reading an opcode & begin command disassembly
+            flags |= cupboard_trace.TRACE_SYNC
+        if pin_mlb.value:             # Memory Lock: low indicates memory hold (for delaying RAM access in multi-processor systems)
+            flags |= cupboard_trace.TRACE_MLB
+        if pin_vpb.value:             # Vector Pull: low indicates that vector is being fetched during interrupt sequence
+            flags |= cupboard_trace.TRACE_VPB
+        # the data bus stays driven through a run of emulated reads; it is released during PHI2 low (after the
+        # previous read's hold time, before a writing CPU or external memory drives it) only when this cycle isn't one
+        if not (rw_signal and region):
+            release_data_bus()
+        if sampling:
+            t2 = ns()
         # __/--
         clock_high()
-        print("%04x %s " % (address_bus_value, status), end='')
+        if sampling:
+            t3 = ns()
         if (rw_signal):
             # READ operation
-            if is_emulated_memory(address_bus_value):
+            if region:
                 # part of emulated memory - "write" data back to the CPU
-                data_bus_value = emulated_memory[address_bus_value]
-                write_data_bus(data_bus_value)
-                force_data_bus_reset = True # need to reset the written data on the data bus AFTER next falling edge of clock
-                print("R %02x" % data_bus_value)
+                if region == PAGE_IO:
+                    data_bus_value = io_handlers[page].read(address_bus_value)
+                else:
+                    data_bus_value = emulated_memory[address_bus_value]
+                drive_data_bus(data_bus_value)
+                flags |= cupboard_trace.TRACE_EMULATED
             else:
-                # not part of emulated memory - read data from bus and report
+                # not part of emulated memory - read data from bus
                 data_bus_value = read_data_bus()
-                print("r %02x" % data_bus_value)
         else:
             # WRITE operation
             data_bus_value = read_data_bus()
-            if is_emulated_memory(address_bus_value):
-                # part of emulated memory - save data and report change
-                print("W %02x -> %02x" % (emulated_memory[address_bus_value], data_bus_value))
-                emulated_memory[address_bus_value] = data_bus_value
+            if region:
+                # part of emulated memory - save data (ROM pages write into a discard page)
+                if trace_verbose:
+                    print("%04x %s W %02x -> %02x" % (address_bus_value, cupboard_trace.status_text(flags), emulated_memory[address_bus_value], data_bus_value))
+                if region == PAGE_IO:
+                    io_handlers[page].write(address_bus_value, data_bus_value)
+                else:
+                    write_pages[page][address_bus_value & 0xff] = data_bus_value
+                flags |= cupboard_trace.TRACE_EMULATED
+        if sampling:
+            t4 = ns()
+        if trace_enable:
+            record(address_bus_value, data_bus_value, flags, cycle_count)
+        if profiling:
+            if rw_signal:
+                profile_reads[page] += 1
+                if flags & cupboard_trace.TRACE_SYNC:
+                    profile_sync(address_bus_value, data_bus_value, cycle_count)
+            else:
+                profile_writes[page] += 1
+        if trace_verbose and not (flags & cupboard_trace.TRACE_EMULATED and not rw_signal):
+            print("%04x %s %s %02x" % (address_bus_value, cupboard_trace.status_text(flags), cupboard_trace.op_text(flags), data_bus_value))
+        if watching:
+            # one bit test in the bitmap for this kind of cycle; stop after the cycle that hit
+            kind = cupboard_break.BREAK_EXEC if flags & cupboard_trace.TRACE_SYNC else (cupboard_break.BREAK_READ if rw_signal else cupboard_break.BREAK_WRITE)
+            if break_maps[kind][address_bus_value >> 3] & (1 << (address_bus_value & 7)) and breaks.hit(kind, address_bus_value, data_bus_value, cycle_count):
+                cycle_count = (cycle_count + 1) & cupboard_trace.CYCLE_MASK
+                if sampling:
+                    stats.record(t0, t1, t2, t3, t4, ns())
+                    countdown = stats.next_interval()
+                break
+        cycle_count = (cycle_count + 1) & cupboard_trace.CYCLE_MASK
+        if inter_cycle_delay:
+            time.sleep(inter_cycle_delay)
+        if sampling:
+            stats.record(t0, t1, t2, t3, t4, ns())
+            countdown = stats.next_interval()
+    cycle_flags = flags
+    stats.countdown = countdown
+
+# perform clock cycles, sending the trace to the host a frame at a time while streaming; stops early at a
+# breakpoint or watchpoint hit (breaks.triggered)
+def run_cycles (cycles=1, inter_cycle_delay=0):
+    if not trace_stream:
+        cycle_clock(cycles, inter_cycle_delay)
+        return
+    while cycles > 0 and breaks.triggered is None:
+        n = min(cycles, cupboard_trace.FRAME_RECORDS - trace.pending())
+        cycle_clock(n, inter_cycle_delay)
+        cycles -= n
+        if trace.pending() >= cupboard_trace.FRAME_RECORDS:
+            trace.send_pending()
+
+# report a breakpoint or watchpoint hit with the cycle that triggered it
+def show_break ():
+    print(breaks.describe())
+    if trace_enable and not trace_verbose and trace.count > 0:
+        print(trace.format((trace.head - 1) & trace.mask))
+
+# free-run until there is keyboard input, clocking in batches. With a target rate, the number of cycles due is
+# worked out from the time since the start rather than by sleeping a fixed time per cycle, so time lost to sleep
+# granularity, polling and trace output is made up in the next batch instead of accumulating as drift. A run that
+# falls more than a poll interval behind slips its schedule rather than bursting to catch up.
+def free_run ():
+    global free_run_enable
+    breaks.triggered = None
+    start_cycle = cycle_count
+    start_ns = time.monotonic_ns()
+    base_ns = start_ns  # time the schedule counts cycles from
+    base_done = 0       # cycles done at base_ns
+    poll_ns = start_ns
+    poll_limit_ns = FR_POLL_MS * 1000000
+    done = 0
+    polled = 0
+    slips = 0
+    while True:
+        now = time.monotonic_ns()
+        if free_run_hz:
+            due = (now - base_ns) * free_run_hz // 1000000000 - (done - base_done)
+            if due > FR_POLL_CYCLES:
+                base_ns = now
+                base_done = done
+                due = 1
+                slips += 1
+            if due <= 0:
+                # ahead of the clock: sleep until the next cycle is due, waking in time to poll the keyboard
+                wait = (done - base_done + 1) * 1000000000 // free_run_hz - (now - base_ns)
+                time.sleep(min(wait, poll_limit_ns) / 1000000000)
             else:
-                # not part of emulated memory - report data
-                print("w %02x" % data_bus_value)
-        time.sleep(inter_cycle_delay)
+                n = min(due, FR_BATCH)
+                run_cycles(n, free_run_delay)
+                done += n
+        else:
+            run_cycles(FR_BATCH, free_run_delay)
+            done += FR_BATCH
+        if breaks.triggered is not None:
+            break
+        if done - polled >= FR_POLL_CYCLES or now - poll_ns >= poll_limit_ns:
+            polled = done
+            poll_ns = now
+            if supervisor.runtime.serial_bytes_available:
+                break
+    free_run_enable = False
+    if trace_stream:
+        trace.send_pending()
+    elapsed = max(time.monotonic_ns() - start_ns, 1)
+    done = (cycle_count - start_cycle) & cupboard_trace.CYCLE_MASK
+    text = "Free run: %d cycles in %d ms, %d Hz" % (done, elapsed // 1000000, done * 1000000000 // elapsed)
+    if free_run_hz:
+        text += " (target %d Hz" % free_run_hz
+        if slips:
+            text += ", fell behind %d times" % slips
+        text += ")"
+    print(text)
+    if breaks.triggered is not None:
+        show_break()
+
+# a clock rate such as 500HZ, 10KHZ or 1.5MHZ in Hz; 0 if it doesn't parse
+def parse_rate (text):
+    number = text[:-2]
+    scale = 1
+    if number.endswith('K'):
+        number, scale = number[:-1], 1000
+    elif number.endswith('M'):
+        number, scale = number[:-1], 1000000
+    try:
+        return int(float(number) * scale)
+    except ValueError:
+        print("FIELD ERROR")
+        return 0
+
+# clock until an opcode fetch (SYNC) has been seen; returns the number of cycles, 0 if none within STEP_LIMIT
+def cycle_to_sync ():
+    for n in range(1, STEP_LIMIT + 1):
+        run_cycles(1)
+        if cycle_flags & cupboard_trace.TRACE_SYNC:
+            return n
+    return 0
+
+# execute one whole instruction, from its opcode fetch up to the next opcode fetch, and print it disassembled
+def step_instruction ():
+    if not (cycle_flags & cupboard_trace.TRACE_SYNC) and cycle_to_sync() == 0:
+        print("No opcode fetch within %d cycles" % STEP_LIMIT)
+        return False
+    pc = address_bus_value
+    opcode = data_bus_value
+    num_operands = cupboard_opcodes.opcode_length[opcode] - 1
+    operands = [0, 0]
+    seen = 0
+    for cycles in range(1, STEP_LIMIT + 1):
+        run_cycles(1)
+        if cycle_flags & cupboard_trace.TRACE_SYNC:
+            print("%-34s %d cycles" % (cupboard_opcodes.listing(pc, opcode, operands[0], operands[1]), cycles))
+            return True
+        # operand bytes are the reads of pc+1 and pc+2 during the instruction
+        if seen < num_operands and address_bus_value == ((pc + 1 + seen) & 0xffff) and cycle_flags & cupboard_trace.TRACE_RW:
+            operands[seen] = data_bus_value
+            seen += 1
+    print("%s  (no opcode fetch within %d cycles)" % (cupboard_opcodes.listing(pc, opcode, operands[0], operands[1]), STEP_LIMIT))
+    return False
 
 # reset state of the CPU
 def reset_cpu ():
     global pins_addr, pins_data, pin_clk, pin_rst, pin_irq, pin_nmi, pin_sync, pin_vpb, pin_rw, pin_mlb
     pin_rst.value = False # put CPU into reset
+    if via_enable:
+        via.reset()           # the VIA shares the system reset
+        via_irq_changed(False)
+        schedule_events()
     time.sleep(0.01)      # allow time to settle (not necessary in Circuit Python, more of a note)
     pin_nmi.value = True  # reset value
     pin_clk.value = True  # reset value
@@ -311,29 +569,278 @@ def print_version ():
 def show_help ():
     print_version()
     print("  C count?  - Cycle CPU clock, optional number of cycles")
-    print("  FR delay? - Free Run clock, optional delay in milliseconds")
+    print("  B addr    - Breakpoint: stop C, S and FR after an opcode fetch from addr")
+    print("  BR addr value? - Read watchpoint: stop after a read of addr, optionally only when the data is value")
+    print("  BW addr value? - Write watchpoint: stop after a write to addr, optionally only when the data is value")
+    print("  BL        - Breakpoint List")
+    print("  BC addr?  - Breakpoint Clear at addr, or all")
+    print("  FR delay? rate? - Free Run clock until a key is pressed, optional delay per cycle in milliseconds and/or")
+    print("              target clock rate (e.g. 500HZ, 10KHZ); reports the rate achieved when stopped")
+    print("  S count?  - Step whole instructions, optional number of instructions, printing each disassembled")
+    print("  L file addr? - Load an Intel HEX, S-record or raw binary file from CIRCUITPY (binary at addr, default ending at ffff)")
+    print("  LS        - Load Stream: send Intel HEX or S-record lines, ending with the end record or '.'")
+    print("  MAP start end EXT|RAM|ROM - Map address range as external, emulated RAM or emulated ROM; show map if no parameters")
+    print("  PF ON|OFF - Profile: count executions and cycles per instruction, calls and page accesses; report state if no parameter")
+    print("  PFT count? - Profile Top: the instructions with the most cycles, disassembled (default 16)")
+    print("  PFS       - Profile Subroutines: calls and cycles per subroutine (JSR to RTS, including callees)")
+    print("  PFH       - Profile Heat map: reads and writes per memory page")
+    print("  PFC       - Profile Clear")
     print("  RC        - Reset CPU")
+    print("  RM        - Reset Memory to the power-on snapshot")
+    print("  SS name   - Snapshot Save: keep the current memory image under a name")
+    print("  SR name?  - Snapshot Restore, default the power-on image")
+    print("  SL        - Snapshot List")
+    print("  SD name   - Snapshot Delete")
+    print("  STATS ON|OFF|CLEAR - Time a sample of bus cycles phase by phase; report clock rate, phases and jitter if no parameter")
     print("  ?         - Help, show this information")
     print("  .         - Echo request, expects '*' and return to prompt")
     print("  H ON|OFF  - Hex-only mode on or off, report state if no parameter")
+    print("  T count?  - Trace, show the last cycles recorded (default 16)")
+    print("  TF R|W|S|V|A lo hi?|D val - Trace Filter, show recorded Reads, Writes, Sync, Vector pulls, Address range or Data value")
+    print("  TS        - Trace Stream, output the whole trace buffer as packed hex records")
+    print("  TB ON|OFF? - Trace Binary, send the trace buffer as binary frames, or stream every cycle while ON")
+    print("  TC        - Trace Clear")
+    print("  TE ON|OFF - Trace Enable, record cycles in the trace buffer, report state if no parameter")
+    print("  TV ON|OFF - Trace Verbose, print every cycle as it runs, report state if no parameter")
+    print("  TIMING CAL|cpu? - Show the clock-edge timing profile and board calibration; CAL recalibrates, cpu selects a profile")
     print("  V         - Version, report software version")
+    print("  VIA ON|OFF - Emulated 6522 VIA at %04x (drives IRQ) or physical VIA; show registers if no parameter" % VIA_ADDRESS)
+    print("  VIA PA|PB value - Set the levels on the emulated VIA's port A or B input pins")
+
+# load Intel HEX or S-record lines from the console until the end record (or a '.' line)
+def load_stream ():
+    print("Send records, end with the end record or '.'")
+    loader, error = cupboard_loader.load_stream(emulated_memory)
+    if error is not None:
+        print("Load failed:", error)
+    print(loader.report())
+
+# ON/OFF switch command: returns the new setting, reporting it when there is no parameter
+def switch_setting (name, value, args):
+    if len(args) == 0:
+        print("%s:" % name, "Enabled" if value else "Disabled")
+    elif len(args) == 1 and args[0] in ('ON', 'OFF'):
+        return args[0] == 'ON'
+    elif len(args) == 1:
+        print("%s recognizes ON or OFF" % name)
+    else:
+        print("%s takes up to one field" % name)
+    return value
 
-def handle_command (cmd, args):
-    global dump_prev_addr, dump_prev_count, write_prev_address, output_width, pin_oe, force_hex, free_run_delay, free_run_enable
+def handle_command (cmd, args, cmdline):
+    global dump_prev_addr, dump_prev_count, write_prev_address, output_width, pin_oe, force_hex, free_run_delay, free_run_enable, free_run_hz
+    global trace_enable, trace_verbose, trace_stream, profile_enable, stats_enable
     num_args = len(args)
 
     if cmd == 'C': # Cycle clock [count]
         num_steps = 1 if num_args == 0 else convert_user_number(args[0])
-        cycle_clock(num_steps)
+        breaks.triggered = None
+        start_cycle = cycle_count
+        run_cycles(num_steps)
+        if trace_stream:
+            trace.send_pending()
+        elif trace_enable and not trace_verbose:
+            trace.dump((cycle_count - start_cycle) & cupboard_trace.CYCLE_MASK)
+        if breaks.triggered is not None:
+            print(breaks.describe())
+
+    elif cmd in ('B', 'BR', 'BW'): # Breakpoint / read or write watchpoint: addr [value]
+        kind = {'B': cupboard_break.BREAK_EXEC, 'BR': cupboard_break.BREAK_READ, 'BW': cupboard_break.BREAK_WRITE}[cmd]
+        if num_args == 1 or (num_args == 2 and cmd != 'B'):
+            breaks.set(kind, convert_user_number(args[0]), convert_user_number(args[1]) if num_args == 2 else None)
+        elif cmd == 'B':
+            print("Breakpoint takes an address")
+        else:
+            print("Watchpoint takes an address and an optional data value")
+
+    elif cmd == 'BL': # Breakpoint List
+        for kind, addr, value in breaks.list():
+            if value is None:
+                print("%-5s %04x" % (cupboard_break.KIND_NAMES[kind], addr))
+            else:
+                print("%-5s %04x = %02x" % (cupboard_break.KIND_NAMES[kind], addr, value))
+        print("%d set" % breaks.count)
+
+    elif cmd == 'BC': # Breakpoint Clear [addr]
+        if num_args == 0:
+            breaks.clear_all()
+        else:
+            addr = convert_user_number(args[0])
+            if not any([breaks.clear(kind, addr) for kind in range(len(cupboard_break.KIND_NAMES))]):
+                print("Nothing set at %04x" % addr)
+
+    elif cmd == 'T': # Trace [count]
+        trace.dump(16 if num_args == 0 else convert_user_number(args[0]))
+
+    elif cmd == 'TF': # Trace Filter kind [values]
+        match = None
+        if num_args > 0:
+            match = cupboard_trace.make_filter(args[0], [convert_user_number(a) for a in args[1:]])
+        if match is None:
+            print("Trace filter is R, W, S, V, A lo hi? or D value")
+        else:
+            print("%d cycles" % trace.dump(None, match))
+
+    elif cmd == 'TS': # Trace Stream
+        trace.stream()
+
+    elif cmd == 'TB': # Trace Binary [ON|OFF]
+        if num_args == 0:
+            trace.send_all()
+        elif args[0] in ('ON', 'OFF'):
+            if trace_stream:
+                trace.send_pending()
+                trace.send_end()
+            trace_stream = args[0] == 'ON'
+            trace.sent = trace.head
+        else:
+            print("Trace binary recognizes ON or OFF")
+
+    elif cmd == 'PF': # Profile [ON|OFF]
+        enable = switch_setting("Profile", profile_enable, args)
+        if enable and not profile_enable:
+            profiler.last_slot = -1  # don't charge the cycles run while profiling was off
+        profile_enable = enable
+
+    elif cmd == 'PFC': # Profile Clear
+        profiler.clear()
+
+    elif cmd == 'PFT': # Profile Top [count]
+        total = max(profiler.total_cycles(), 1)
+        print("    count    cycles  cyc/ex      %")
+        for pc, opcode, count, cycles in profiler.top(16 if num_args == 0 else convert_user_number(args[0])):
+            print("%9d %9d %7.1f %6.2f  %s" % (count, cycles, cycles / max(count, 1), cycles * 100 / total,
+                                                 cupboard_profile.listing(emulated_memory, is_emulated_memory(pc), pc, opcode)))
+        if profiler.other:
+            print("%d opcode fetches not counted, address table full" % profiler.other)
+
+    elif cmd == 'PFS': # Profile Subroutines
+        total = max(profiler.total_cycles(), 1)
+        print("  addr     calls    cycles  cyc/call      %")
+        for pc, calls, cycles in profiler.subroutine_list():
+            print("  %04x %9d %9d %9.1f %6.2f" % (pc, calls, cycles, cycles / calls, cycles * 100 / total))
+
+    elif cmd == 'PFH': # Profile Heat map
+        profiler.show_heat(profiler.reads, "Reads")
+        profiler.show_heat(profiler.writes, "Writes")
+
+    elif cmd == 'STATS': # bus loop STATS [ON|OFF|CLEAR]
+        if num_args == 1 and args[0] == 'CLEAR':
+            stats.clear()
+        elif num_args > 0:
+            stats_enable = switch_setting("Stats", stats_enable, args)
+        else:
+            print("Stats:", "Enabled" if stats_enable else "Disabled")
+            stats.report()
+
+    elif cmd == 'TIMING': # clock edge TIMING [CAL|profile]
+        if num_args == 1 and args[0] == 'CAL':
+            calibrate_edges()
+        elif num_args == 1:
+            if edge_timing.select(args[0]):
+                apply_edge_timing()
+            else:
+                print("No timing profile %s" % args[0])
+        edge_timing.show()
+
+    elif cmd == 'TC': # Trace Clear
+        trace.clear()
+
+    elif cmd == 'TE': # Trace Enable
+        trace_enable = switch_setting("Trace", trace_enable, args)
+
+    elif cmd == 'TV': # Trace Verbose
+        trace_verbose = switch_setting("Trace verbose", trace_verbose, args)
+
+    elif cmd == 'S': # Step instruction [count]
+        num_steps = 1 if num_args == 0 else convert_user_number(args[0])
+        breaks.triggered = None
+        for _ in range(num_steps):
+            if not step_instruction() or breaks.triggered is not None:
+                break
+        if trace_stream:
+            trace.send_pending()
+        if breaks.triggered is not None:
+            print(breaks.describe())
 
     elif cmd == 'FR': # Free Run
-        free_run_delay = 0 if num_args == 0 else (convert_user_number(args[0]) / 1000.0)
+        # FR [delay] [rate]: a plain number is the per-cycle delay in milliseconds, a number ending HZ/KHZ/MHZ the target rate
+        free_run_delay = 0
+        free_run_hz = 0
+        for a in args:
+            if a.endswith('HZ'):
+                free_run_hz = parse_rate(a)
+            else:
+                free_run_delay = convert_user_number(a) / 1000.0
+        if free_run_hz:
+            print("Free run at %d Hz, any key stops" % free_run_hz)
+        else:
+            print("Free run, any key stops")
         free_run_enable = True
 
+    elif cmd == 'L': # Load file [address]
+        if num_args == 0 or num_args > 2:
+            print("Load takes a file name and an optional address")
+        else:
+            try:
+                # the file name as typed: args are upper-cased, and only the board's FAT drive ignores case
+                loader = cupboard_loader.load_file(emulated_memory, cmdline.split()[1], convert_user_number(args[1]) if num_args == 2 else None)
+                print(loader.report())
+            except (OSError, cupboard_loader.LoadError) as e:
+                print("Load failed:", e)
+
+    elif cmd == 'LS': # Load Stream
+        load_stream()
+
+    elif cmd == 'MAP': # memory MAP [start end type]
+        if num_args == 0:
+            show_memory_map()
+        elif num_args == 3 and args[2] in PAGE_NAMES:
+            region = PAGE_NAMES.index(args[2])
+            start = convert_user_number(args[0])
+            end = convert_user_number(args[1])
+            if region == PAGE_IO:
+                print("I/O pages are mapped by their device")
+            elif start > end or end > 0xffff:
+                print("MAP range must be start <= end <= ffff")
+            else:
+                map_pages(start, end, region)
+                show_memory_map()
+        else:
+            print("MAP takes start end EXT|RAM|ROM")
+
     elif cmd == 'RC': # Reset Cpu
         print("Reset CPU")
         reset_cpu()
 
+    elif cmd == 'RM': # Reset Memory
+        print("Reset memory")
+        reset_memory()
+
+    elif cmd == 'SS': # Snapshot Save
+        if num_args != 1:
+            print("Snapshot save takes a name")
+        elif args[0] == cupboard_snapshot.POWER_ON:
+            print("%s is built in" % cupboard_snapshot.POWER_ON)
+        else:
+            print("Saved %s, %d pages differ from power-on" % (args[0], snapshots.save(args[0])))
+
+    elif cmd == 'SR': # Snapshot Restore
+        name = cupboard_snapshot.POWER_ON if num_args == 0 else args[0]
+        ns = snapshots.restore(name)
+        if ns is None:
+            print("No snapshot %s" % name)
+        else:
+            print("Restored %s in %d us" % (name, ns // 1000))
+
+    elif cmd == 'SL': # Snapshot List
+        for name, pages in snapshots.list():
+            print("%-16s %3d pages" % (name, pages))
+
+    elif cmd == 'SD': # Snapshot Delete
+        if num_args != 1 or not snapshots.delete(args[0]):
+            print("Snapshot delete takes the name of a saved snapshot")
+
     elif cmd == 'H': # Hex-only mode on or off, report state if no parameter
         if num_args == 0:
             print("Hex-only input:", "Enabled" if force_hex else "Disabled")
@@ -347,6 +854,21 @@ def handle_command (cmd, args):
         else:
             print("Hex-only takes up to one field")
 
+    elif cmd == 'VIA': # emulated VIA [ON|OFF] or [PA|PB value]
+        if num_args == 0:
+            if via_enable:
+                via.show()
+            else:
+                print("Emulated VIA: Disabled")
+        elif num_args == 1 and args[0] in ('ON', 'OFF'):
+            enable_via(args[0] == 'ON')
+        elif num_args == 2 and args[0] == 'PA':
+            via.port_a_in = convert_user_number(args[1]) & 0xff
+        elif num_args == 2 and args[0] == 'PB':
+            via.port_b_in = convert_user_number(args[1]) & 0xff
+        else:
+            print("VIA takes ON, OFF, PA value or PB value")
+
     elif cmd == 'V': # Version
         print_version()
 
@@ -366,25 +888,30 @@ def handle_command (cmd, args):
 def main ():
     global free_run_enable, free_run_delay
     reset_all_pins()
+    calibrate_edges()
     reset_cpu()
     reset_memory()
     led.value = True
     print("\nEMon:")
     while True:
         while supervisor.runtime.serial_bytes_available:
-            input_fields = input().strip().upper().split(' ')
+            cmdline = input().strip()
+            input_fields = cmdline.upper().split(' ')
             free_run_enable = False  # any keyboard input breaks free-run
+            if trace_stream:
+                trace.send_pending()
             if len(input_fields) > 0:
                 cmd = input_fields[0]
                 args = []
                 for a in input_fields[1:]:
                     if len(a) > 0:
                         args.append(a)
-                handle_command(cmd, args)
+                handle_command(cmd, args, cmdline)
             print("EMon:")
         if free_run_enable:
-            time.sleep(free_run_delay)
-            cycle_clock()
+            free_run()
+            if breaks.triggered is not None:
+                print("EMon:")
         else:
             time.sleep(0.05)
             led.value = not led.value
@@ -0,0 +1,221 @@
+# emon_client.py
+# Host side of the EMon binary trace stream: captures trace frames from emon6502.py over serial (or decodes a raw
+# capture file), rebuilds the per-cycle trace, disassembles each instruction and writes the result to a file.
+#
+#   python3 emon_client.py DUMP trace.txt -p /dev/ttyACM0           # the board's trace buffer (TB)
+#   python3 emon_client.py CAPTURE trace.txt -p /dev/ttyACM0        # free-run with streaming (TB ON + FR), Ctrl-C to stop
+#   python3 emon_client.py CAPTURE trace.txt -n 100000              # clock 100000 cycles with streaming
+#   python3 emon_client.py CAPTURE trace.txt -r 10KHZ               # free-run at a target clock rate
+#   python3 emon_client.py DECODE trace.txt --raw capture.bin       # decode bytes captured earlier
+#   python3 emon_client.py LOAD rom.hex -p /dev/ttyACM0             # stream an image into emulated memory (LS)
+#   python3 emon_client.py LOAD rom.bin -a 0x8000                   # raw binary is sent as Intel HEX
+#
+# See cupboard_trace.py for the frame and record format.
+
+import sys
+import time
+import argparse
+import cupboard_trace
+import cupboard_opcodes
+import cupboard_loader
+
+# show extra runtime information
+verbose = False
+
+# disassemble one instruction given its address, opcode and the operand bytes seen on the bus
+def disassemble (pc, opcode, operands):
+    if len(operands) < cupboard_opcodes.opcode_length[opcode] - 1:
+        return cupboard_opcodes.MNEMONICS[cupboard_opcodes.opcode_mnemonic[opcode]] + " ?"
+    return cupboard_opcodes.disassemble(pc, opcode, *operands)
+
+# write decoded records as text, one line per cycle, with the disassembly on each opcode fetch
+def write_trace (f, records):
+    for k, (cycle, addr, data, flags) in enumerate(records):
+        line = "%8d %04x %s %s %02x" % (cycle, addr, cupboard_trace.status_text(flags), cupboard_trace.op_text(flags), data)
+        if flags & cupboard_trace.TRACE_SYNC:
+            # operand bytes are the reads of the following addresses before the next opcode fetch (JSR reads
+            # its high byte last, after the stack cycles)
+            operands = []
+            for cycle2, addr2, data2, flags2 in records[k + 1:k + 8]:
+                if flags2 & cupboard_trace.TRACE_SYNC:
+                    break
+                if addr2 == (addr + 1 + len(operands)) & 0xffff and flags2 & cupboard_trace.TRACE_RW and len(operands) < 2:
+                    operands.append(data2)
+            line += "   %04x  %s" % (addr, disassemble(addr, data, operands))
+        f.write(line + "\n")
+
+# decode a raw byte stream: returns the records and the console text found around the frames
+def decode_stream (data):
+    decoder = cupboard_trace.FrameDecoder()
+    records = []
+    text = b''
+    for item in decoder.feed(data):
+        if item[0] == "text":
+            text += item[1]
+        elif item[1] == cupboard_trace.FRAME_TRACE:
+            records.extend(cupboard_trace.decode_records(item[2]))
+    if decoder.bad_frames or decoder.lost_frames:
+        print("%d damaged, %d lost frames" % (decoder.bad_frames, decoder.lost_frames))
+    return records, text
+
+def open_port (port):
+    import serial
+    return serial.Serial(port, 115200, timeout=0.1)
+
+def send_command (ser, cmd):
+    if verbose:
+        print(cmd)
+    ser.write(bytes(cmd + "\r\n", 'utf-8'))
+
+# read from the board until an end frame arrives (or Ctrl-C / timeout); returns raw bytes
+def read_until_end (ser, decoder, records, timeout=None, stop_after=None, on_stop=None):
+    raw = bytearray()
+    start = time.monotonic()
+    stopped = False
+    try:
+        while True:
+            data = ser.read(4096)
+            raw += data
+            for item in decoder.feed(data):
+                if item[0] == "frame":
+                    if item[1] == cupboard_trace.FRAME_END:
+                        return raw
+                    records.extend(cupboard_trace.decode_records(item[2]))
+                elif verbose:
+                    sys.stdout.write(item[1].decode('utf-8', 'replace'))
+            if not stopped and stop_after is not None and len(records) >= stop_after:
+                stopped = True
+                on_stop()
+            if timeout is not None and len(data) == 0 and time.monotonic() - start > timeout:
+                print("Timed out waiting for the end of the trace")
+                return raw
+    except KeyboardInterrupt:
+        if on_stop is not None and not stopped:
+            on_stop()
+            return raw + read_until_end(ser, decoder, records, timeout=5)
+        return raw
+
+# DUMP: the board's whole trace buffer
+def dump_trace (port, output_filename, raw_filename):
+    decoder = cupboard_trace.FrameDecoder()
+    records = []
+    with open_port(port) as ser:
+        send_command(ser, "TB")
+        raw = read_until_end(ser, decoder, records, timeout=5)
+    save(output_filename, raw_filename, raw, records, decoder)
+
+# CAPTURE: stream cycles while the board runs them, free-running (until Ctrl-C) or for a number of cycles
+def capture_trace (port, output_filename, raw_filename, cycles, delay, rate):
+    decoder = cupboard_trace.FrameDecoder()
+    records = []
+    with open_port(port) as ser:
+        send_command(ser, "TB ON")
+        if cycles > 0:
+            send_command(ser, "C %x" % cycles)
+            stop = lambda: send_command(ser, "TB OFF")
+            raw = read_until_end(ser, decoder, records, stop_after=cycles, on_stop=stop)
+        else:
+            cmd = "FR"
+            if delay:
+                cmd += " %x" % delay
+            if rate:
+                cmd += " " + rate
+            send_command(ser, cmd)
+            print("Capturing, Ctrl-C to stop")
+            stop = lambda: (send_command(ser, "."), send_command(ser, "TB OFF"))
+            raw = read_until_end(ser, decoder, records, on_stop=stop)
+    save(output_filename, raw_filename, raw, records, decoder)
+
+# DECODE: a raw capture saved earlier
+def decode_file (output_filename, raw_filename):
+    with open(raw_filename, "rb") as f:
+        records, _ = decode_stream(f.read())
+    save(output_filename, None, None, records, None)
+
+# Intel HEX lines for a raw binary image at address
+def ihex_lines (data, address, per_line=32):
+    lines = []
+    for offset in range(0, len(data), per_line):
+        chunk = data[offset:offset + per_line]
+        a = address + offset
+        rec = bytes([len(chunk), (a >> 8) & 0xff, a & 0xff, 0]) + chunk
+        lines.append(":%s%02X" % (rec.hex().upper(), -sum(rec) & 0xff))
+    lines.append(":00000001FF")
+    return lines
+
+# LOAD: stream an Intel HEX, S-record or raw binary file into emulated memory, one echoed line at a time
+def load_image (port, input_filename, address):
+    with open(input_filename, "rb") as f:
+        data = f.read()
+    if data[:1] in (b':', b'S', b's'):
+        lines = [l.strip() for l in data.decode().splitlines() if len(l.strip()) > 0]
+    else:
+        lines = ihex_lines(data, address if address is not None else 0x10000 - len(data))
+    start = time.monotonic()
+    with open_port(port) as ser:
+        ser.timeout = 2
+        send_command(ser, "LS")
+        ser.readline()  # echo
+        ser.readline()  # "Send records..."
+        for line in lines:
+            ser.write(bytes(line + "\r\n", 'utf-8'))
+            ser.readline()  # echo: the board has taken the line
+        if not any(cupboard_loader.is_end_record(line) for line in lines):
+            ser.write(b".\r\n")  # no end record to finish the load
+        # the report follows the end record or the '.' (the board reads to one of them even after a bad record),
+        # so skip any echo and prompt lines until it arrives
+        while True:
+            reply = ser.readline().decode('utf-8').strip()
+            if len(reply) == 0:
+                print("No report from the board")
+                break
+            if reply.startswith("Load failed") or reply.startswith("Loaded"):
+                print(reply)
+            if reply.startswith("Loaded"):
+                break
+    print("%d records sent in %.2f s" % (len(lines), time.monotonic() - start))
+
+def save (output_filename, raw_filename, raw, records, decoder):
+    if raw_filename is not None and raw is not None:
+        with open(raw_filename, "wb") as f:
+            f.write(raw)
+    with open(output_filename, "wt") as f:
+        write_trace(f, records)
+    print("%d cycles written to %s" % (len(records), output_filename))
+    if raw is not None and len(records) > 0:
+        print("%d bytes received, %.2f bytes per cycle" % (len(raw), len(raw) / len(records)))
+    if decoder is not None and (decoder.bad_frames or decoder.lost_frames):
+        print("%d damaged, %d lost frames" % (decoder.bad_frames, decoder.lost_frames))
+
+def main ():
+    global verbose
+    parser = argparse.ArgumentParser(description='EMon trace client')
+    parser.add_argument('command', type=str, help='DUMP|CAPTURE|DECODE|LOAD')
+    parser.add_argument('filename', type=str, help='decoded trace output file, or the image to LOAD')
+    parser.add_argument('-a', '--address', type=lambda v: int(v, 0), default=None, help='LOAD address of a raw binary image')
+    parser.add_argument('-p', '--port', type=str, default="COM15", help='serial port of the monitor')
+    parser.add_argument('--raw', type=str, default=None, help='raw capture file: saved by DUMP/CAPTURE, read by DECODE')
+    parser.add_argument('-n', '--cycles', type=int, default=0, help='CAPTURE this many cycles instead of free-running')
+    parser.add_argument('-d', '--delay', type=int, default=0, help='free-run delay in milliseconds')
+    parser.add_argument('-r', '--rate', type=str, default=None, help='free-run target clock rate, e.g. 500HZ or 10KHZ')
+    parser.add_argument('-v', '--verbose', action="store_true", help='display extra runtime info')
+    args = parser.parse_args()
+    verbose = args.verbose
+
+    cmd = args.command.upper()
+    if cmd == "DUMP":
+        dump_trace(args.port, args.filename, args.raw)
+    elif cmd == "CAPTURE":
+        capture_trace(args.port, args.filename, args.raw, args.cycles, args.delay, args.rate.upper() if args.rate else None)
+    elif cmd == "DECODE":
+        if args.raw is None:
+            print("DECODE needs --raw")
+        else:
+            decode_file(args.filename, args.raw)
+    elif cmd == "LOAD":
+        load_image(args.port, args.filename, args.address)
+    else:
+        print("Unknown command '%s'" % args.command)
+
+if __name__ == "__main__":
+    main()
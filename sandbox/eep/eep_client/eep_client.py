@@ -1,9 +1,24 @@
+import os
+import sys
 import serial
 import argparse
+import time
+
+# the binary link is shared with the firmware
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "circuit_python"))
+import cupboard_link
 
 # show extra runtime information
 verbose = False
 
+# only use the text commands, even if the firmware offers binary transfers
+text_only = False
+
+EEPROM_SIZE      = 0x8000
+EEPROM_PAGE_SIZE = 64
+PAGE_WRITE_S     = 0.010  # estimated time to write a page, used until one has been timed
+MAX_DIFFERENCES  = 64     # differing bytes listed by COMPARE
+
 def echo_check (ser):
     ser.write(b'.\r\n')
     ser.readline() # ignore echo
@@ -28,6 +43,77 @@ def version_check (ser):
     data = ser.readline().decode('utf-8').strip()
     return (data == "EEP:")
 
+# switch the programmer to binary transfers - returns the link, or None if the firmware only has text commands
+def binary_start (ser):
+    if text_only:
+        return None
+    ser.write(b'BIN\r\n')
+    ser.readline() # ignore echo
+    reply = ser.readline().decode('utf-8').strip().split(' ')
+    if len(reply) < 4 or reply[0] != "BIN" or int(reply[1]) != cupboard_link.LINK_VERSION:
+        # older firmware: skip its "Unknown command" help
+        while len(reply) > 0 and reply[0] != "EEP:":
+            reply = ser.readline().decode('utf-8').strip().split(' ')
+            if reply == ['']:
+                break
+        return None
+    link = cupboard_link.Link(lambda: ser.read(max(ser.in_waiting, 1)), ser.write, True)
+    link.window = int(reply[2])
+    link.block = int(reply[3])
+    if verbose:
+        print("Binary transfers: window %d, block %d bytes" % (link.window, link.block))
+    return link
+
+# leave binary mode and read up to the end of the "EEP:" prompt line, so the next command's echo comes first
+def binary_end (ser, link):
+    cupboard_link.exchange(link, [(cupboard_link.LINK_END, b'')])
+    pending = link.pending
+    link.pending = b''
+    prompt = pending.find(b"EEP:")
+    if prompt < 0:
+        ser.read_until(b"EEP:")
+        rest = b''
+    else:
+        rest = pending[prompt + 4:]  # the link may have read the prompt, and any of its line end, with the last frame
+    if b"\n" not in rest:
+        ser.readline()
+
+# read count bytes from address, a block per request
+def binary_read (link, address, count):
+    requests = []
+    for a in range(address, address + count, link.block):
+        n = min(link.block, address + count - a)
+        requests.append((cupboard_link.LINK_READ, bytes([a & 0xff, a >> 8, n & 0xff, n >> 8])))
+    data = bytearray()
+    for kind, payload in cupboard_link.exchange(link, requests):
+        data += payload[2:]
+    return data
+
+# write the image bytes marked present within the given pages (all if None), a run of at most a block per request
+# - returns the number of bytes that failed to verify on the board
+def binary_write (link, image, present, pages=None):
+    if pages is None:
+        pages = range(0, EEPROM_SIZE, EEPROM_PAGE_SIZE)
+    requests = []
+    for page in pages:
+        a = page
+        while a < page + EEPROM_PAGE_SIZE:
+            if not present[a]:
+                a += 1
+                continue
+            run = a
+            while a < page + EEPROM_PAGE_SIZE and present[a]:
+                a += 1
+            if len(requests) > 0 and requests[-1][2] == run and run % link.block != 0:
+                requests[-1][1] += image[run:a]  # extend the previous run
+            else:
+                requests.append([cupboard_link.LINK_WRITE, bytearray([run & 0xff, run >> 8]) + image[run:a], a])
+            requests[-1][2] = a
+    failed = 0
+    for kind, payload in cupboard_link.exchange(link, [(r[0], r[1]) for r in requests]):
+        failed += payload[0] | (payload[1] << 8)
+    return failed
+
 def read_eeprom (port, output_filename, relocate):
     with open(output_filename, "wt") as f:
         with serial.Serial(port, 115200, timeout=1) as ser:
@@ -35,6 +121,15 @@ def read_eeprom (port, output_filename, relocate):
                 return
             if not version_check(ser):
                 return
+            link = binary_start(ser)
+            if link is not None:
+                start = time.monotonic()
+                data = binary_read(link, 0, EEPROM_SIZE)
+                binary_end(ser, link)
+                print("Read %d bytes in %.1fs" % (len(data), time.monotonic() - start))
+                for addr in range(0, EEPROM_SIZE, 16):
+                    f.write("%04x %s\n" % (addr + relocate, "".join("%02x " % d for d in data[addr:addr + 16])))
+                return
             addr = 0
             ser.write(b'D 0 10\r\n')
             ser.readline() # ignore echo
@@ -58,26 +153,210 @@ def write_eeprom (port, input_filename, relocate):
                 return
             if not version_check(ser):
                 return
+            link = binary_start(ser)
+            if link is not None:
+                image, present = load_image(input_filename, relocate)
+                start = time.monotonic()
+                failed = binary_write(link, image, present)
+                binary_end(ser, link)
+                print("Wrote %d bytes in %.1fs, %d failed" % (sum(present), time.monotonic() - start, failed))
+                return
             for l in f.readlines():
                 t = l.strip().split(' ', 1)
                 if len(t) > 1:
                     addr = int(t[0], 16) - relocate
                     cmd = "W %04x %s" % (addr, t[1])
                     print(cmd)
-                    ser.write(bytes(cmd, 'utf-8'))
+                    ser.write(bytes(cmd + "\r\n", 'utf-8'))
                     ser.readline() # ignore echo
                     ser.readline() # ignore "EEP:"
 
+# send a command and return the lines it prints, up to the "EEP:" prompt
+def eep_command (ser, cmd):
+    ser.write(bytes(cmd + "\r\n", 'utf-8'))
+    ser.readline() # ignore echo
+    lines = []
+    while True:
+        data = ser.readline()
+        if len(data) == 0:
+            break # timeout
+        data = data.decode('utf-8').strip()
+        if data == "EEP:":
+            break
+        lines.append(data)
+    return lines
+
+# load a hex text file ("addr data data ...", as written by READ) - returns the image and a map of bytes it sets
+def load_image (input_filename, relocate):
+    image = bytearray(b'\xff' * EEPROM_SIZE)
+    present = bytearray(EEPROM_SIZE)
+    with open(input_filename, "rt") as f:
+        for l in f.readlines():
+            t = l.split()
+            if len(t) > 1:
+                addr = int(t[0], 16) - relocate
+                for d in t[1:]:
+                    image[addr] = int(d, 16)
+                    present[addr] = 1
+                    addr += 1
+    return image, present
+
+# read whole pages from the EEPROM - returns {page address: bytes}
+def read_pages (ser, link, pages):
+    contents = {}
+    if link is not None:
+        requests = [(cupboard_link.LINK_READ, bytes([p & 0xff, p >> 8, EEPROM_PAGE_SIZE, 0])) for p in pages]
+        for page, (kind, payload) in zip(pages, cupboard_link.exchange(link, requests)):
+            contents[page] = payload[2:]
+        return contents
+    for page in pages:
+        data = bytearray()
+        for l in eep_command(ser, "D %04x %x" % (page, EEPROM_PAGE_SIZE)):
+            data += bytes(int(d, 16) for d in l.split()[1:])
+        contents[page] = data
+    return contents
+
+# CRC-32 of each of the given pages on the EEPROM, computed by the firmware - returns {page address: crc}
+def page_crcs (ser, link, pages):
+    # ranges of consecutive pages, as many as one request (or one text command) covers
+    per = link.block // 4 if link is not None else EEPROM_SIZE // EEPROM_PAGE_SIZE
+    ranges = []
+    for page in pages:
+        if len(ranges) > 0 and ranges[-1][1] == page and (page - ranges[-1][0]) // EEPROM_PAGE_SIZE < per:
+            ranges[-1][1] = page + EEPROM_PAGE_SIZE
+        else:
+            ranges.append([page, page + EEPROM_PAGE_SIZE])
+    crcs = {}
+    if link is not None:
+        requests = []
+        for start, end in ranges:
+            n = end - start
+            requests.append((cupboard_link.LINK_CRC, bytes([start & 0xff, start >> 8, n & 0xff, n >> 8, EEPROM_PAGE_SIZE, 0])))
+        for (start, end), (kind, payload) in zip(ranges, cupboard_link.exchange(link, requests)):
+            for i in range(0, len(payload), 4):
+                crcs[start + i // 4 * EEPROM_PAGE_SIZE] = int.from_bytes(payload[i:i + 4], 'little')
+        return crcs
+    for start, end in ranges:
+        for l in eep_command(ser, "CRC %04x %x P" % (start, end - start)):
+            try:
+                t = l.split()
+                a = int(t[0].rstrip(':'), 16)
+                for c in t[1:]:
+                    crcs[a] = int(c, 16)
+                    a += EEPROM_PAGE_SIZE
+            except (ValueError, IndexError):
+                pass # older firmware without CRC: its pages are read instead
+    return crcs
+
+# pages where the image differs from the EEPROM: page CRCs first, then only the pages whose CRC doesn't match are
+# read (a page the image covers only in part may differ outside it) - returns the pages and {page: contents read}
+def changed_pages (ser, link, image, present, pages):
+    crcs = page_crcs(ser, link, pages)
+    contents = read_pages(ser, link, [p for p in pages if crcs.get(p) != cupboard_link.crc32(image[p:p + EEPROM_PAGE_SIZE])])
+    changed = []
+    for page, data in contents.items():
+        if any(present[a] and image[a] != data[a - page] for a in range(page, page + EEPROM_PAGE_SIZE)):
+            changed.append(page)
+    return changed, contents
+
+# write the image bytes marked present within the given pages, one W command per run of them
+def text_write (ser, image, present, pages):
+    for page in pages:
+        a = page
+        while a < page + EEPROM_PAGE_SIZE:
+            if not present[a]:
+                a += 1
+                continue
+            run = a
+            while a < page + EEPROM_PAGE_SIZE and present[a]:
+                a += 1
+            cmd = "W %04x %s" % (run, " ".join("%02x" % d for d in image[run:a]))
+            if verbose:
+                print(cmd)
+            eep_command(ser, cmd)
+
+# write only the pages of a hex file that differ from the EEPROM, then verify them
+def update_eeprom (port, input_filename, relocate):
+    image, present = load_image(input_filename, relocate)
+    pages = [p for p in range(0, EEPROM_SIZE, EEPROM_PAGE_SIZE) if any(present[p:p + EEPROM_PAGE_SIZE])]
+    with serial.Serial(port, 115200, timeout=2) as ser:
+        if not echo_check(ser):
+            return False
+        if not version_check(ser):
+            return False
+        eep_command(ser, "WS") # clear the firmware's write statistics
+        link = binary_start(ser)
+        start = time.monotonic()
+        changed, _ = changed_pages(ser, link, image, present, pages)
+        compared = time.monotonic()
+        # normally each changed page goes in one write cycle
+        if link is not None:
+            binary_write(link, image, present, changed)
+        else:
+            text_write(ser, image, present, changed)
+        written = sum(sum(present[p:p + EEPROM_PAGE_SIZE]) for p in changed)
+        written_time = time.monotonic() - compared
+        changed_now, _ = changed_pages(ser, link, image, present, changed)
+        if link is not None:
+            binary_end(ser, link)
+        stats = eep_command(ser, "WS")
+        finish = time.monotonic()
+    skipped = sum(present) - written
+    page_s = written_time / len(changed) if len(changed) > 0 else PAGE_WRITE_S
+    print("Compared %d pages in %.1fs: %d changed, %d unchanged" % (len(pages), compared - start, len(changed), len(pages) - len(changed)))
+    print("Skipped %d bytes, wrote %d bytes in %.1fs (%s)" % (skipped, written, written_time, stats[0] if len(stats) > 0 else "no statistics"))
+    print("Total %.1fs, about %.1fs saved over writing every page" % (finish - start, (len(pages) - len(changed)) * page_s - (compared - start)))
+    if len(changed_now) > 0:
+        print("Verify FAILED at pages %s" % " ".join("%04x" % (p + relocate) for p in changed_now))
+        return False
+    print("Verify OK")
+    return True
+
+# compare a hex file with the EEPROM, listing the bytes that differ - returns True if they all match
+def compare_eeprom (port, input_filename, relocate):
+    image, present = load_image(input_filename, relocate)
+    pages = [p for p in range(0, EEPROM_SIZE, EEPROM_PAGE_SIZE) if any(present[p:p + EEPROM_PAGE_SIZE])]
+    with serial.Serial(port, 115200, timeout=2) as ser:
+        if not echo_check(ser):
+            return False
+        if not version_check(ser):
+            return False
+        link = binary_start(ser)
+        start = time.monotonic()
+        changed, contents = changed_pages(ser, link, image, present, pages)
+        if link is not None:
+            binary_end(ser, link)
+        finish = time.monotonic()
+    differences = []
+    for page in changed:
+        for a in range(page, page + EEPROM_PAGE_SIZE):
+            if present[a] and contents[page][a - page] != image[a]:
+                differences.append(a)
+    print("Compared %d pages in %.1fs: %d matched by CRC, %d read back" % (len(pages), finish - start, len(pages) - len(contents), len(contents)))
+    for a in differences[:MAX_DIFFERENCES]:
+        page = a - a % EEPROM_PAGE_SIZE
+        print("%04x: EEPROM %02x, file %02x" % (a + relocate, contents[page][a - page], image[a]))
+    if len(differences) > MAX_DIFFERENCES:
+        print("... and %d more" % (len(differences) - MAX_DIFFERENCES))
+    if len(differences) > 0:
+        print("MISMATCH: %d of %d bytes differ" % (len(differences), sum(present)))
+        return False
+    print("Match: %d bytes" % sum(present))
+    return True
+
 def main ():
-    global verbose
+    global verbose, text_only
     parser = argparse.ArgumentParser(description='EEP EEPROM Programmer Client')
     parser.add_argument('command', type=str, help='EEP command: READ|WRITE|COMPARE')
     parser.add_argument('filename', type=str, help='file to read, write, or compare')
     parser.add_argument('-p', '--port', type=str, default="COM15", help='serial port of programmer')
     parser.add_argument('-r', '--relocate', type=int, default=0x8000, help='address offset to apply')
+    parser.add_argument('-i', '--incremental', action="store_true", help='WRITE only the pages that differ from the EEPROM, then verify them')
+    parser.add_argument('-t', '--text', action="store_true", help='use text commands only, not binary transfers')
     parser.add_argument('-v', '--verbose', action="store_true", help='display extra runtime info')
     args = parser.parse_args()
     verbose = args.verbose
+    text_only = args.text
     relocate = args.relocate
     filename = args.filename
     port = args.port
@@ -86,6 +365,7 @@ def main ():
         print("Connecting to EEPROM programmer on port %s" % port)
         print("Relocation offset = 0x%04x" % relocate)
 
+    ok = True
     cmd = args.command.upper()
     if cmd in ["R", "READ"]:  # read contents of EEPROM and store in hex file
         print(f"Read EEPROM into {filename}")
@@ -93,14 +373,20 @@ def main ():
 
     elif cmd in ["W", "WRITE"]:  # write EEPROM with contents of hex file
         print(f"Write {filename} to EEPROM")
-        write_eeprom(port, filename, relocate)
+        if args.incremental:
+            ok = update_eeprom(port, filename, relocate)
+        else:
+            write_eeprom(port, filename, relocate)
 
     elif cmd in ["C", "COMPARE"]:  # compare EEPROM contents with that of a hex file
         print(f"Compare {filename} to EEPROM")
+        ok = compare_eeprom(port, filename, relocate)
 
     else:
         print(f"Unrecognized command {cmd}")
+        ok = False
     print("Exiting")
+    sys.exit(0 if ok else 1)
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,14 @@
 # eep.circuitpy.py
 # 28C256 (and others) EEPROM programmer for Adafruit M4 Grand Central
-# Copy to root of M4 Grand Central "CIRCUITPY" drive with filename code.py
+# Copy to root of M4 Grand Central "CIRCUITPY" drive with filename code.py, along with ../../circuit_python/cupboard_bus.py
+# and ../../circuit_python/cupboard_link.py
 
 import board
 import digitalio
 import time
 import supervisor
+import cupboard_bus
+import cupboard_link
 
 # global data
 dump_prev_addr     = 0x0000  # track previously dumped address...
@@ -13,6 +16,16 @@ dump_prev_count    = 16      # ...and width
 write_prev_address = 0x0000  # track previously written address
 output_width       = 16      # number of bytes to display per line of dumped memory
 force_hex          = True    # only expect hexadecimal numbers in fields; otherwise assume decimal and use 'x', 'o', or '%' prefix or hex, octal, or binary
+bus_backend        = cupboard_bus.BACKEND_PORT  # PORT = bulk port-register bus access, PIN = per-pin digitalio access
+page_write         = True    # W, WN and F load up to a page of bytes per write cycle; off = one write cycle per byte
+write_skipped      = 0       # write statistics since the last WS: bytes already correct and not written...
+write_written      = 0       # ...bytes written...
+write_cycles       = 0       # ...and write cycles used
+
+# 28C256 write timing
+EEPROM_SIZE = 0x8000         # 28C256, 32K bytes
+EEPROM_PAGE_SIZE = 64        # bytes sharing A6-A14 are loaded together and written in one write cycle
+WRITE_TIMEOUT_NS = 11000000  # experiments show ~6.4ms, datasheet claims under 10ms, timeout at 11ms
 
 # on-board red LED
 led = digitalio.DigitalInOut(board.LED)
@@ -20,41 +33,28 @@ led.direction = digitalio.Direction.OUTPUT
 
 # assigned GPIO pins for CPU interface
 # IMPORTANT: All pins are connected the EEPROM via a 3v3-5v level translator
-pins_addr = [digitalio.DigitalInOut(i) for i in [board.D30, board.D31, board.D32, board.D33, board.D34, board.D35, board.D36, board.D37, board.D38, board.D39, board.D40, board.D41, board.D42, board.D43, board.D44]]
-pins_data = [digitalio.DigitalInOut(i) for i in [board.D22, board.D23, board.D24, board.D25, board.D26, board.D27, board.D28, board.D29]]
+bus = cupboard_bus.open_bus([board.D30, board.D31, board.D32, board.D33, board.D34, board.D35, board.D36, board.D37, board.D38, board.D39, board.D40, board.D41, board.D42, board.D43, board.D44],
+                           [board.D22, board.D23, board.D24, board.D25, board.D26, board.D27, board.D28, board.D29],
+                           bus_backend, addr_output=True)
+pins_addr = bus.pins_addr
+pins_data = bus.pins_data
 pin_we    = digitalio.DigitalInOut(board.D45)
 pin_oe    = digitalio.DigitalInOut(board.D46)
 pin_ce    = digitalio.DigitalInOut(board.D47)
 
 # setup all pins to their default state (ready to read)
 def reset_all_pins ():
-    for p in pins_data:
-        p.switch_to_input(None)     # initially output from EEPROM = input to Grand Central, no pull; will switch when need to write data to the EEPROM
-    for p in pins_addr:
-        p.switch_to_output(False)   # output from Grand Central = input to EEPROM
+    bus.reset_all_pins()            # data initially output from EEPROM = input to Grand Central, no pull; address = output from Grand Central = input to EEPROM
     pin_we.switch_to_output(True)   # output from Grand Central = input to EEPROM
     pin_oe.switch_to_output(True)   # output from Grand Central = input to EEPROM
     pin_ce.switch_to_output(False)  # output from Grand Central = input to EEPROM
 
-# set address pins
-def set_eeprom_address_pins (address):
-    global pins_addr    
-    for p in pins_addr:
-        p.value = address & 0x01
-        address >>= 1
-
-# set data pins
-def set_eeprom_data_pins (data):
-    global pins_data
-    for p in pins_data:
-        p.switch_to_output(data & 0x01)
-        data >>= 1
-
-# after a write to the data bus, reset the pins to inputs
-def reset_data_pin_dir ():
-    global pins_data
-    for p in pins_data:
-        p.switch_to_input()
+# bus access goes through the selected backend (see cupboard_bus.py)
+set_eeprom_address_pins = bus.write_addr_bus  # set address pins
+step_eeprom_address     = bus.step_addr_bus   # set the next address of a run (PIN: writes only the pins that change)
+set_eeprom_data_pins    = bus.write_data_bus  # set data pins (switches them to outputs)
+reset_data_pin_dir      = bus.reset_data_bus  # after a write to the data bus, reset the pins to inputs
+read_eeprom_data_bus    = bus.read_data_bus   # read the data bus pins and return the byte value
 
 # set all pins to outputs and write values
 def set_all_pins (address, data, oe, we):
@@ -64,17 +64,6 @@ def set_all_pins (address, data, oe, we):
     pin_oe.value = oe
     pin_we.value = we
 
-# read the data bus pins and return the byte value
-def read_eeprom_data_bus ():
-    global pins_data
-    data = 0
-    val = 0x01
-    for p in pins_data:
-        if (p.value):
-            data += val
-        val <<= 1
-    return data
-
 # read a byte from the EEPROM
 def read_eeprom_byte (address):
     global pin_oe
@@ -84,24 +73,112 @@ def read_eeprom_byte (address):
     pin_oe.value = True
     return data
 
+# read len(buffer) bytes from address into buffer (a bytearray or memoryview) in one burst: OE stays low for the
+# whole range, and with the PIN backend each step writes only the address pins that change, about two per byte
+def read_eeprom_range (address, buffer):
+    step = step_eeprom_address
+    read = read_eeprom_data_bus
+    step(address)
+    pin_oe.value = False
+    for i in range(len(buffer)):
+        step(address + i)
+        buffer[i] = read()
+    pin_oe.value = True
+
+# one page read back, for checking and CRCs
+page_buffer = bytearray(EEPROM_PAGE_SIZE)
+
+# CRC-32 of count bytes from address (the zlib/binascii CRC), read a page at a time
+def crc_eeprom_range (address, count):
+    buffer = page_buffer
+    crc = 0
+    end = address + count
+    while address < end:
+        n = min(EEPROM_PAGE_SIZE, end - address)
+        view = memoryview(buffer)[:n]
+        read_eeprom_range(address, view)
+        crc = cupboard_link.crc32(view, crc)
+        address += n
+    return crc
+
+# poll the last byte written until it reads back (DATA polling: bit 7 reads complemented until the write cycle
+# is done) or timeout (e.g., when SDP is enabled) - returns True if write confirmed
+def wait_eeprom_write (address, data):
+    set_eeprom_address_pins(address)
+    start_ns = time.monotonic_ns()
+    while True:
+        pin_oe.value = False
+        check = read_eeprom_data_bus()
+        pin_oe.value = True
+        if check == data:
+            return True
+        # always poll once after the timeout, in case something held us up for all of it
+        if time.monotonic_ns() - start_ns >= WRITE_TIMEOUT_NS:
+            return False
+
 # write a byte to EEPROM - returns True if write confirmed or False if write failed
 def write_eeprom_byte (address, data):
-    global pin_we
+    global pin_we, write_cycles
+    write_cycles += 1
     set_eeprom_address_pins(address)
     pin_we.value = False
     set_eeprom_data_pins(data)
     pin_we.value = True
     reset_data_pin_dir()
-    # poll data until matches write or timeout (e.g., when SDP is enabled)
-    # experiments show ~6.4ms, datasheet claims under 10ms, timeout at 11ms
-    matched = False
-    start_ns = time.monotonic_ns()
-    while not matched and (time.monotonic_ns() - start_ns) < 11000000:
-        pin_oe.value = False
-        check = read_eeprom_data_bus()
-        pin_oe.value = True
-        matched = (check == data)
-    return matched
+    return wait_eeprom_write(address, data)
+
+# write bytes within one EEPROM page in a single write cycle - returns the number of bytes that failed
+def write_eeprom_page (address, data, retry=True):
+    global write_cycles
+    write_cycles += 1
+    set_address = step_eeprom_address
+    drive_data = bus.drive_data_bus
+    we = pin_we
+    # load the bytes back to back: each must follow the last within tBLC (150us) or the write cycle starts early
+    for i in range(len(data)):
+        set_address(address + i)
+        we.value = False
+        drive_data(data[i])
+        we.value = True
+    bus.release_data_bus()
+    wait_eeprom_write(address + len(data) - 1, data[-1])
+    # verify the page. A pause in loading (e.g. garbage collection) starts the write cycle early and the chip ignores
+    # the loads after it, so reload those as a page once; after that fall back to byte writes.
+    check = memoryview(page_buffer)[:len(data)]
+    read_eeprom_range(address, check)
+    missed = [i for i in range(len(data)) if check[i] != data[i]]
+    if retry and len(missed) > 1:
+        return write_eeprom_page(address + missed[0], data[missed[0]:], False)
+    failed = 0
+    for i in missed:
+        if not write_eeprom_byte(address + i, data[i]):
+            failed += 1
+    return failed
+
+# write a block of bytes, a page at a time in page-write mode - returns the number of bytes that failed
+# A page that already holds the data is skipped, and in byte mode so is each byte that is already correct: a read
+# costs far less than a write cycle and doesn't wear the chip.
+def write_eeprom_block (address, data):
+    global write_skipped, write_written
+    failed = 0
+    i = 0
+    while i < len(data):
+        count = min(EEPROM_PAGE_SIZE - (address + i) % EEPROM_PAGE_SIZE, len(data) - i)
+        check = memoryview(page_buffer)[:count]
+        read_eeprom_range(address + i, check)
+        changed = [i + j for j in range(count) if check[j] != data[i + j]]
+        if page_write and len(changed) > 1:
+            failed += write_eeprom_page(address + i, data[i:i + count])
+            written = count
+        else:
+            for j in changed:
+                if not write_eeprom_byte(address + j, data[j]):
+                    failed += 1
+            written = len(changed)
+        write_written += written
+        write_skipped += count - written
+        i += count
+    return failed
 
 # fast write an SDP byte, NOT A NORMAL WRITE CYCLE, expects port direction already set
 def write_eeprom_sdp (address, data):
@@ -113,9 +190,8 @@ def write_eeprom_sdp (address, data):
 
 # send SDP lock sequence
 def lock_eeprom ():
-    global pin_ce, pins_data
-    for p in pins_data:
-        p.switch_to_output(0)
+    global pin_ce
+    set_eeprom_data_pins(0)
     write_eeprom_sdp(0x5555, 0xaa)
     write_eeprom_sdp(0x2aaa, 0x55)
     write_eeprom_sdp(0x5555, 0xa0)
@@ -126,9 +202,8 @@ def lock_eeprom ():
 
 # send SDP unlock sequence
 def unlock_eeprom ():
-    global pin_ce, pins_data
-    for p in pins_data:
-        p.switch_to_output(0)
+    global pin_ce
+    set_eeprom_data_pins(0)
     write_eeprom_sdp(0x5555, 0xaa)
     write_eeprom_sdp(0x2aaa, 0x55)
     write_eeprom_sdp(0x5555, 0x80)
@@ -140,27 +215,61 @@ def unlock_eeprom ():
     time.sleep(0.001)
     pin_ce.value = False
 
-# dump a range of addresses from EEPROM
+# dump a range of addresses from EEPROM, a line at a time: each line is read in one burst and its text built in a
+# preallocated buffer, then printed at once
+HEX_DIGITS = b"0123456789abcdef"
+dump_data = bytearray(16)
+dump_text = bytearray(16 * 3 + 2)
 def dump_memory (start_address, num_bytes):
-    global output_width
-    num_cols = 0
+    global output_width, dump_data, dump_text
+    width = max(output_width, 1)
+    if len(dump_data) < width:
+        dump_data = bytearray(width)
+        dump_text = bytearray(width * 3 + width // 8)
+    end = start_address + num_bytes
+    line = start_address
+    while line < end:
+        count = min(width, end - line)
+        data = memoryview(dump_data)[:count]
+        read_eeprom_range(line, data)
+        text = dump_text
+        n = 0
+        for i in range(count):
+            v = data[i]
+            text[n] = HEX_DIGITS[v >> 4]
+            text[n + 1] = HEX_DIGITS[v & 0x0f]
+            text[n + 2] = 0x20
+            n += 3
+            if (i + 1) % 8 == 0 and i + 1 < width:
+                text[n] = 0x20
+                n += 1
+        print("%04x: %s" % (line, str(text[:n], 'ascii')))
+        line += count
+
+# time a read of a range: the burst path and the old byte-at-a-time path (address written in full, OE pulsed)
+def read_benchmark (start_address, num_bytes):
+    buffer = bytearray(cupboard_link.LINK_BLOCK)
+    start_ns = time.monotonic_ns()
+    for a in range(start_address, start_address + num_bytes, len(buffer)):
+        read_eeprom_range(a, memoryview(buffer)[:min(len(buffer), start_address + num_bytes - a)])
+    burst_ns = time.monotonic_ns() - start_ns
+    start_ns = time.monotonic_ns()
     for a in range(start_address, start_address + num_bytes):
-        if num_cols == 0:
-            print("%04x: " % a, end='')
-        print("%02x " % read_eeprom_byte(a), end='')
-        num_cols += 1
-        if num_cols >= output_width:
-            num_cols = 0
-            print()
-        elif num_cols % 8 == 0:
-            print(" ", end='')
-    if num_cols > 0:
-        print()
-
-# fill a memory range with a fixed byte
+        read_eeprom_byte(a)
+    byte_ns = time.monotonic_ns() - start_ns
+    print("Read %d bytes: burst %d ms (%.1f KB/s), byte by byte %d ms (%.1f KB/s)" % (num_bytes,
+          burst_ns // 1000000, num_bytes * 1000000000 / 1024 / max(burst_ns, 1),
+          byte_ns // 1000000, num_bytes * 1000000000 / 1024 / max(byte_ns, 1)))
+
+# fill a memory range with a fixed byte, up to a page per write
 def fill_memory (start_address, num_bytes, data):
-    for a in range(start_address, start_address + num_bytes):
-        write_eeprom_byte(a, data)
+    page = bytearray([data & 0xff]) * EEPROM_PAGE_SIZE
+    a = start_address
+    end = start_address + num_bytes
+    while a < end:
+        count = min(EEPROM_PAGE_SIZE - a % EEPROM_PAGE_SIZE, end - a)
+        write_eeprom_block(a, page[:count])
+        a += count
 
 # interpret a number from the fields of user input
 def convert_user_number (field_text):
@@ -186,6 +295,29 @@ def convert_user_number (field_text):
         print("FIELD ERROR")
         return 0
 
+# answer a binary read or write request (see cupboard_link.py)
+def binary_request (kind, payload):
+    address = payload[0] | (payload[1] << 8)
+    if kind == cupboard_link.LINK_READ:
+        count = min(payload[2] | (payload[3] << 8), cupboard_link.LINK_BLOCK)
+        data = bytearray(2 + count)
+        data[0] = payload[0]
+        data[1] = payload[1]
+        read_eeprom_range(address, memoryview(data)[2:])
+        return (cupboard_link.LINK_DATA, data)
+    if kind == cupboard_link.LINK_CRC:
+        count = payload[2] | (payload[3] << 8)
+        size = max(payload[4] | (payload[5] << 8), 1)
+        data = bytearray()
+        for a in range(address, address + min(count, size * cupboard_link.LINK_BLOCK // 4), size):
+            crc = crc_eeprom_range(a, min(size, address + count - a))
+            data += bytes([crc & 0xff, (crc >> 8) & 0xff, (crc >> 16) & 0xff, crc >> 24])
+        return (cupboard_link.LINK_CRC, data)
+    if kind == cupboard_link.LINK_WRITE:
+        failed = write_eeprom_block(address, payload[2:])
+        return (cupboard_link.LINK_ACK, bytes([failed & 0xff, failed >> 8]))
+    return (cupboard_link.LINK_NAK, b'')
+
 def print_version ():
     print("EEP Grand Central v0.1")
 
@@ -193,6 +325,8 @@ def show_help ():
     print_version()
     print("  ?            - Help, show this information")
     print("  .            - Echo request, expects '.' and return to 'EEP:' prompt")
+    print("  CRC addr len P? - CRC-32 of a range, or with P of each 64-byte page in it")
+    print("  BIN          - Binary mode for eep_client.py: CRC-checked read/write frames until an end frame")
     print("  D addr? len? - Dump EEPROM contents, repeats last parameters if none given")
     print("  DN           - Dump Next contents, increments previous addr by previous count")
     print("  F addr len n - Fill EEPROM with a fixed byte")
@@ -201,15 +335,37 @@ def show_help ():
     print("  OW count     - Output Width, number of bytes per dumped line")
     print("  U            - Unlock EEPROM via SDP-disable")
     print("  V            - Version, report software version")
-    print("  W addr data+ - Write one+ bytes to EEPROM")
+    print("  W addr data+ - Write one+ bytes to EEPROM, skipping pages (or bytes) already correct")
     print("  WN data+     - Write one+ bytes to EEPROM at next address")
+    print("  WS           - Write Statistics: bytes skipped, bytes written, write cycles since last WS")
     print("  PT a d oe we - Pin Test (testing function, not normally used)")
+    print("  PW ON|OFF    - Page Write mode on or off, report state if no parameter")
+    print("  RT addr? len? - Read Time of a range (default the whole chip), burst against byte by byte")
 
 def handle_command (cmd, args):
-    global dump_prev_addr, dump_prev_count, write_prev_address, output_width, pin_oe, force_hex
+    global dump_prev_addr, dump_prev_count, write_prev_address, output_width, pin_oe, force_hex, page_write
+    global write_skipped, write_written, write_cycles
     num_args = len(args)
 
-    if cmd == 'D': # Dump memory [addr]? [count]?
+    if cmd == 'BIN': # Binary transfers (see cupboard_link.py)
+        print("BIN %d %d %d" % (cupboard_link.LINK_VERSION, cupboard_link.LINK_WINDOW, cupboard_link.LINK_BLOCK))
+        cupboard_link.serve(binary_request)
+
+    elif cmd == 'CRC': # CRC-32 [addr] [count] [P]?
+        if num_args == 2:
+            address = convert_user_number(args[0])
+            count = convert_user_number(args[1])
+            print("CRC %04x %04x: %08x" % (address, count, crc_eeprom_range(address, count)))
+        elif num_args == 3 and args[2] == 'P':
+            address = convert_user_number(args[0])
+            end = address + convert_user_number(args[1])
+            for line in range(address, end, EEPROM_PAGE_SIZE * 8):
+                crcs = [crc_eeprom_range(a, min(EEPROM_PAGE_SIZE, end - a)) for a in range(line, min(line + EEPROM_PAGE_SIZE * 8, end), EEPROM_PAGE_SIZE)]
+                print("%04x: %s" % (line, " ".join("%08x" % c for c in crcs)))
+        else:
+            print("CRC requires an address and a length, and P for page CRCs")
+
+    elif cmd == 'D': # Dump memory [addr]? [count]?
         if num_args == 1:  # use new address and previous count
             dump_prev_addr = convert_user_number(args[0])
         elif num_args == 2:  # use new address and count
@@ -275,6 +431,27 @@ def handle_command (cmd, args):
         else:
             print("PT requires four arguments")
 
+    elif cmd == 'PW': # Page Write mode on or off, report state if no parameter
+        if num_args == 0:
+            print("Page write:", "Enabled" if page_write else "Disabled")
+        elif num_args == 1:
+            if args[0] == 'ON':
+                page_write = True
+            elif args[0] == 'OFF':
+                page_write = False
+            else:
+                print("Page write recognizes ON or OFF")
+        else:
+            print("Page write takes up to one field")
+
+    elif cmd == 'RT': # Read Time [addr]? [count]?
+        if num_args <= 2:
+            address = convert_user_number(args[0]) if num_args > 0 else 0
+            count = convert_user_number(args[1]) if num_args > 1 else EEPROM_SIZE - address
+            read_benchmark(address, count)
+        else:
+            print("RT takes up to two fields")
+
     elif cmd == 'U': # Unlock
         print("Unlocking EEPROM via SDP-disable")
         unlock_eeprom()
@@ -284,19 +461,24 @@ def handle_command (cmd, args):
             print("W requires at least two arguments")
         else:
             write_prev_address = convert_user_number(args[0])
-            for v in args[1:]:
-                write_eeprom_byte(write_prev_address, convert_user_number(v))
-                write_prev_address += 1
-            write_prev_address -= 1
+            data = bytearray([convert_user_number(v) & 0xff for v in args[1:]])
+            write_eeprom_block(write_prev_address, data)
+            write_prev_address += len(data) - 1
 
     elif cmd == 'WN': # Write Next memory
         if num_args < 1:
             print("WN requires one argument")
         else:
-            for v in args:
-                write_prev_address += 1
-                write_eeprom_byte(write_prev_address, convert_user_number(v))
-    
+            data = bytearray([convert_user_number(v) & 0xff for v in args])
+            write_eeprom_block(write_prev_address + 1, data)
+            write_prev_address += len(data)
+
+    elif cmd == 'WS': # Write Statistics
+        print("Skipped %d bytes, wrote %d bytes in %d write cycles" % (write_skipped, write_written, write_cycles))
+        write_skipped = 0
+        write_written = 0
+        write_cycles = 0
+
     elif cmd == 'V': # Version
         print_version()
 